@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Compact binary log records
+
+Each record is length-prefixed and has a fixed field layout (network byte order):
+- H     : Length of the remainder of the record in bytes
+- B B B : Endpoint code, app code (generators only, else 0), intrusion code (0 for none)
+- H     : App suffix (generators only; "uniform_1" -> 1, 0 for none)
+- B s   : VIN length, VIN
+- Body depending on the endpoint:
+	data:         d       generated
+	colour:       h h BBB x, y, r, g, b
+	country-code: h h     x, y
+	poi:          h h B   x, y, POI type code
+	tsp:          h h h h x, y, targ_x, targ_y
+
+Codes are the one-based index into the respective interned list below.
+The web API decodes this format (webapp/binary_records.py) - keep in sync!
+"""
+
+import struct
+
+
+# Interned values
+ENDPOINTS = ["log/data", "log/colour", "get/country-code", "get/poi", "get/tsp"]
+GENERATORS = ["GAUSSIAN", "GUMBEL", "LAPLACE", "LOGISTIC", "PARETO", "RAYLEIGH",
+	"UNIFORM", "VONMISES", "WALD", "WEIBULL"]
+INTRUSIONS = ["normal", "off-value", "huge-error", "red", "jump", "illegaltype", "routetoself"]
+POI_TYPES = ["restaurant", "gas station", "private home", "nsa hq"]
+
+CONTENT_TYPE = "application/octet-stream"
+
+_DATA_ENDPOINT = "log/data"
+_DATA_PREFIX = _DATA_ENDPOINT + "/"
+
+_LENGTH = struct.Struct("!H")
+_HEADER = struct.Struct("!BBBH")
+_VIN_LENGTH = struct.Struct("!B")
+
+# Endpoint : (body struct, body field names)
+_BODIES = {
+	"log/data" : (struct.Struct("!d"), ["generated"]),
+	"log/colour" : (struct.Struct("!hhBBB"), ["x", "y", "r", "g", "b"]),
+	"get/country-code" : (struct.Struct("!hh"), ["x", "y"]),
+	"get/poi" : (struct.Struct("!hhB"), ["x", "y", "type"]),
+	"get/tsp" : (struct.Struct("!hhhh"), ["x", "y", "targ_x", "targ_y"])
+}
+
+
+def encode_record(endpoint, params):
+	"""
+	Encode the given request params for the given endpoint (e.g. "log/data/uniform_1") as a record.
+	raises: ValueError if the request can't be represented (e.g. an unknown generator).
+	"""
+
+	endpoint = endpoint.strip("/")
+
+	app_code = 0
+	app_suffix = 0
+	if endpoint.startswith(_DATA_PREFIX):
+		generator = endpoint[len(_DATA_PREFIX):].upper()
+		endpoint = _DATA_ENDPOINT
+
+		name, _, suffix = generator.rpartition("_")
+		if name and suffix.isdigit():
+			generator = name
+			app_suffix = int(suffix)
+
+		app_code = _code(GENERATORS, generator, "generator")
+
+	endpoint_code = _code(ENDPOINTS, endpoint, "endpoint")
+
+	intrusion_code = 0
+	if params.get("intrusion"):
+		intrusion_code = _code(INTRUSIONS, params["intrusion"], "intrusion")
+
+	vin = str(params["vin"])
+	if len(vin) > 255:
+		raise ValueError("VIN is too long: {}".format(vin))
+
+	body_values = dict(params)
+	if endpoint == _DATA_ENDPOINT:
+		body_values["generated"] = float(params["generated"])
+	elif endpoint == "log/colour":
+		body_values["r"], body_values["g"], body_values["b"] = params["colour"].split(",")
+	elif endpoint == "get/poi":
+		body_values["type"] = _code(POI_TYPES, params["type"], "POI type")
+
+	body_struct, field_names = _BODIES[endpoint]
+	try:
+		body = body_struct.pack(*[_to_body_value(body_values[n], n) for n in field_names])
+	except (KeyError, struct.error) as error:
+		raise ValueError("Can't encode request for {}: {}".format(endpoint, error))
+
+	record = (_HEADER.pack(endpoint_code, app_code, intrusion_code, app_suffix)
+		+ _VIN_LENGTH.pack(len(vin)) + vin + body)
+
+	return _LENGTH.pack(len(record)) + record
+
+
+def _code(interned_values, value, name):
+	""" Return the one-based code of the given value. """
+
+	try:
+		return interned_values.index(value) + 1
+	except ValueError:
+		raise ValueError("Can't encode {}: {}".format(name, value))
+
+
+def _to_body_value(value, field_name):
+	""" Convert the given value to the type used in the body. Only the generated value is a float. """
+
+	if field_name == "generated":
+		return value
+
+	int_value = int(value)
+	if int_value != float(value):
+		raise ValueError("Can't encode non-integer {}: {}".format(field_name, value))
+
+	return int_value
@@ -5,6 +5,7 @@ import argparse
 import os
 import random
 import sys
+import threading
 import time
 
 import requests
@@ -14,6 +15,7 @@ from turtlesim.msg import Pose, Color
 from turtlesim_expl.msg import GenValue
 
 # pylint: disable-msg=C0411; (Standard import should be above - I don't consider it "standard")
+import binary_records
 from pipes.pose_pipe import PosePipe
 from pipes.pose_processor import PoseProcessor, CC_STR, POI_STR, TSP_STR
 
@@ -53,8 +55,21 @@ class Logger(object):
 		}
 		self._last_conn_err = 0
 
+		# The API answers with 503 and Retry-After when overloaded - nothing is sent until then
+		self._retry_at = 0
+		self._dropped_count = 0
+		self._last_overload_warn = 0
+
 		self._rand_gen = random.Random()
 
+		# Compact binary records, sent in batches of the given size or once the oldest is max_age old
+		self._binary = args.binary
+		self._binary_batch_size = args.binary_batch
+		self._binary_max_age = args.binary_max_age
+		self._binary_buffer = []
+		self._binary_since = None
+		self._binary_lock = threading.Lock()
+
 		rospy.init_node("logger", anonymous=True)
 
 		# Subscribe to topics
@@ -68,17 +83,21 @@ class Logger(object):
 			{"method" : self.log_pose, "rate" : 0.1})
 
 		rospy.loginfo("Logger initialised in NS {}".format(args.namespace))
-		rospy.loginfo("Options (Label | {}), (Intrusion | {})"
-			.format("yes" if args.label else "no", args.intrusion))
+		rospy.loginfo("Options (Label | {}), (Intrusion | {}), (Binary | {})"
+			.format("yes" if args.label else "no", args.intrusion,
+				"batches of {}".format(args.binary_batch) if args.binary else "no"))
 
-		# Block until shut down and check for stop file every ten seconds
+		# Block until shut down - check for the stop file and send binary records that waited too long
 		while not rospy.is_shutdown():
 			if os.path.lexists(STOP_FILE_PATH):
 				rospy.logerr("!!! STOP FILE DETECTED !!! KILLED !!!")
 				break
 
+			self._flush_binary_if_old()
 			rospy.sleep(.1)
 
+		self.flush_binary()
+
 
 	def log_generated_data(self, gen_value, generator_name):
 		""" Log generated data value. """
@@ -180,14 +199,100 @@ class Logger(object):
 			if Logger._INTRUSION_FIELD not in request:
 				raise KeyError("Missing intrusion key necessary for labelling.")
 
+		endpoint = path + "/" + log_method
+
+		if self._binary:
+			try:
+				record = binary_records.encode_record(endpoint, request)
+			except ValueError:
+				# Not representable in the binary format - fall back to a form-encoded request
+				record = None
+
+			if record is not None:
+				self._send_binary(record)
+				return
+
+		self._post(endpoint, request)
+
+
+	def _send_binary(self, record):
+		""" Buffer the given binary record and send the buffer once the batch is complete. """
+
+		with self._binary_lock:
+			if not self._binary_buffer:
+				self._binary_since = time.time()
+
+			self._binary_buffer.append(record)
+			if len(self._binary_buffer) < self._binary_batch_size:
+				return
+
+		self.flush_binary()
+
+
+	def _flush_binary_if_old(self):
+		""" Send the buffered binary records if the oldest one is older than the maximum age. """
+
+		with self._binary_lock:
+			is_old = self._binary_buffer and time.time() >= self._binary_since + self._binary_max_age
+
+		if is_old:
+			self.flush_binary()
+
+
+	def flush_binary(self):
+		""" Send all buffered binary records. """
+
+		with self._binary_lock:
+			payload = "".join(self._binary_buffer)
+			record_count = len(self._binary_buffer)
+			self._binary_buffer = []
+			self._binary_since = None
+
+		if payload:
+			self._post("log/binary", payload, headers={"Content-Type" : binary_records.CONTENT_TYPE},
+				record_count=record_count)
+
+
+	def _post(self, endpoint, data, headers=None, record_count=1):
+		"""
+		Post the given data to the given endpoint of the logging API.
+		*record_count: Number of records in the data, counted as dropped if it isn't accepted.
+		"""
+
+		time_now = time.time()
+		if time_now < self._retry_at:
+			self._dropped_count += record_count
+			return
+
 		try:
-			requests.post(Logger.URL + "/" + path + "/" + log_method, request)
+			response = requests.post(Logger.URL + "/" + endpoint, data, headers=headers)
 		except requests.ConnectionError:
-			time_now = time.time()
 			# Only print an error every ten seconds
 			if time_now > self._last_conn_err + 10:
 				rospy.logerr("Can't connect to logging API")
 				self._last_conn_err = time_now
+			return
+
+		if response.status_code == 503:
+			self._handle_overload(response, time_now, record_count)
+
+
+	def _handle_overload(self, response, time_now, record_count):
+		""" Stop sending for the time requested by the API's Retry-After header. """
+
+		try:
+			retry_after = float(response.headers.get("Retry-After", 1))
+		except ValueError:
+			retry_after = 1
+
+		self._retry_at = time_now + retry_after
+		self._dropped_count += record_count
+
+		# Only print a warning every ten seconds
+		if time_now > self._last_overload_warn + 10:
+			rospy.logwarn("Logging API is overloaded - pausing for {} s ({} records dropped so far)"
+				.format(retry_after, self._dropped_count))
+			self._last_overload_warn = time_now
 
 
 	def copy_base_request(self):
@@ -203,6 +308,12 @@ if __name__ == "__main__":
 	PARSER.add_argument("--gen-topics", metavar="TOPIC", nargs="*", default=[], dest="gen_topics")
 	PARSER.add_argument("--label", action="store_true", help="Label the data with intrusion type")
 	PARSER.add_argument("--intrusion", "-i", choices=PoseProcessor.POSSIBLE_INTRUSION_LEVELS)
+	PARSER.add_argument("--binary", action="store_true",
+		help="Send compact binary records instead of form-encoded requests")
+	PARSER.add_argument("--binary-batch", type=int, default=1, metavar="N",
+		help="Number of binary records to send per request")
+	PARSER.add_argument("--binary-max-age", type=float, default=1, metavar="S",
+		help="Send buffered binary records once the oldest one is S seconds old")
 
 	# Pass filtered args to parser (remove remapping arguments and delete program name)
 	ARGS = PARSER.parse_args(rospy.myargv(sys.argv)[1:])
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+""" Micro benchmarks for the server's hot paths """
+
+import argparse
+import gc
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from log_entry import LogEntry
+import log_parser
+from state_dao import StateDao
+import util.outp
+
+
+def client_time_call(args):
+	""" Unpack the args and call _bench_client_time.
+	Expects 'max_vins' and 'requests'. """
+	_bench_client_time(args.max_vins, args.requests)
+
+
+def _bench_client_time(max_vins, request_count):
+	"""
+	Measure the per-request cost of the client time handling for growing numbers of VINs.
+	Simulates ShardCoordinator._advance_client_time: One get and one set per request on a random known VIN.
+	"""
+
+	vin_counts = []
+	vin_count = 10
+	while vin_count <= max_vins:
+		vin_counts.append(vin_count)
+		vin_count *= 10
+
+	table = [["VINs", "Requests", "Total (s)", "Per request (us)"]]
+
+	with _TempCwd():
+		dao = StateDao(verbose=False)
+		rand = random.Random(0)
+		time_now = time.time()
+
+		vins = []
+		for vin_count in vin_counts:
+			# Register the additional clients
+			for i in range(len(vins), vin_count):
+				vins.append("V{}".format(i))
+				dao.set_client_time(vins[-1], time_now + rand.randint(0, 3600))
+
+			requested_vins = [rand.choice(vins) for _ in range(0, request_count)]
+
+			time_before = time.time()
+			for vin in requested_vins:
+				client_time = dao.get_client_time(vin)
+				dao.set_client_time(vin, client_time + rand.randint(0, 10))
+				dao.get_current_min_time()
+			time_taken = time.time() - time_before
+
+			table.append([
+				"{:,}".format(vin_count),
+				"{:,}".format(request_count),
+				"{:.3f}".format(time_taken),
+				"{:.2f}".format(time_taken / request_count * 1000000)
+			])
+
+	util.outp.print_table(table, headline="Client time handling")
+
+
+def log_entry_call(args):
+	""" Unpack the args and call _bench_log_entry.
+	Expects 'entries'. """
+	_bench_log_entry(args.entries)
+
+
+def _bench_log_entry(entry_count):
+	""" Measure the memory per LogEntry and the throughput of creating, serialising and parsing them. """
+
+	rand = random.Random(0)
+	app_ids = ["COLOUR", "POI", "TSP_ROUTING", "COUNTRYCODE", "DATAGEN_A"]
+	time_now = int(time.time())
+
+	table = [["Operation", "Entries", "Total (s)", "Per entry (us)"]]
+
+	def add_row(name, time_taken):
+		table.append([name, "{:,}".format(entry_count), "{:.3f}".format(time_taken),
+			"{:.2f}".format(time_taken / entry_count * 1000000)])
+
+	gc.collect()
+	rss_before = _get_max_rss_bytes()
+
+	time_before = time.time()
+	log_entries = [LogEntry(vin="VIN{:05d}".format(i % 10000), app_id=rand.choice(app_ids), level=LogEntry.LEVEL_DEFAULT,
+		log_message="{},{},{}".format(i % 256, i % 128, i % 64), gps_position="{}.5,{}.25".format(i % 100, i % 50),
+		time_unix=time_now + i, intrusion="normal") for i in range(0, entry_count)]
+	add_row("Create", time.time() - time_before)
+
+	gc.collect()
+	bytes_per_entry = float(_get_max_rss_bytes() - rss_before) / entry_count
+
+	time_before = time.time()
+	log_strings = [e.get_log_string() for e in log_entries]
+	add_row("Serialise", time.time() - time_before)
+
+	time_before = time.time()
+	for log_string in log_strings:
+		LogEntry.from_log_string(log_string)
+	add_row("Parse", time.time() - time_before)
+
+	gc.collect()
+	rss_before = _get_max_rss_bytes()
+
+	time_before = time.time()
+	parsed_entries = list(log_parser.yield_entries(log_strings))
+	add_row("Parse (log_parser)", time.time() - time_before)
+
+	gc.collect()
+	parsed_bytes_per_entry = float(_get_max_rss_bytes() - rss_before) / entry_count
+	del parsed_entries
+
+	time_before = time.time()
+	for log_entry in log_entries:
+		log_entry.data[LogEntry.LOG_MESSAGE_FIELD]
+	add_row("Field access (data)", time.time() - time_before)
+
+	util.outp.print_table(table, headline="LogEntry")
+	print("Memory: ~{:,.0f} bytes per created entry, ~{:,.0f} bytes per parsed entry".format(
+		bytes_per_entry, parsed_bytes_per_entry))
+	print("(Growth of the maximum resident set size; 10,000 distinct VINs)")
+
+
+def parse_call(args):
+	""" Unpack the args and call _bench_parse.
+	Expects 'lines'. """
+	_bench_parse(args.lines)
+
+
+def _bench_parse(line_count):
+	""" Compare the lines per second of LogEntry.from_log_string and log_parser. """
+
+	rand = random.Random(0)
+	app_ids = ["COLOUR", "POI", "TSP_ROUTING", "COUNTRYCODE", "DATAGEN_A"]
+	time_now = int(time.time())
+
+	log_strings = [LogEntry(vin="VIN{:07d}".format(i), app_id=rand.choice(app_ids),
+		log_message="{},{},{}".format(i % 256, i % 128, i % 64), gps_position="{}.5,{}.25".format(i % 100, i % 50),
+		time_unix=time_now + i, intrusion="normal").get_log_string() for i in range(0, line_count)]
+
+	parsers = [
+		("LogEntry.from_log_string", lambda: [LogEntry.from_log_string(l) for l in log_strings]),
+		("log_parser", lambda: list(log_parser.yield_entries(log_strings))),
+		("log_parser: app_id, intrusion",
+			lambda: list(log_parser.yield_entries(log_strings, fields=[LogEntry.APP_ID_FIELD, "intrusion"])))
+	]
+
+	table = [["Parser", "Lines", "Total (s)", "Lines per second", "Speed-up"]]
+	baseline = None
+
+	for name, parse in parsers:
+		time_before = time.time()
+		parse()
+		time_taken = time.time() - time_before
+
+		baseline = baseline or time_taken
+		table.append([name, "{:,}".format(line_count), "{:.3f}".format(time_taken),
+			"{:,.0f}".format(line_count / time_taken), "{:.1f}x".format(baseline / time_taken)])
+
+	util.outp.print_table(table, headline="Log parsing")
+
+
+def log_batch_call(args):
+	""" Unpack the args and call _bench_log_batch.
+	Expects 'entries'. """
+	_bench_log_batch(args.entries)
+
+
+def _bench_log_batch(entry_count):
+	""" Compare the memory per entry and a group-by by app_id and class of LogEntry lists and LogBatch. """
+
+	rand = random.Random(0)
+	app_ids = ["COLOUR_1", "POI", "TSP_ROUTING", "COUNTRYCODE", "DATAGEN_A_2"]
+	labels = ["normal", "red", "jump"]
+	time_now = int(time.time())
+
+	log_strings = [LogEntry(vin="VIN{:05d}".format(i % 10000), app_id=rand.choice(app_ids),
+		log_message="{},{},{}".format(i % 256, i % 128, i % 64), gps_position="{}.5,{}.25".format(i % 100, i % 50),
+		time_unix=time_now + i, intrusion=rand.choice(labels)).get_log_string() for i in range(0, entry_count)]
+
+	table = [["Container", "Entries", "Bytes per entry", "Parse (s)", "Group-by (s)"]]
+
+	for name, read, group in [
+		("[LogEntry]", lambda lines: list(log_parser.yield_entries(lines)), _group_log_entries),
+		("LogBatch", log_parser.read_batch, lambda batch: batch.get_group_indices(
+			[LogEntry.APP_ID_FIELD, log_parser.INTRUSION_FIELD]))]:
+
+		length, bytes_per_entry, time_parse, time_group = _run_in_subprocess(
+			_measure_container, read, group, log_strings)
+
+		table.append([name, "{:,}".format(length), "{:,.0f}".format(bytes_per_entry),
+			"{:.3f}".format(time_parse), "{:.3f}".format(time_group)])
+
+	util.outp.print_table(table, headline="LogBatch")
+	print("Bytes per entry: Growth of the resident set size of a process that only holds this container")
+
+
+def _measure_container(read, group, log_strings):
+	"""
+	Read the given lines into a container and group it. Run in its own process, so the growth of the
+	maximum resident set size is the container's.
+	returns: (entries, bytes per entry, parse time, group-by time)
+	"""
+
+	gc.collect()
+	rss_before = _get_max_rss_bytes()
+
+	time_before = time.time()
+	container = read(log_strings)
+	time_parse = time.time() - time_before
+
+	gc.collect()
+	bytes_per_entry = float(_get_max_rss_bytes() - rss_before) / len(log_strings)
+
+	time_before = time.time()
+	group(container)
+	time_group = time.time() - time_before
+
+	return (len(container), bytes_per_entry, time_parse, time_group)
+
+
+def _run_in_subprocess(function, *args):
+	""" Return function(*args), called in a forked process. Its memory is freed with the process. """
+
+	queue = multiprocessing.Queue()
+	process = multiprocessing.Process(target=lambda: queue.put(function(*args)))
+	process.start()
+
+	result = queue.get()
+	process.join()
+
+	return result
+
+
+def _group_log_entries(log_entries):
+	groups = {}
+	for index, log_entry in enumerate(log_entries):
+		groups.setdefault((log_entry.app_id, log_entry.intrusion), []).append(index)
+	return groups
+
+
+def _get_max_rss_bytes():
+	""" Maximum resident set size of this process in bytes (Linux reports KB). """
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+
+class _TempCwd(object):
+	""" Work in a temporary directory that is removed afterwards. """
+
+	def __init__(self):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self._previous_cwd = None
+		self._temp_dir = None
+
+
+	def __enter__(self):
+		self._previous_cwd = os.getcwd()
+		self._temp_dir = tempfile.mkdtemp(prefix="bench_")
+		os.chdir(self._temp_dir)
+		return self._temp_dir
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		os.chdir(self._previous_cwd)
+		shutil.rmtree(self._temp_dir)
+
+
+
+if __name__ == "__main__":
+	try:
+		PARSER = argparse.ArgumentParser()
+		SUBPARSERS = PARSER.add_subparsers()
+
+		CLIENT_TIME_PARSER = SUBPARSERS.add_parser("client-time",
+			help="Per-request cost of the client time handling for 10 to --max-vins VINs")
+		CLIENT_TIME_PARSER.add_argument("--max-vins", type=int, default=1000000, metavar="N")
+		CLIENT_TIME_PARSER.add_argument("--requests", "-n", type=int, default=100000, metavar="N")
+		CLIENT_TIME_PARSER.set_defaults(function=client_time_call)
+
+		LOG_ENTRY_PARSER = SUBPARSERS.add_parser("log-entry",
+			help="Memory per LogEntry and throughput of creating, serialising and parsing them")
+		LOG_ENTRY_PARSER.add_argument("--entries", "-n", type=int, default=1000000, metavar="N")
+		LOG_ENTRY_PARSER.set_defaults(function=log_entry_call)
+
+		PARSE_PARSER = SUBPARSERS.add_parser("parse",
+			help="Lines per second of LogEntry.from_log_string compared to log_parser")
+		PARSE_PARSER.add_argument("--lines", "-n", type=int, default=1000000, metavar="N")
+		PARSE_PARSER.set_defaults(function=parse_call)
+
+		LOG_BATCH_PARSER = SUBPARSERS.add_parser("log-batch",
+			help="Memory per entry and group-by time of LogBatch compared to a list of LogEntry objects")
+		LOG_BATCH_PARSER.add_argument("--entries", "-n", type=int, default=1000000, metavar="N")
+		LOG_BATCH_PARSER.set_defaults(function=log_batch_call)
+
+		if len(sys.argv) == 1:
+			PARSER.print_help()
+			exit()
+
+		ARGS = PARSER.parse_args()
+		ARGS.function(ARGS)
+		exit()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+""" Block-compressed log files """
+
+import bz2
+import json
+import os
+import struct
+import zlib
+
+
+# File layout:
+# MAGIC | header line (JSON) | compressed blocks | block index line (JSON) | trailer
+# The trailer holds the offset of the block index followed by TRAILER_MAGIC.
+MAGIC = "RRBLOG1\n"
+_TRAILER_MAGIC = "RRBLEND\n"
+_TRAILER_FORMAT = "<Q"
+_TRAILER_SIZE = struct.calcsize(_TRAILER_FORMAT) + len(_TRAILER_MAGIC)
+
+CODECS = {
+	"zlib" : (lambda data: zlib.compress(data, 6), zlib.decompress),
+	"bz2" : (lambda data: bz2.compress(data, 9), bz2.decompress)
+}
+
+DEFAULT_CODEC = "zlib"
+DEFAULT_BLOCK_BYTES = 256 * 1024
+
+_SUFFIX_TEMP = ".compressing"
+
+
+def is_block_file(file_path):
+	""" Whether the given file is block-compressed. """
+
+	with open(file_path, "rb") as file_handle:
+		return file_handle.read(len(MAGIC)) == MAGIC
+
+
+def yield_lines(file_path):
+	""" Yield all lines including their line ending from the given plain or block-compressed file. """
+
+	if not is_block_file(file_path):
+		with open(file_path, "r") as file_handle:
+			for line in file_handle:
+				yield line
+		return
+
+	reader = BlockLogReader(file_path)
+	for line in reader.yield_lines():
+		yield line
+
+
+def compress_file(file_path, target_path, codec=DEFAULT_CODEC, block_bytes=DEFAULT_BLOCK_BYTES):
+	""" Write the lines of the given plain or block-compressed file to a new block-compressed file. """
+
+	with BlockLogWriter(target_path, codec, block_bytes) as writer:
+		for line in yield_lines(file_path):
+			writer.write_line(line)
+
+
+def compress_in_place(file_path, codec=DEFAULT_CODEC, block_bytes=DEFAULT_BLOCK_BYTES):
+	"""
+	Replace the given plain file with its block-compressed version.
+	returns: False if the file was compressed already.
+	"""
+
+	if is_block_file(file_path):
+		return False
+
+	temp_path = file_path + _SUFFIX_TEMP
+	compress_file(file_path, temp_path, codec, block_bytes)
+	os.rename(temp_path, file_path)
+
+	return True
+
+
+
+class BlockLogWriter(object):
+	"""
+	Writes lines into independently compressed blocks of about block_bytes uncompressed bytes.
+	Lines never span blocks. The block index is written on close().
+	"""
+
+	def __init__(self, file_path, codec=DEFAULT_CODEC, block_bytes=DEFAULT_BLOCK_BYTES):
+		""" Ctor """
+
+		object.__init__(self)
+
+		if codec not in CODECS:
+			raise ValueError("Unknown codec {}! Use one of: {}".format(codec, ", ".join(sorted(CODECS))))
+		if block_bytes <= 0:
+			raise ValueError("Block size must be positive valued!")
+
+		self.file_path = file_path
+		self._compress = CODECS[codec][0]
+		self._block_bytes = block_bytes
+
+		# [offset, compressed size, line count] per block
+		self._blocks = []
+		self._block_lines = []
+		self._block_size = 0
+
+		self._file = open(file_path, "wb")
+		self._file.write(MAGIC)
+		self._file.write(json.dumps({"codec" : codec}, sort_keys=True) + "\n")
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+	def write_line(self, line):
+		""" Add the given line. Adds the line terminating character if it's missing. """
+
+		if not line.endswith("\n"):
+			line += "\n"
+
+		self._block_lines.append(line)
+		self._block_size += len(line)
+
+		if self._block_size >= self._block_bytes:
+			self._write_block()
+
+
+	def close(self):
+		""" Write the last block and the block index. """
+
+		if self._file is None:
+			return
+
+		if self._block_lines:
+			self._write_block()
+
+		index_offset = self._file.tell()
+		self._file.write(json.dumps(self._blocks) + "\n")
+		self._file.write(struct.pack(_TRAILER_FORMAT, index_offset) + _TRAILER_MAGIC)
+
+		self._file.close()
+		self._file = None
+
+
+	def _write_block(self):
+		data = self._compress("".join(self._block_lines))
+		self._blocks.append([self._file.tell(), len(data), len(self._block_lines)])
+		self._file.write(data)
+
+		self._block_lines = []
+		self._block_size = 0
+
+
+
+class BlockLogReader(object):
+	""" Random access to the blocks of a block-compressed file via its block index. """
+
+	def __init__(self, file_path):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self.file_path = file_path
+		self.codec = None
+
+		with open(file_path, "rb") as file_handle:
+			if file_handle.read(len(MAGIC)) != MAGIC:
+				raise ValueError("Not a block-compressed file: {}".format(file_path))
+
+			header = json.loads(file_handle.readline())
+			if header["codec"] not in CODECS:
+				raise ValueError("Unknown codec {} in {}".format(header["codec"], file_path))
+			self.codec = header["codec"]
+			self._decompress = CODECS[self.codec][1]
+
+			file_handle.seek(-_TRAILER_SIZE, os.SEEK_END)
+			index_offset_data = file_handle.read(struct.calcsize(_TRAILER_FORMAT))
+			if file_handle.read() != _TRAILER_MAGIC:
+				raise ValueError("Incomplete block-compressed file: {}".format(file_path))
+
+			file_handle.seek(struct.unpack(_TRAILER_FORMAT, index_offset_data)[0])
+			self._blocks = json.loads(file_handle.readline())
+
+
+	def get_block_count(self):
+		""" Return the number of blocks. """
+		return len(self._blocks)
+
+
+	def get_line_count(self):
+		""" Return the number of lines in all blocks. """
+		return sum([b[2] for b in self._blocks])
+
+
+	def read_block(self, block_index):
+		""" Return the lines of the given block including their line ending. """
+
+		offset, size, _ = self._blocks[block_index]
+
+		with open(self.file_path, "rb") as file_handle:
+			file_handle.seek(offset)
+			return self._decompress(file_handle.read(size)).splitlines(True)
+
+
+	def yield_lines(self, start_line=0):
+		""" Yield all lines from the given line number on. Skips the blocks before it without reading them. """
+
+		first_line_of_block = 0
+
+		with open(self.file_path, "rb") as file_handle:
+			for offset, size, line_count in self._blocks:
+				if first_line_of_block + line_count <= start_line:
+					first_line_of_block += line_count
+					continue
+
+				file_handle.seek(offset)
+				lines = self._decompress(file_handle.read(size)).splitlines(True)
+
+				for line in lines[max(start_line - first_line_of_block, 0):]:
+					yield line
+
+				first_line_of_block += line_count
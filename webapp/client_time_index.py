@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+""" Index of the client times """
+
+import heapq
+
+
+class ClientTimeIndex(object):
+	"""
+	Current time per client with the minimum over all clients.\n
+	Updates push onto a min-heap and leave the outdated heap item behind; outdated items are dropped
+	once they reach the top (lazy invalidation), and the heap is rebuilt when they pile up.
+	Updates are O(log n) amortised, the minimum is O(1) after an update.
+	Clients without a time (None) are ignored for the minimum.
+	"""
+
+	# Rebuild the heap when it holds more than this factor times the number of clients
+	_COMPACTION_FACTOR = 2
+	_MIN_COMPACTION_SIZE = 1024
+
+
+	def __init__(self, client_times=None):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self._client_times = {}
+		self._heap = [] # (time, identifier) tuples - possibly outdated
+
+		if client_times:
+			self._client_times = dict(client_times)
+			self._rebuild_heap()
+
+
+	def get(self, identifier):
+		""" Return the time of the given client. raises: KeyError for unknown clients. """
+		return self._client_times[identifier]
+
+
+	def set(self, identifier, new_time):
+		""" Set the time of the given client. None denotes a client without a time. """
+
+		self._client_times[identifier] = new_time
+
+		if new_time is not None:
+			heapq.heappush(self._heap, (new_time, identifier))
+
+		if len(self._heap) > max(self._COMPACTION_FACTOR * len(self._client_times), self._MIN_COMPACTION_SIZE):
+			self._rebuild_heap()
+		else:
+			self._drop_outdated()
+
+
+	def get_min(self):
+		""" Return the minimum time over all clients or None if no client has a time. """
+
+		if not self._heap:
+			return None
+
+		return self._heap[0][0]
+
+
+	def items(self):
+		""" Return (identifier, time) of all clients. """
+		return self._client_times.items()
+
+
+	def __contains__(self, identifier):
+		return identifier in self._client_times
+
+
+	def __len__(self):
+		return len(self._client_times)
+
+
+	def _drop_outdated(self):
+		""" Pop outdated items off the top of the heap so it holds the current minimum. """
+
+		while self._heap:
+			heap_time, identifier = self._heap[0]
+			if self._client_times.get(identifier) == heap_time:
+				return
+
+			heapq.heappop(self._heap)
+
+
+	def _rebuild_heap(self):
+		""" Create a heap with exactly one item per client with a time. """
+
+		self._heap = [(t, i) for i, t in self._client_times.items() if t is not None]
+		heapq.heapify(self._heap)
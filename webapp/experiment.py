@@ -32,13 +32,17 @@ ResultFileGroup = namedtuple("ResultFileGroup", "file_name lines")
 class Experiment(object):
 	""" Do experiments. Start with a(). """
 
-	def __init__(self, file_path, store_title):
-		""" Ctor """
+	def __init__(self, file_path, store_title, processes=1):
+		"""
+		Ctor
+		*processes: Number of worker processes to convert the log entries in. None uses one per CPU.
+		"""
 
 		object.__init__(self)
 
 		# State
 		self.title = None
+		self.processes = processes
 		# Time
 		self.start_time = time.time()
 		self.end_time = None
@@ -277,7 +281,7 @@ class Experiment(object):
 
 		self.entries = []
 
-		for entry in idse_dao.yield_entries(file_path):
+		for entry in idse_dao.yield_entries(file_path, processes=self.processes):
 			self.entries.append(entry)
 
 			if len(self.entries) >= 5000000:
@@ -310,10 +314,12 @@ if __name__ == "__main__":
 		PARSER = argparse.ArgumentParser()
 		PARSER.add_argument("file_path", metavar="PATH/FILE", help="Log file")
 		PARSER.add_argument("--store", "-s", metavar="TITLE", help="Experiment title")
+		PARSER.add_argument("--processes", "-p", type=int, default=1,
+			help="Worker processes for the conversion; 0 uses one per CPU")
 
 		ARGS = PARSER.parse_args()
 
-		EXPERIMENT = Experiment(ARGS.file_path, ARGS.store)
+		EXPERIMENT = Experiment(ARGS.file_path, ARGS.store, ARGS.processes or None)
 		EXPERIMENT.run()
 
 		exit()
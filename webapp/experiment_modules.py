@@ -11,12 +11,11 @@ import sklearn.ensemble as sk_ens
 import sklearn.svm as sk_svm
 import sklearn.model_selection as sk_mod
 
-from ids.dir_utils import Dir
 from ids.ids_converter import IdsConverter
 from ids.ids_one_hot_vs_mapping_converter import OneHotVsMappingConverter
 from ids.ids_entry import IdsEntry
 import ids.ids_tools as ids_tools
-from log_entry import LogEntry
+import log_parser
 import util.seqr
 import util.fmtr
 
@@ -62,11 +61,7 @@ class OneHotVsMapping(ModuleInterface):
 	@staticmethod
 	def run(experiment):
 
-		log_entries = []
-
-		for line in Dir.yield_lines(experiment.file_path, ITEM_LIMIT):
-			log_entry = LogEntry.from_log_string(line)
-			log_entries.append(log_entry)
+		log_entries = list(log_parser.yield_entries(experiment.file_path, limit=ITEM_LIMIT))
 
 		experiment.entries = log_entries
 
@@ -317,11 +312,7 @@ class AllVsSpecSvmVsIso(ModuleInterface):
 
 		from ids.TEMP_IDS_CONVERTER import IdsConverter as TEMPCONVERTER
 		converter = TEMPCONVERTER()
-		log_entries = []
-
-		for line in Dir.yield_lines(experiment.file_path, ITEM_LIMIT):
-			log_entry = LogEntry.from_log_string(line)
-			log_entries.append(log_entry)
+		log_entries = list(log_parser.yield_entries(experiment.file_path, limit=ITEM_LIMIT))
 
 		all_entries = converter.LOG_ENTRIES_TO_IDS_ENTRIES(log_entries, binary=True)
 
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+""" Integer codes for low-cardinality log fields """
+
+
+class FieldCodes(object):
+	"""
+	Assigns each distinct value of a field an integer code: 0, 1, ... in the order of first use.
+	Codes are stable for the lifetime of the process, but not across processes - don't persist them.
+	Values are kept as interned strings, so a code table doesn't hold any copies of them.
+	"""
+
+	def __init__(self, field, known_values=None):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self.field = field
+
+		self._codes = {}
+		self._values = []
+
+		for value in known_values or []:
+			self.encode(value)
+
+
+	def __len__(self):
+		return len(self._values)
+
+
+	def encode(self, value):
+		""" Return the code of the given value, assigning a new one to values not seen before. """
+
+		code = self._codes.get(value)
+
+		if code is None:
+			code = len(self._values)
+			value = intern(value) if type(value) is str else value
+			self._codes[value] = code
+			self._values.append(value)
+
+		return code
+
+
+	def decode(self, code):
+		""" Return the value of the given code. """
+		return self._values[code]
+
+
+	def get_values(self):
+		""" Return all values, indexed by code. """
+		return list(self._values)
+
+
+
+# Shared by all LogEntry objects of this process
+APP_IDS = FieldCodes("app_id")
+LEVELS = FieldCodes("level", ["DEBUG", "ERROR"])
+LABELS = FieldCodes("intrusion", [""])
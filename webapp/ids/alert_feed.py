@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+""" Alert feed """
+
+import collections
+import json
+import os
+import threading
+import time
+
+
+class AlertFeed(object):
+	"""
+	In-memory ring buffer of the latest intrusion alerts with increasing sequence numbers.
+	Consumers poll for alerts newer than the last sequence number they have seen.
+	Every alert is also appended to the optional AlertJournal.
+	"""
+
+	# Interval in which waiting consumers check for new alerts
+	_POLL_INTERVAL = 0.1
+
+
+	def __init__(self, capacity=10000, journal=None):
+		""" Ctor """
+
+		object.__init__(self)
+
+		if capacity <= 0:
+			raise ValueError("Capacity must be positive valued!")
+
+		self._alerts = collections.deque(maxlen=capacity)
+		self._journal = journal
+		self._lock = threading.Lock()
+		self._last_seq = 0
+
+
+	def publish(self, log_entry_string, app_id, classification, confidence):
+		"""
+		Add an alert for the given detection.
+		returns: The alert as a dict.
+		"""
+
+		with self._lock:
+			self._last_seq += 1
+			alert = {
+				"seq" : self._last_seq,
+				"time_unix" : time.time(),
+				"app_id" : app_id,
+				"classification" : classification,
+				"confidence" : confidence,
+				"log_entry" : log_entry_string
+			}
+
+			self._alerts.append(alert)
+			if self._journal is not None:
+				self._journal.append(alert)
+
+		return alert
+
+
+	def get_since(self, since, timeout=0, limit=None):
+		"""
+		Return the alerts with a sequence number above since, oldest first.
+		Waits up to timeout seconds for new alerts if there are none yet.
+		returns: (alerts, the sequence number to pass as the next since) - the last one returned
+		if limit cut the alerts off, else the last one published
+		"""
+
+		time_end = time.time() + timeout
+
+		while self._last_seq <= since and time.time() < time_end:
+			time.sleep(AlertFeed._POLL_INTERVAL)
+
+		with self._lock:
+			alerts = [a for a in self._alerts if a["seq"] > since]
+			last_seq = self._last_seq
+
+		if limit is not None and len(alerts) > limit:
+			alerts = alerts[:limit]
+			last_seq = alerts[-1]["seq"] if alerts else since
+
+		return (alerts, last_seq)
+
+
+	def get_last_seq(self):
+		""" Return the sequence number of the latest alert. 0 if there is none. """
+		return self._last_seq
+
+
+	def close_journal(self):
+		""" Close the journal file. It is reopened with the next alert. """
+
+		if self._journal is None:
+			return
+
+		with self._lock:
+			self._journal.close()
+
+
+
+class AlertJournal(object):
+	"""
+	Append-only journal of alerts with one JSON object per line.
+	Rotates to <name>_1.log, <name>_2.log, ... once the file exceeds max_bytes.
+	"""
+
+	_SUFFIX = ".log"
+
+
+	def __init__(self, path_without_suffix, max_bytes=10 * 1024 * 1024, backup_count=5):
+		""" Ctor """
+
+		object.__init__(self)
+
+		if max_bytes <= 0 or backup_count < 0:
+			raise ValueError("Max bytes must be positive valued and backup count can't be negative!")
+
+		self._path_without_suffix = path_without_suffix
+		self._max_bytes = max_bytes
+		self._backup_count = backup_count
+
+		self._file = None
+		self._size = 0
+
+
+	def get_path(self, index=0):
+		""" Return the path of the current journal file (0) or of the given backup. """
+
+		if index == 0:
+			return self._path_without_suffix + AlertJournal._SUFFIX
+
+		return "{}_{}{}".format(self._path_without_suffix, index, AlertJournal._SUFFIX)
+
+
+	def append(self, alert):
+		""" Append the given alert and flush it so followers see it immediately. """
+
+		if self._file is None:
+			self._open()
+
+		line = json.dumps(alert, sort_keys=True) + "\n"
+		self._file.write(line)
+		self._file.flush()
+
+		self._size += len(line)
+		if self._size >= self._max_bytes:
+			self._rotate()
+
+
+	def close(self):
+		""" Close the journal file if it is open. """
+
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+
+	def _open(self):
+		""" Open the current journal file for appending. """
+
+		self._file = open(self.get_path(), "a")
+		self._size = os.path.getsize(self.get_path())
+
+
+	def _rotate(self):
+		""" Move the current file to the first backup, shifting older backups and dropping the oldest. """
+
+		self.close()
+
+		if self._backup_count == 0:
+			os.remove(self.get_path())
+			return
+
+		for index in range(self._backup_count - 1, 0, -1):
+			if os.path.lexists(self.get_path(index)):
+				os.rename(self.get_path(index), self.get_path(index + 1))
+
+		os.rename(self.get_path(), self.get_path(1))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+""" Detection queue """
+
+import Queue
+import threading
+import time
+
+import util.mtrc
+
+
+_QUEUE_DEPTH = util.mtrc.REGISTRY.gauge(
+	"ids_detection_queue_entries", "Number of log entries waiting for or in detection")
+_DETECTION_LAG = util.mtrc.REGISTRY.histogram(
+	"ids_detection_lag_seconds", "Time between queueing entries and finishing their detection")
+
+
+class DetectionQueue(object):
+	"""
+	Bounded queue of log entries that are processed by background detector workers.
+	Decouples the intrusion detection from the caller - put() only blocks if the queue is full.
+	The bound counts log entries, not the batches they were queued in.
+	Note: The workers are threading.Threads - once gevent monkey-patched them (the web API's default mode)
+	they are greenlets, so without a runner the classification still runs on the hub.
+	"""
+
+	def __init__(self, live_ids, max_size=10000, worker_count=1, runner=None):
+		"""
+		Ctor
+		*max_size: Maximum number of queued entries. A larger batch is only accepted into an empty queue.
+		*runner: Optional callable(func, args) that runs the classification, e.g. a thread pool's apply.
+		Defaults to classifying in the worker itself. Alerts are published in the worker (see LiveIds).
+		"""
+
+		object.__init__(self)
+
+		if max_size <= 0 or worker_count <= 0:
+			raise ValueError("Queue size and worker count must be positive valued!")
+
+		self._live_ids = live_ids
+		self._runner = runner
+		self._max_size = max_size
+
+		# (time enqueued, [log entries]) tuples - bounded by _queued_entry_count instead of its own size
+		self._queue = Queue.Queue()
+
+		self._lock = threading.Lock()
+		self._space_freed = threading.Condition(self._lock)
+		self._queued_entry_count = 0
+		self._last_lag = 0.0
+		self._max_lag = 0.0
+
+		self._workers = []
+		for _ in range(0, worker_count):
+			worker = threading.Thread(target=self._work)
+			worker.daemon = True
+			worker.start()
+			self._workers.append(worker)
+
+
+	def put(self, log_entry):
+		""" Queue the given entry for detection. Blocks if the queue is full. """
+		self.put_all([log_entry])
+
+
+	def put_all(self, log_entries):
+		""" Queue the given entries for detection in bulk. Blocks if the queue is full. """
+
+		if not log_entries:
+			return
+
+		with self._lock:
+			while self._queued_entry_count > 0 and self._queued_entry_count + len(log_entries) > self._max_size:
+				self._space_freed.wait()
+
+			self._queued_entry_count += len(log_entries)
+			_QUEUE_DEPTH.set(self._queued_entry_count)
+
+		self._queue.put((time.time(), log_entries))
+
+
+	def join(self):
+		""" Block until all queued entries were processed. """
+		self._queue.join()
+
+
+	def is_full(self):
+		""" Whether put() would block. """
+		return self._queued_entry_count >= self._max_size
+
+
+	def get_depth(self):
+		""" Return the number of entries waiting for or in detection. """
+		return self._queued_entry_count
+
+
+	def get_lag(self):
+		"""
+		Return the detection lag in seconds.
+		returns: (lag of the last processed entries, maximum lag observed)
+		"""
+		return (self._last_lag, self._max_lag)
+
+
+	### Worker ###
+
+
+	def _work(self):
+		""" Process queued entries until the program exits. """
+
+		while True:
+			time_enqueued, log_entries = self._queue.get()
+
+			try:
+				self._live_ids.process_all(log_entries, self._runner)
+			# pylint: disable-msg=W0703; (Catching too general exception - the worker needs to survive)
+			except Exception as error:
+				print("Detection failed for {} entries: {}".format(len(log_entries), error))
+			finally:
+				lag = time.time() - time_enqueued
+
+				with self._lock:
+					self._queued_entry_count -= len(log_entries)
+					self._last_lag = lag
+					self._max_lag = max(self._max_lag, lag)
+					_QUEUE_DEPTH.set(self._queued_entry_count)
+					self._space_freed.notify_all()
+
+				_DETECTION_LAG.observe(lag, count=len(log_entries))
+
+				self._queue.task_done()
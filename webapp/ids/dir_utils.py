@@ -9,6 +9,9 @@ import uuid
 import sklearn.svm as sk_svm
 from sklearn.externals import joblib
 
+import block_log
+import log_segments
+
 
 class Dir(object):
 	""" Generic directory and path handling. """
@@ -78,12 +81,16 @@ class Dir(object):
 
 	@staticmethod
 	def yield_lines(file_path, limit=None):
-		""" Yield all lines in the given file. Removes the line terminating character. """
+		"""
+		Yield all lines in the given file. Removes the line terminating character.
+		Segmented logs (see log_segments) are read segment by segment, block-compressed files
+		(see block_log) are decompressed on the fly.
+		"""
 
 		count = 0
 
-		with open(file_path, "r") as file_handle:
-			for line in file_handle:
+		for part_path in Dir.get_file_parts(file_path):
+			for line in block_log.yield_lines(part_path):
 				# Remove the newline character
 				yield line[:-1]
 
@@ -92,6 +99,20 @@ class Dir(object):
 					return
 
 
+	@staticmethod
+	def get_file_parts(file_path):
+		"""
+		Return the files making up the given file: The sealed segments and the file itself for segmented
+		logs, else just the file. Segments can be processed independently of each other.
+		"""
+
+		parts = log_segments.get_log_parts(file_path)
+		if not parts:
+			raise IOError("File doesn't exist: {}".format(file_path))
+
+		return parts
+
+
 	@staticmethod
 	def write_lines(file_path, lines_generator):
 		""" Write the given lines to the given file. Adds the line terminating character. """
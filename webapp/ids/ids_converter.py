@@ -4,19 +4,36 @@
 import warnings
 
 import numpy
-import sklearn.preprocessing as sk_pre
 
+from log_batch import LogBatch
+import log_batch
 from log_entry import LogEntry
+import field_codes
 from ids.ids_entry import IdsEntry
 import ids_data
+import ids_parallel
+import ids_schema
 import ids_tools
 
 
 class IdsConverter(object):
 	""" Conversion of LogEntry objects. """
 
-	def __init__(self):
-		""" Ctor. """
+	def __init__(self, dtype=numpy.float_, label_dtype=None):
+		"""
+		Ctor.
+		*dtype: Type of the vectors: numpy.float64 or numpy.float32. All features are one-hot flags or scaled values,
+		so float32 is ample and halves the memory of the matrices.
+		*label_dtype: Optional integer type, e.g. numpy.int8, to return y as numpy.ndarray instead of a list.
+		"""
+
+		self.dtype = numpy.dtype(dtype)
+		if self.dtype not in [numpy.dtype(numpy.float32), numpy.dtype(numpy.float64)]:
+			raise ValueError("Invalid dtype: {}. Expected float32 or float64.".format(self.dtype))
+
+		self.label_dtype = None if label_dtype is None else numpy.dtype(label_dtype)
+		if self.label_dtype is not None and self.label_dtype.kind != "i":
+			raise ValueError("Invalid label dtype: {}. Expected a signed integer type.".format(self.label_dtype))
 
 		self.app_ids = ids_data.get_app_ids()
 		ids_tools.verify_md5(self.app_ids, "3a88e92473acb1ad1b56e05a8074c7bd")
@@ -37,6 +54,9 @@ class IdsConverter(object):
 			ids_data.get_labels(),
 			verify_hash="88074a13baa6f97fa4801f3b0ec53065")
 
+		# { binary : [class per code of field_codes.LABELS] } - each label is only mapped once
+		self._classes_per_label_code = {True : [], False : []}
+
 		## Verifier data ##
 		# 1 for a binarised level (only two options)
 		base_len = 1
@@ -60,26 +80,41 @@ class IdsConverter(object):
 		# TSP: x, y, targ_x, targ_y
 		self._vector_constraints[ids_data.POSE_TSP][self._len_key] += 4
 
+		## Encoding ##
+		self._schema = ids_schema.get_schema()
+		for app_id, app_schema in self._schema.app_schemas.items():
+			if app_schema.width != self._vector_constraints[app_id][self._len_key]:
+				raise ValueError("Schema of {} doesn't match the vector constraints!".format(app_id))
+
 
 	def log_entry_to_vector(self, app_id, log_entry, binary=True):
-		""" Convert the given log_entry to a classifiable vector. """
+		"""
+		Convert the given log_entry to a classifiable vector.
+		Uses the compiled schema - plain lookups without the overhead of the batch conversion.
+		"""
 
-		vectors = self.log_entries_to_vectors(app_id, [log_entry])
-		return vectors[0]
+		app_schema = self._schema.get_app_schema(app_id)
+		return app_schema.encode(log_entry.level, log_entry.log_message, log_entry.gps_position, self.dtype)
 
 
-	def log_entries_to_ids_entries_dict(self, all_log_entries, binary=True):
-		""" Convert the given LogEntry objects to a { app_id : IdsEntrys } dict. """
+	def log_entries_to_ids_entries_dict(self, all_log_entries, binary=True, processes=1):
+		"""
+		Convert the given LogEntry objects or LogBatch to a { app_id : IdsEntrys } dict.
+		*processes: Number of worker processes to convert in; see ids_parallel. 1 converts in this process.
+		"""
 
-		log_entries_per_app_id = {}
+		if processes != 1:
+			ids_entries_per_app_id = {}
+			X_y_dict = ids_parallel.log_entries_to_X_y_dict(self, all_log_entries, binary, processes)
 
-		for log_entry in all_log_entries:
-			app_id = ids_tools.log_entry_to_app_id(log_entry)
+			# pylint: disable-msg=C0103; (Invalid variable name)
+			for app_id, (X, y) in X_y_dict.items():
+				ids_entries_per_app_id[app_id] = [IdsEntry(app_id, vector, vclass) for vector, vclass in zip(X, y)]
 
-			if app_id not in log_entries_per_app_id:
-				log_entries_per_app_id[app_id] = []
+			self.check_dict(ids_entries_per_app_id)
+			return ids_entries_per_app_id
 
-			log_entries_per_app_id[app_id].append(log_entry)
+		log_entries_per_app_id = self.log_entries_to_dict(all_log_entries)
 
 		ids_entries_per_app_id = ids_tools.empty_app_id_to_list_dict(log_entries_per_app_id.keys())
 
@@ -92,6 +127,32 @@ class IdsConverter(object):
 		return ids_entries_per_app_id
 
 
+	def log_entries_to_dict(self, all_log_entries):
+		"""
+		Group the given LogEntry objects or LogBatch by app_id.
+		returns: { app_id : [LogEntry] } or { app_id : LogBatch }
+		"""
+
+		log_entries_per_app_id = {}
+
+		if isinstance(all_log_entries, LogBatch):
+			indices_per_app_id = all_log_entries.get_group_indices(
+				[LogEntry.APP_ID_FIELD], key=lambda values: ids_tools.strip_app_id(values[0]))
+
+			for app_id, indices in indices_per_app_id.items():
+				log_entries_per_app_id[app_id] = all_log_entries.select(indices)
+		else:
+			for log_entry in all_log_entries:
+				app_id = ids_tools.log_entry_to_app_id(log_entry)
+
+				if app_id not in log_entries_per_app_id:
+					log_entries_per_app_id[app_id] = []
+
+				log_entries_per_app_id[app_id].append(log_entry)
+
+		return log_entries_per_app_id
+
+
 	def ids_entries_to_dict(self, ids_entries):
 		""" Store the given LogEntry objects in a { app_id : [IdsEntry] } dict. """
 
@@ -107,16 +168,21 @@ class IdsConverter(object):
 
 
 	def log_entries_to_ids_entries(self, expected_app_id, log_entries, binary):
-		""" Convert the given LogEntry objects to IdsEntry objects for this app_id. """
+		""" Convert the given LogEntry objects or LogBatch to IdsEntry objects for this app_id. """
 
-		app_ids = [ids_tools.log_entry_to_app_id(log_entry) for log_entry in log_entries]
+		if isinstance(log_entries, LogBatch):
+			# Map each category once and look the entries' codes up
+			app_id_per_code = [ids_tools.strip_app_id(a) for a in log_entries.get_categories(LogEntry.APP_ID_FIELD)]
+			app_ids = [app_id_per_code[c] for c in log_entries.get_codes(LogEntry.APP_ID_FIELD)]
+		else:
+			app_ids = [ids_tools.log_entry_to_app_id(log_entry) for log_entry in log_entries]
 
 		if any([a != expected_app_id for a in app_ids]):
 			raise ValueError("Given elements are not all of the expected app type: {}"
 				.format(expected_app_id))
 
 		vectors = self.log_entries_to_vectors(expected_app_id, log_entries)
-		vclasses = [self.log_entry_to_class(log_entry, binary) for log_entry in log_entries]
+		vclasses = self.log_entries_to_classes(log_entries, binary)
 
 		ids_entries = []
 		for app_id, vector, vclass in zip(app_ids, vectors, vclasses):
@@ -126,39 +192,116 @@ class IdsConverter(object):
 		return ids_entries
 
 
+	def log_entries_to_classes(self, log_entries, binary):
+		""" Map the given LogEntry objects or LogBatch to a list of classes to predict. """
+
+		if isinstance(log_entries, LogBatch):
+			class_per_code = [self.label_to_class(l, binary)
+				for l in log_entries.get_categories(LogBatch.INTRUSION_FIELD)]
+			return [class_per_code[c] for c in log_entries.get_codes(LogBatch.INTRUSION_FIELD)]
+
+		return [self.log_entry_to_class(log_entry, binary) for log_entry in log_entries]
+
+
+	def classes_to_y(self, classes):
+		""" Return the given classes as y: A list, or a numpy.ndarray of label_dtype if that is set. """
+
+		if self.label_dtype is None:
+			return list(classes)
+
+		return numpy.array(classes, dtype=self.label_dtype)
+
+
 	def ids_entries_to_X_y(self, ids_entries, app_id=None):
 		""" Convert the given IdsEntry objects to (X, y).
-		* app_id : Optionally specify the app_id that all entries should have. """
+		* app_id : Optionally specify the app_id that all entries should have.
+		returns: X as C-ordered two-dimensional numpy.ndarray of dtype with one vector per row, y as by classes_to_y() """
 
 		# pylint: disable-msg=C0103; (Invalid variable name)
-		X = []
 		y = []
 
 		for ids_entry in ids_entries:
 			if app_id and ids_entry.app_id != app_id:
 				raise ValueError("Given IdsEntry has an incorrect app_id!")
 
-			X.append(ids_entry.vector)
 			y.append(ids_entry.vclass)
 
+		if not ids_entries:
+			return (numpy.empty((0, 0), dtype=self.dtype), self.classes_to_y(y))
+
+		vector_len = len(ids_entries[0].vector)
+		if any([len(e.vector) != vector_len for e in ids_entries]):
+			raise ValueError("Given IdsEntry objects have vectors of different lengths!")
+
+		X = numpy.empty((len(ids_entries), vector_len), dtype=self.dtype, order="C")
+		for row, ids_entry in enumerate(ids_entries):
+			X[row] = ids_entry.vector
+
+		return (X, self.classes_to_y(y))
+
+
+	def log_entries_to_X_y(self, app_id, log_entries, binary=True):
+		"""
+		Convert the given LogEntry objects or LogBatch of the given app_id to (X, y) without IdsEntry objects.
+		returns: X as by log_entries_to_vectors(), y as by classes_to_y()
+		"""
+
+		# pylint: disable-msg=C0103; (Invalid variable name)
+		X = self.log_entries_to_vectors(app_id, log_entries)
+		y = self.classes_to_y(self.log_entries_to_classes(log_entries, binary))
 		return (X, y)
 
 
-	def log_entries_to_train_dict(self, log_entries, printer):
-		""" Convert the given log entries to { app_id : (X, y) }. """
+	def log_entries_to_train_dict(self, log_entries, printer, processes=1):
+		"""
+		Convert the given log entries to { app_id : (X, y) }.
+		*processes: Number of worker processes to convert in; see ids_parallel. 1 converts in this process.
+		"""
 
 		printer.prt("Transforming the log data to trainable vectors...")
-		ids_entries_dict = self.log_entries_to_ids_entries_dict(log_entries)
+
+		if processes != 1:
+			train_dict = ids_parallel.log_entries_to_X_y_dict(self, log_entries, processes=processes)
+			printer.prt("Done.")
+			return train_dict
+
+		log_entries_dict = self.log_entries_to_dict(log_entries)
 
 		train_dict = {}
-		for app_id, ids_entries in ids_entries_dict.items():
-			train_dict[app_id] = self.ids_entries_to_X_y(ids_entries, app_id)
+		for app_id, app_log_entries in log_entries_dict.items():
+			train_dict[app_id] = self.log_entries_to_X_y(app_id, app_log_entries)
 
 		self.check_dict(train_dict)
 		printer.prt("Done.")
 		return train_dict
 
 
+	def yield_X_y_blocks(self, log_entries, chunk_size=log_batch.DEFAULT_BATCH_SIZE, binary=True):
+		"""
+		Convert the given log entries chunk by chunk, so only one chunk is held in memory at a time.
+		*log_entries: A LogBatch, or an iterable of LogEntry and/or LogBatch objects - e.g. a generator.
+		*chunk_size: Maximum number of entries per chunk. Larger given batches are split.
+		returns: A generator of (app_id, X_block, y_block) tuples as by log_entries_to_X_y() -
+		one per app_id found in each chunk, in sorted app_id order per chunk.
+		"""
+
+		if chunk_size <= 0:
+			raise ValueError("Chunk size must be positive valued!")
+
+		for batch in log_batch.yield_batches(log_entries, chunk_size):
+			for start in xrange(0, len(batch), chunk_size):
+				chunk = batch if len(batch) <= chunk_size else batch[start:start + chunk_size]
+				chunk_per_app_id = self.log_entries_to_dict(chunk)
+
+				for app_id in sorted(chunk_per_app_id.keys()):
+					if app_id not in self.app_ids:
+						raise ValueError("Invalid app_id: {}".format(app_id))
+
+					# pylint: disable-msg=C0103; (Invalid variable name)
+					X_block, y_block = self.log_entries_to_X_y(app_id, chunk_per_app_id[app_id], binary)
+					yield (app_id, X_block, y_block)
+
+
 	def check_dict(self, given_dict):
 		""" Ensure the given dict conforms to our expectations. Call before returning entry dicts! """
 
@@ -173,8 +316,10 @@ class IdsConverter(object):
 
 	def log_entries_to_vectors(self, app_id, log_entries):
 		"""
-		Convert the given LogEntry objects to learnable vectors.
-		returns: C-ordered numpy.ndarray (dense) with dtype=float64
+		Convert the given LogEntry objects or LogBatch to learnable vectors.
+		The column blocks - level, log message and GPS position - are encoded for all entries at once
+		and written into one preallocated matrix, which is verified once.
+		returns: C-ordered two-dimensional numpy.ndarray (dense) of dtype with one vector per row
 		"""
 
 		if not log_entries:
@@ -191,50 +336,82 @@ class IdsConverter(object):
 		log_messages = []
 		positions = []
 
-		for log_entry in log_entries:
-			data_dict = log_entry.data
+		if isinstance(log_entries, LogBatch):
+			levels = log_entries.get_column(LogEntry.LEVEL_FIELD)
+			log_messages = log_entries.get_column(LogEntry.LOG_MESSAGE_FIELD)
+			positions = log_entries.get_column(LogEntry.GPS_POSITION_FIELD)
+		else:
+			for log_entry in log_entries:
+				levels.append(log_entry.level)
+				log_messages.append(log_entry.log_message)
+				positions.append(log_entry.gps_position)
+
+		column_blocks = [
+			# Binarisation of levels -> [0, 1]
+			self.levels_binarise(levels),
+			# Conversion (data gens) or one-hot encoding of log messages -> [0, 1, ...]
+			self.encode_log_messages(app_id, log_messages),
+			# GPS positions -> 0 or 2 columns
+			self.encode_positions_matrix(positions)
+		]
+
+		for block in column_blocks:
+			if block.ndim != 2 or block.shape[0] != len(levels):
+				raise ValueError("Encoding (app_id: %s) has an invalid shape: %s" % (app_id, block.shape))
+
+		vectors = numpy.empty(
+			(len(levels), sum([block.shape[1] for block in column_blocks])),
+			dtype=self.dtype,
+			order="C")
+
+		column = 0
+		for block in column_blocks:
+			vectors[:, column:column + block.shape[1]] = block
+			column += block.shape[1]
+
+		self.verify_vectors(vectors, app_id)
 
-			levels.append(data_dict[LogEntry.LEVEL_FIELD])
-			log_messages.append(data_dict[LogEntry.LOG_MESSAGE_FIELD])
-			positions.append(data_dict[LogEntry.GPS_POSITION_FIELD])
+		return vectors
 
-		# Binarisation of levels -> [0, 1]
-		enc_levels_array = self.levels_binarise(levels)
-		# Conversion (data gens) or one-hot encoding of log messages -> [0, 1, ...]
-		enc_log_messages_array = self.encode_log_messages(app_id, log_messages)
-		# Convert GPS positions to None or (x, y)
-		enc_gps_positions_array = self.encode_positions(positions)
 
-		vectors = []
+	def log_entry_to_class(self, log_entry, binary):
+		""" Map the given LogEntry object to a class to predict. """
 
-		for enc_lvl, enc_msg, enc_gps in (
-			zip(enc_levels_array, enc_log_messages_array, enc_gps_positions_array)):
+		if not log_entry.intrusion:
+			raise ValueError("Given LogEntry does not have a set intrusion to convert.")
 
-			# 1 level int, 1-12 log message floats or ints
-			data = list(enc_lvl) + list(enc_msg)
-			# 0/2 GPS floats
-			if enc_gps is not None:
-				data += list(enc_gps)
+		return self._label_code_to_class(log_entry.intrusion_code, binary)
 
-			ndarray = numpy.array(
-				data,
-				dtype=numpy.float_,
-				order="C")
 
-			self.verify_vector(ndarray, app_id)
+	def label_to_class(self, label, binary):
+		""" Map the given intrusion label to a class to predict. """
 
-			vectors.append(ndarray)
+		if not label:
+			raise ValueError("Given label is not set.")
 
-		return vectors
+		return self._label_code_to_class(field_codes.LABELS.encode(label), binary)
 
 
-	def log_entry_to_class(self, log_entry, binary):
-		""" Map the given LogEntry object to a class to predict. """
+	def _label_code_to_class(self, label_code, binary):
+		""" Map the given code of an intrusion label to a class to predict, mapping the label on first use. """
 
-		if not log_entry.intrusion:
-			raise ValueError("Given LogEntry does not have a set intrusion to convert.")
+		classes = self._classes_per_label_code[bool(binary)]
+		its_class = classes[label_code] if label_code < len(classes) else None
 
-		its_class = self.label_int_mapping[log_entry.intrusion]
+		if its_class is None:
+			its_class = self._label_value_to_class(field_codes.LABELS.decode(label_code), binary)
+
+			if label_code >= len(classes):
+				classes.extend([None] * (label_code + 1 - len(classes)))
+			classes[label_code] = its_class
+
+		return its_class
+
+
+	def _label_value_to_class(self, label, binary):
+		""" Map the given intrusion label to a class to predict. """
+
+		its_class = self.label_int_mapping[label]
 
 		if binary:
 			its_class = self.class_to_binary(its_class)
@@ -245,7 +422,7 @@ class IdsConverter(object):
 	def class_means_intruded(self, the_class):
 		""" Map the given class to a boolean 'is intruded'. """
 
-		if not isinstance(the_class, int):
+		if not isinstance(the_class, (int, numpy.integer)):
 			raise TypeError("Expected int. Got: {}".format(type(the_class)))
 
 		# Ensure we still have the state we expect.
@@ -320,12 +497,8 @@ class IdsConverter(object):
 		returns: Two-dimensional numpy.ndarray with a 1 element binary encoding per row.
 		"""
 
-		# For expected levels, see web_api.log_entry.LogEntry
-		expected_levels = ["DEBUG", "ERROR"]
-		ids_tools.verify_md5(expected_levels, "7692bbdba09aa7f2c9a15ca0e9a654cd")
-
-		encoded_levels = self.generic_one_hot(expected_levels, levels)
-		return encoded_levels
+		# For expected levels, see web_api.log_entry.LogEntry - verified with the schema
+		return self._schema.levels.encode_all(levels)
 
 
 	def encode_log_messages(self, app_id, log_messages):
@@ -400,12 +573,7 @@ class IdsConverter(object):
 		returns: A two-dimensional numpy.ndarray with 3 scaled colours per row.
 		"""
 
-		scaled = self.generic_scale(
-			values=colours,
-			range_min=0, range_max=1,
-			min_v=0, max_v=255
-		)
-		return scaled
+		return self._schema.colour_scale.scale_all(colours)
 
 
 	def country_codes_one_hot(self, country_codes):
@@ -414,12 +582,8 @@ class IdsConverter(object):
 		returns: A two-dimensional numpy.ndarray with a 5 element binary encoding per row.
 		"""
 
-		# For expected country codes, see web_api.functionality.country_code_mapper
-		expected_cc = ids_data.get_country_codes()
-		ids_tools.verify_md5(expected_cc, "b1d9e303bda676c3c6a61dc21e1d07c3")
-
-		encodings = self.generic_one_hot(expected_cc, country_codes)
-		return encodings
+		# For expected country codes, see web_api.functionality.country_code_mapper - verified with the schema
+		return self._schema.country_codes.encode_all(country_codes)
 
 
 	def poi_pairs_one_hot(self, poi_pairs):
@@ -428,17 +592,10 @@ class IdsConverter(object):
 		returns: A two-dimensional numpy.ndarray with a 4+7=11 element binary encoding per row.
 		"""
 
-		# For expected POI types, see turtlesim_expl.pipes.pose_processor
-		expected_types = ["gas station", "nsa hq", "private home", "restaurant"]
-		ids_tools.verify_md5(expected_types, "e545240e0a39da6af18c018df5952044")
-		# For expected POI results, see web_api.functionality.poi_mapper
-		exptected_results = ["Aral", "French", "German", "Italian", "Shell", "Total", "Invalid"]
-		ids_tools.verify_md5(exptected_results, "88234d800fbb78a73e0dd99379461e07")
-
-		poi_pairs_array = numpy.array(poi_pairs)
-
-		types_encodings = self.generic_one_hot(expected_types, poi_pairs_array[:, 0])
-		results_encodings = self.generic_one_hot(exptected_results, poi_pairs_array[:, 1])
+		# For expected POI types and results, see turtlesim_expl.pipes.pose_processor and
+		# web_api.functionality.poi_mapper - verified with the schema
+		types_encodings = self._schema.poi_types.encode_all([pair[0] for pair in poi_pairs])
+		results_encodings = self._schema.poi_results.encode_all([pair[1] for pair in poi_pairs])
 
 		encodings = numpy.concatenate((types_encodings, results_encodings), axis=1)
 		return encodings
@@ -454,6 +611,38 @@ class IdsConverter(object):
 		return numpy.array(encoded_positions)
 
 
+	def encode_positions_matrix(self, positions):
+		"""
+		Convert the given "x,y" GPS position strings to scaled (x, y) rows.
+		returns: A two-dimensional numpy.ndarray with 2 columns if all positions are set or 0 if none are.
+		"""
+
+		split_positions = self.split_positions(positions)
+		if split_positions is None:
+			return numpy.empty((len(positions), 0), dtype=numpy.float_)
+
+		return self.positions_scale(split_positions)
+
+
+	def split_positions(self, positions):
+		"""
+		Split the given "x,y" GPS position strings.
+		returns: A list of [x, y] string pairs or None if no position is set.
+		"""
+
+		if not any(positions):
+			return None
+
+		if not all(positions):
+			raise ValueError("Either all or none of the given entries need to have a GPS position")
+
+		split_positions = [position.split(",") for position in positions]
+		if any([len(split) != 2 for split in split_positions]):
+			raise ValueError("Invalid string")
+
+		return split_positions
+
+
 	def position_to_none_or_scaled(self, position):
 		""" Convert the given GPS position string to (x, y). """
 
@@ -476,30 +665,16 @@ class IdsConverter(object):
 		returns: A two-dimensional numpy.ndarray scaled positions per row.
 		"""
 
-		scaled = self.generic_scale(
-			values=positions,
-			range_min=-1, range_max=1,
-			min_v=0, max_v=499
-		)
-		return scaled
+		return self._schema.position_scale.scale_all(positions)
 
 
 	def generic_one_hot(self, expected_values, values):
 		"""
 		Do a one-hot encoding of the given values, which are one of expected_values.
+		Same encoding as a sklearn.preprocessing.LabelBinarizer fitted to expected_values.
 		returns: A two-dimensional numpy.ndarray with one encoding per row.
 		"""
-
-		if any([value not in expected_values for value in values]):
-			filtered = filter(lambda x: x not in expected_values, values)
-			raise ValueError("Given values \"{}\" are invalid! Expected one of: {}"
-				.format(filtered, expected_values))
-
-		binariser = sk_pre.LabelBinarizer()
-		binariser.fit(expected_values)
-
-		encodings = binariser.transform(values)
-		return encodings
+		return ids_schema.OneHotTable.compile(expected_values).encode_all(values)
 
 
 	# pylint: disable-msg=C0103; (Snake-case naming)
@@ -511,29 +686,34 @@ class IdsConverter(object):
 		returns: A two-dimensional numpy.ndarray with scaled values.
 		"""
 
-		# pylint: disable-msg=C0103; (Snake-case naming)
-		X = numpy.array(values, dtype=numpy.float_)
+		scale = ids_schema.Scale(
+			min_v=float(min_v), max_v=float(max_v),
+			range_min=float(range_min), range_max=float(range_max))
+		return scale.scale_all(values)
+
 
-		if X.ndim != 2:
-			raise ValueError("generic_scale() requires a two-dimensional input")
+	### Verification ###
 
-		X_min = numpy.array([float(min_v) for _ in values[0]])
-		X_max = numpy.array([float(max_v) for _ in values[0]])
 
-		# Source: http://scikit-learn.org/stable/modules/generated/sklearn.preprocessing.MinMaxScaler.html
-		X_std = (X - X_min) / (X_max - X_min)
-		X_scaled = X_std * (range_max - range_min) + range_min
+	def verify_vectors(self, ndarray, app_id):
+		""" Verifies the given two-dimensional ndarray has one vector per row that fits the app_id classifier. """
 
-		return X_scaled
+		if not isinstance(ndarray, numpy.ndarray) or ndarray.dtype != self.dtype or ndarray.ndim != 2:
+			raise ValueError("Given array is of invalid type.")
 
+		if app_id not in self.app_ids:
+			raise ValueError("Invalid app_id: {}".format(app_id))
 
-	### Verification ###
+		expected_len = self._vector_constraints[app_id][self._len_key]
+		if ndarray.shape[1] != expected_len:
+			raise ValueError("Given ndarray (app_id: %s) has invalid length. Expected %s; Got: %s"
+				% (app_id, expected_len, ndarray.shape[1]))
 
 
 	def verify_vector(self, ndarray, app_id):
 		""" Verifies the given ndarray fits the app_id classifier. """
 
-		if not isinstance(ndarray, numpy.ndarray) or ndarray.dtype != numpy.float_:
+		if not isinstance(ndarray, numpy.ndarray) or ndarray.dtype != self.dtype:
 			raise ValueError("Given array is of invalid type.")
 
 		if app_id not in self.app_ids:
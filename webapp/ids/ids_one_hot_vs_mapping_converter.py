@@ -10,8 +10,8 @@ import ids_tools
 
 class OneHotVsMappingConverter(IdsConverter):
 
-	def __init__(self):
-		super(OneHotVsMappingConverter, self).__init__()
+	def __init__(self, dtype=numpy.float_, label_dtype=None):
+		super(OneHotVsMappingConverter, self).__init__(dtype, label_dtype)
 
 		## Verifier data ##
 		# 1 for a binarised level (only two options)
@@ -37,6 +37,11 @@ class OneHotVsMappingConverter(IdsConverter):
 		self._vector_constraints[ids_data.POSE_TSP][self._len_key] += 4
 
 
+	def log_entry_to_vector(self, app_id, log_entry, binary=True):
+		""" The compiled schema holds the one-hot encoding - use the mapping of log_entries_to_vectors(). """
+		return self.log_entries_to_vectors(app_id, [log_entry])[0]
+
+
 	def encode_log_messages(self, app_id, log_messages):
 		"""
 		Either just convert the data or do convert to mapping
@@ -107,3 +112,16 @@ class OneHotVsMappingConverter(IdsConverter):
 			encoded_positions.append([int(x) for x in split])
 
 		return numpy.array(encoded_positions)
+
+
+	def encode_positions_matrix(self, positions):
+		"""
+		Given: strings "x,y"
+		returns: numpy.ndarray with [int(x),int(y)] per row - or no columns if no position is set
+		"""
+
+		split_positions = self.split_positions(positions)
+		if split_positions is None:
+			return numpy.empty((len(positions), 0))
+
+		return numpy.array([[int(x) for x in split] for split in split_positions])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+""" Conversion of log entries in a pool of worker processes """
+
+import multiprocessing
+
+import numpy
+
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# State of the running conversion: (converter, { app_id : entries }, { app_id : matrix })
+# Set before the pool is forked, so the workers inherit it - nothing of it is pickled.
+_SHARED = None
+
+
+def log_entries_to_X_y_dict(converter, all_log_entries, binary=True, processes=None,
+	chunk_size=DEFAULT_CHUNK_SIZE):
+	"""
+	Convert the given LogEntry objects or LogBatch to { app_id : (X, y) } in a pool of worker processes.
+	Each app_id's entries are split into chunks of rows. Workers encode one chunk each and write it straight
+	into the app_id's matrix in shared memory, so only the chunks' positions are sent between processes.
+	*converter: The IdsConverter to encode with.
+	*processes: Number of worker processes. None uses one per CPU.
+	*chunk_size: Maximum number of entries per chunk.
+	returns: X as by IdsConverter.log_entries_to_vectors(), but backed by shared memory, and y as by classes_to_y()
+	"""
+
+	# pylint: disable-msg=W0603; (Global statement)
+	global _SHARED
+
+	if chunk_size <= 0:
+		raise ValueError("Chunk size must be positive valued!")
+
+	if _SHARED is not None:
+		raise ValueError("A parallel conversion is already running in this process!")
+
+	entries_per_app_id = converter.log_entries_to_dict(all_log_entries)
+
+	matrices = {}
+	chunks = []
+
+	for app_id in sorted(entries_per_app_id.keys()):
+		log_entries = entries_per_app_id[app_id]
+		matrices[app_id] = _create_shared_matrix(
+			len(log_entries), _get_width(converter, app_id, log_entries), converter.dtype)
+		chunks.extend([(app_id, start, min(start + chunk_size, len(log_entries)))
+			for start in xrange(0, len(log_entries), chunk_size)])
+
+	_SHARED = (converter, entries_per_app_id, matrices)
+
+	try:
+		pool = multiprocessing.Pool(processes)
+
+		try:
+			pool.map(_convert_chunk, chunks, chunksize=1)
+		finally:
+			pool.terminate()
+			pool.join()
+	finally:
+		_SHARED = None
+
+	X_y_dict = {}
+	for app_id, log_entries in entries_per_app_id.items():
+		classes = converter.log_entries_to_classes(log_entries, binary)
+		X_y_dict[app_id] = (matrices[app_id], converter.classes_to_y(classes))
+
+	converter.check_dict(X_y_dict)
+	return X_y_dict
+
+
+### Helpers ###
+
+
+def _get_width(converter, app_id, log_entries):
+	""" Return the number of columns of the given app_id's vectors by encoding its first entry. """
+	return converter.log_entries_to_vectors(app_id, log_entries[:1]).shape[1]
+
+
+def _create_shared_matrix(rows, columns, dtype):
+	""" Create a C-ordered float matrix in shared memory. Workers forked afterwards write to the same memory. """
+
+	raw_array = multiprocessing.RawArray("f" if dtype == numpy.float32 else "d", rows * columns)
+	return numpy.frombuffer(raw_array, dtype=dtype).reshape((rows, columns))
+
+
+def _convert_chunk(chunk):
+	""" Worker: Encode the given (app_id, start, stop) chunk into its rows of the app_id's shared matrix. """
+
+	converter, entries_per_app_id, matrices = _SHARED
+	app_id, start, stop = chunk
+
+	matrices[app_id][start:stop] = converter.log_entries_to_vectors(app_id, entries_per_app_id[app_id][start:stop])
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+""" Compiled encoding schema of the IdsConverter """
+
+# pylint: disable-msg=R0903; (Too few public methods)
+
+import attr
+import numpy
+
+import ids_data
+import ids_tools
+
+
+_SCHEMA = None
+
+
+def get_schema():
+	""" Return the schema of this process. It's compiled and verified on first use. """
+
+	# pylint: disable-msg=W0603; (Global statement)
+	global _SCHEMA
+
+	if _SCHEMA is None:
+		_SCHEMA = _compile_schema()
+
+	return _SCHEMA
+
+
+
+@attr.s(frozen=True)
+class OneHotTable(object):
+	"""
+	One-hot encoding of a fixed set of values, as by a fitted sklearn.preprocessing.LabelBinarizer:
+	One column per value in sorted order - or a single column for the greater of two values.
+	"""
+
+	values = attr.ib()
+	width = attr.ib()
+	# { value : column or None for the column-less smaller value of a binary table }
+	columns = attr.ib()
+
+
+	@staticmethod
+	def compile(expected_values):
+		""" Create the table for the given values. """
+
+		values = tuple(sorted(set(expected_values)))
+
+		if len(values) == 2:
+			return OneHotTable(values=values, width=1, columns={values[0] : None, values[1] : 0})
+
+		return OneHotTable(values=values, width=len(values), columns={v : i for i, v in enumerate(values)})
+
+
+	def encode_all(self, values):
+		""" returns: A two-dimensional numpy.ndarray with one encoding per row. """
+
+		columns = [self.columns.get(value, -1) for value in values]
+		if any([c == -1 for c in columns]):
+			filtered = [v for v, c in zip(values, columns) if c == -1]
+			raise ValueError("Given values \"{}\" are invalid! Expected one of: {}"
+				.format(filtered, list(self.values)))
+
+		encodings = numpy.zeros((len(values), self.width), dtype=numpy.int_)
+
+		rows = [r for r, c in enumerate(columns) if c is not None]
+		encodings[rows, [columns[r] for r in rows]] = 1
+
+		return encodings
+
+
+	def encode_into(self, vector, offset, value):
+		""" Set the bit of the given value in the given vector, which has this encoding at offset. """
+
+		if value not in self.columns:
+			raise ValueError("Given value \"{}\" is invalid! Expected one of: {}".format(value, list(self.values)))
+
+		column = self.columns[value]
+		if column is not None:
+			vector[offset + column] = 1.0
+
+
+
+@attr.s(frozen=True)
+class Scale(object):
+	""" Linear scaling from [min_v,max_v] to [range_min,range_max]. Create it with float values. """
+
+	min_v = attr.ib()
+	max_v = attr.ib()
+	range_min = attr.ib()
+	range_max = attr.ib()
+
+
+	def scale_all(self, values):
+		""" returns: The given two-dimensional array scaled as a numpy.ndarray. """
+
+		# pylint: disable-msg=C0103; (Snake-case naming)
+		X = numpy.array(values, dtype=numpy.float_)
+
+		if X.ndim != 2:
+			raise ValueError("Scaling requires a two-dimensional input")
+
+		# Source: http://scikit-learn.org/stable/modules/generated/sklearn.preprocessing.MinMaxScaler.html
+		X_std = (X - self.min_v) / (self.max_v - self.min_v)
+		return X_std * (self.range_max - self.range_min) + self.range_min
+
+
+	def scale(self, value):
+		""" returns: The given value scaled as float - same result as scale_all(). """
+
+		value_std = (float(value) - self.min_v) / (self.max_v - self.min_v)
+		return value_std * (self.range_max - self.range_min) + self.range_min
+
+
+
+@attr.s(frozen=True)
+class AppSchema(object):
+	"""
+	The vector layout of one app_id: Columns for the level, the log message and (optionally) the GPS position.
+	Encodes single entries with table lookups and the precomputed scales.
+	"""
+
+	app_id = attr.ib()
+	width = attr.ib()
+	level_table = attr.ib()
+	# Each encoder is a function (vector, offset, log_message) -> None that fills message_width columns
+	message_encoder = attr.ib()
+	message_width = attr.ib()
+	position_scale = attr.ib()
+
+
+	def encode(self, level, log_message, gps_position, dtype=numpy.float_):
+		""" returns: The vector as one-dimensional numpy.ndarray of the given dtype. """
+
+		vector = numpy.zeros(self.width, dtype=dtype)
+
+		self.level_table.encode_into(vector, 0, level)
+		offset = self.level_table.width
+
+		self.message_encoder(vector, offset, log_message)
+		offset += self.message_width
+
+		if (self.position_scale is not None) != bool(gps_position):
+			raise ValueError("Entries of {} need {} GPS position".format(
+				self.app_id, "a" if self.position_scale is not None else "no"))
+
+		if self.position_scale is not None:
+			split = gps_position.split(",")
+			if len(split) != 2:
+				raise ValueError("Invalid string")
+
+			vector[offset] = self.position_scale.scale(split[0])
+			vector[offset + 1] = self.position_scale.scale(split[1])
+
+		return vector
+
+
+
+@attr.s(frozen=True)
+class IdsSchema(object):
+	""" Tables and scales of all encodings and the layout of each app_id's vectors """
+
+	levels = attr.ib()
+	country_codes = attr.ib()
+	poi_types = attr.ib()
+	poi_results = attr.ib()
+	colour_scale = attr.ib()
+	position_scale = attr.ib()
+	# { app_id : AppSchema }
+	app_schemas = attr.ib()
+
+
+	def get_app_schema(self, app_id):
+		""" Return the AppSchema of the given app_id. """
+
+		if app_id not in self.app_schemas:
+			raise ValueError("Invalid app_id: {}".format(app_id))
+
+		return self.app_schemas[app_id]
+
+
+
+### Compilation ###
+
+
+def _compile_schema():
+	""" Verify the expected values and compile them to the schema. """
+
+	# For expected levels, see web_api.log_entry.LogEntry
+	expected_levels = ["DEBUG", "ERROR"]
+	ids_tools.verify_md5(expected_levels, "7692bbdba09aa7f2c9a15ca0e9a654cd")
+
+	# For expected country codes, see web_api.functionality.country_code_mapper
+	expected_cc = ids_data.get_country_codes()
+	ids_tools.verify_md5(expected_cc, "b1d9e303bda676c3c6a61dc21e1d07c3")
+
+	# For expected POI types, see turtlesim_expl.pipes.pose_processor
+	expected_types = ["gas station", "nsa hq", "private home", "restaurant"]
+	ids_tools.verify_md5(expected_types, "e545240e0a39da6af18c018df5952044")
+	# For expected POI results, see web_api.functionality.poi_mapper
+	exptected_results = ["Aral", "French", "German", "Italian", "Shell", "Total", "Invalid"]
+	ids_tools.verify_md5(exptected_results, "88234d800fbb78a73e0dd99379461e07")
+
+	levels = OneHotTable.compile(expected_levels)
+	country_codes = OneHotTable.compile(expected_cc)
+	poi_types = OneHotTable.compile(expected_types)
+	poi_results = OneHotTable.compile(exptected_results)
+
+	colour_scale = Scale(min_v=0.0, max_v=255.0, range_min=0.0, range_max=1.0)
+	position_scale = Scale(min_v=0.0, max_v=499.0, range_min=-1.0, range_max=1.0)
+
+	def app_schema(app_id, message_encoder, message_width, has_position):
+		return AppSchema(
+			app_id=app_id,
+			width=levels.width + message_width + (2 if has_position else 0),
+			level_table=levels,
+			message_encoder=message_encoder,
+			message_width=message_width,
+			position_scale=position_scale if has_position else None)
+
+	app_schemas = {}
+
+	# Generators send "{f}"
+	for app_id in ids_data.get_generators():
+		app_schemas[app_id] = app_schema(app_id, _encode_float_message, 1, has_position=False)
+
+	# Colour sends "{i},{i},{i}"
+	for app_id in ids_data.get_colours():
+		app_schemas[app_id] = app_schema(
+			app_id, _create_scaled_message_encoder(colour_scale, 3, int), 3, has_position=True)
+
+	# Country code string like "DE" or "CH"
+	app_schemas[ids_data.POSE_CC] = app_schema(
+		ids_data.POSE_CC, _create_one_hot_message_encoder([country_codes]), country_codes.width, has_position=True)
+
+	# POI pair "type,result"
+	app_schemas[ids_data.POSE_POI] = app_schema(
+		ids_data.POSE_POI, _create_one_hot_message_encoder([poi_types, poi_results]),
+		poi_types.width + poi_results.width, has_position=True)
+
+	# Two positions as "{},{},{},{}" (start,end as x,y)
+	app_schemas[ids_data.POSE_TSP] = app_schema(
+		ids_data.POSE_TSP, _create_scaled_message_encoder(position_scale, 4, float, value_range=(0, 500)), 4,
+		has_position=True)
+
+	return IdsSchema(
+		levels=levels,
+		country_codes=country_codes,
+		poi_types=poi_types,
+		poi_results=poi_results,
+		colour_scale=colour_scale,
+		position_scale=position_scale,
+		app_schemas=app_schemas)
+
+
+def _encode_float_message(vector, offset, log_message):
+	vector[offset] = float(log_message)
+
+
+def _create_scaled_message_encoder(scale, part_count, convert, value_range=None):
+	""" Encoder of messages with part_count comma-separated numbers, converted and scaled. """
+
+	def encode(vector, offset, log_message):
+		parts = [convert(p) for p in log_message.split(",")]
+		if len(parts) != part_count:
+			raise ValueError("Expected {} values. Got: {}".format(part_count, log_message))
+
+		for index, part in enumerate(parts):
+			if value_range is not None and not value_range[0] <= part < value_range[1]:
+				raise ValueError("Value out of range: {}".format(log_message))
+
+			vector[offset + index] = scale.scale(part)
+
+	return encode
+
+
+def _create_one_hot_message_encoder(tables):
+	""" Encoder of messages with one comma-separated part per table - or the whole message for one table. """
+
+	def encode(vector, offset, log_message):
+		parts = log_message.split(",") if len(tables) > 1 else [log_message]
+		if len(parts) != len(tables):
+			raise ValueError("Expected {} values. Got: {}".format(len(tables), log_message))
+
+		for table, part in zip(tables, parts):
+			table.encode_into(vector, offset, part)
+			offset += table.width
+
+	return encode
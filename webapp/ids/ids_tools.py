@@ -10,6 +10,8 @@ import warnings
 import sklearn.model_selection as sk_mod
 
 from log_entry import LogEntry
+import field_codes
+import log_parser
 import ids_data
 
 
@@ -112,14 +114,36 @@ def get_md5_hex(obj):
 ### LogEntry handling ###
 
 
+# Stripped app_id per code of field_codes.APP_IDS - each app_id is only stripped once
+_STRIPPED_APP_IDS = []
+
+
 def log_entry_to_app_id(log_entry):
 	""" Extract and sanitize the app_id from the given LogEntry object. """
+	return _strip_app_id_code(log_entry.app_id_code)
+
+
+def strip_app_id(app_id):
+	""" Strip the given app_id of its ID. """
+	return _strip_app_id_code(field_codes.APP_IDS.encode(app_id))
+
+
+def _strip_app_id_code(code):
+	""" Return the stripped app_id of the given code, stripping it on first use. """
+
+	stripped_app_id = _STRIPPED_APP_IDS[code] if code < len(_STRIPPED_APP_IDS) else None
+
+	if stripped_app_id is None:
+		stripped_app_id = _strip_app_id_value(field_codes.APP_IDS.decode(code))
+
+		if code >= len(_STRIPPED_APP_IDS):
+			_STRIPPED_APP_IDS.extend([None] * (code + 1 - len(_STRIPPED_APP_IDS)))
+		_STRIPPED_APP_IDS[code] = stripped_app_id
 
-	app_id = log_entry.data[LogEntry.APP_ID_FIELD]
-	return _strip_app_id(app_id)
+	return stripped_app_id
 
 
-def _strip_app_id(app_id):
+def _strip_app_id_value(app_id):
 	""" Strip the given app_id of its ID. """
 
 	# Match indices in the form of _1
@@ -314,8 +338,8 @@ def reservoir_sample_limit(item_generator, sample_size, limit_to):
 		line
 		for line
 		in item_generator
-		# Convert line to LogEntry, check that app_id is in the allowed limits
-		if log_entry_to_app_id(LogEntry.from_log_string(line)) in limit_to
+		# Parse the line's app_id, check that it is in the allowed limits
+		if strip_app_id(log_parser.parse_line(line, fields=[LogEntry.APP_ID_FIELD])[0]) in limit_to
 	)
 
 	return reservoir_sample(limited_generator, sample_size)
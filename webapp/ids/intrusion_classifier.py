@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 """ Classifier """
 
+import time
+
+import numpy
 import sklearn.metrics as sk_met
 import sklearn.model_selection as sk_mod
 import sklearn.svm as sk_svm
 
+import log_batch
 from log_entry import LogEntry
 import util.fmtr
+import util.mtrc
 import util.prtr
 
 import ids_tools
@@ -15,6 +20,10 @@ from dir_utils import ModelDir
 from ids_classification import IdsResult, Classification
 
 
+_CLASSIFICATION_DURATION = util.mtrc.REGISTRY.histogram(
+	"ids_classification_seconds", "Time spent per entry in the learning system", ["app_id"])
+
+
 class IntrusionClassifier(object):
 	""" Classify intrusions rule- and learning-based """
 
@@ -39,7 +48,8 @@ class IntrusionClassifier(object):
 		if IntrusionClassifier._INSTANCE:
 			raise ValueError("Class is already instantiated! Retrieve the instance with get_singleton().")
 
-		self._converter = ids_converter.IdsConverter()
+		# Vectors as float32 and classes as int8 - half the memory of the default types
+		self._converter = ids_converter.IdsConverter(dtype=numpy.float32, label_dtype=numpy.int8)
 
 		self._int_label_mapping = ids_tools.flip_dict(
 			self._converter.label_int_mapping,
@@ -69,6 +79,43 @@ class IntrusionClassifier(object):
 
 		# 2) Learning system: If confidence > 60 %: return
 		learner_result = self._classify_learner(log_entry)
+		return self._select_result(rule_result, learner_result)
+
+
+	def classify_all(self, log_entries):
+		"""
+		Classify the given log entries in bulk. Runs one prediction per app_id.
+		returns: A list of IdsResult objects in the order of the given entries
+		"""
+
+		# 1) Rule-based system for all entries
+		results = [self._classify_rule_based(log_entry) for log_entry in log_entries]
+
+		# { app_id : [index of each entry the rules were not certain about] }
+		learner_indices_per_app_id = {}
+		for index, (log_entry, rule_result) in enumerate(zip(log_entries, results)):
+			if rule_result.confidence == 100:
+				continue
+
+			app_id = ids_tools.log_entry_to_app_id(log_entry)
+			if app_id not in learner_indices_per_app_id:
+				learner_indices_per_app_id[app_id] = []
+			learner_indices_per_app_id[app_id].append(index)
+
+		# 2) Learning system for the remaining entries, grouped by app_id
+		for app_id, indices in learner_indices_per_app_id.items():
+			learner_results = self._classify_learner_all(app_id, [log_entries[i] for i in indices])
+
+			for index, learner_result in zip(indices, learner_results):
+				results[index] = self._select_result(results[index], learner_result)
+
+		return results
+
+
+	@staticmethod
+	def _select_result(rule_result, learner_result):
+		""" Select the learner's result if it is confident enough, else the more confident one. """
+
 		if learner_result.confidence > 60:
 			return learner_result
 
@@ -85,7 +132,7 @@ class IntrusionClassifier(object):
 		"""
 
 		# Level cannot be ERROR
-		if log_entry.data[LogEntry.LEVEL_FIELD] == LogEntry.LEVEL_ERROR:
+		if log_entry.level == LogEntry.LEVEL_ERROR:
 			return IdsResult(classification=Classification.intrusion, confidence=100)
 
 		return IdsResult(classification=Classification.normal, confidence=0)
@@ -97,13 +144,45 @@ class IntrusionClassifier(object):
 		returns: An IdsResult object
 		"""
 
+		app_id = ids_tools.log_entry_to_app_id(log_entry)
+
 		if self._models is None:
 			raise IOError("Some or all model files are missing.")
 
-		app_id = ids_tools.log_entry_to_app_id(log_entry)
+		time_before = time.time()
+
+		# A single entry is encoded with the compiled schema instead of the batch conversion
 		vector = self._converter.log_entry_to_vector(app_id, log_entry)
+		predicted_class = self._models[app_id].predict(vector.reshape(1, -1))[0]
+
+		_CLASSIFICATION_DURATION.observe(time.time() - time_before, app_id=app_id)
+
+		return self._prediction_to_result(predicted_class)
 
-		predicted_class = self._models[app_id].predict([vector])[0]
+
+	def _classify_learner_all(self, app_id, log_entries):
+		"""
+		Classify the given entries of the given app_id based on a learning system.
+		returns: A list of IdsResult objects
+		"""
+
+		if self._models is None:
+			raise IOError("Some or all model files are missing.")
+
+		time_before = time.time()
+
+		vectors = self._converter.log_entries_to_vectors(app_id, log_entries)
+
+		predicted_classes = self._models[app_id].predict(vectors)
+
+		_CLASSIFICATION_DURATION.observe(
+			(time.time() - time_before) / len(log_entries), count=len(log_entries), app_id=app_id)
+
+		return [self._prediction_to_result(predicted_class) for predicted_class in predicted_classes]
+
+
+	def _prediction_to_result(self, predicted_class):
+		""" Map the given predicted class to an IdsResult object. """
 
 		classification = Classification.normal
 		if self._converter.class_means_intruded(predicted_class):
@@ -116,84 +195,86 @@ class IntrusionClassifier(object):
 	### Train ###
 
 
-	def train(self, log_entry_generator, squelch_output=False):
+	def train(self, log_entry_generator, squelch_output=False, limit=5000000):
 		"""
 		Train the app_id based classifiers with the given labelled entries.
-		Only loads up to 5 mio entries to ensure the process does not consume too much memory.
+		Entries are streamed and converted chunk by chunk, so only the vectors of the normal entries are kept.
+		*log_entry_generator: Iterable of LogEntry and/or LogBatch objects, or a LogBatch.
+		*limit: Maximum number of entries to use. Bounds the training time of the models.
 		"""
 
 		if self._has_models():
 			raise ValueError("There are existing model files on disk.")
 
-		limit = 5000000
-
 		printer = util.prtr.Printer(squelch=squelch_output, name="IC")
 
 		printer.prt("Streaming from file up to a maximum of {} entries.".format(limit))
 		printer.prt("Loading and converting entries...")
 
-		ids_entries_dict = self._read_convert_entries(log_entry_generator, limit)
+		train_dict, removed_per_app_id = self._read_convert_entries(log_entry_generator, limit)
 
-		self._train_entries(ids_entries_dict, printer)
+		self._train_entries(train_dict, removed_per_app_id, printer)
 
 		printer.prt("Finished training classifiers for {}/{} app ids."
-			.format(len(ids_entries_dict), len(self._converter.app_ids)))
+			.format(len(train_dict), len(self._converter.app_ids)))
 
 
 	def _read_convert_entries(self, log_entry_generator, limit):
 		"""
-		Read up to <limit> entries from disk and convert them to (app_id, vector, class) tuples.
-		returns: found_app_ids (set) and converted_entries (tuple list)
+		Read up to <limit> entries chunk by chunk and convert them to vectors.
+		Intruded entries are dropped per chunk, as the classifiers learn normal behaviour only.
+		returns: { app_id : X } of the normal entries and { app_id : number of dropped entries }
 		"""
 
-		# Read up to <limit> entries
-		log_entries = []
-		for log_entry in log_entry_generator:
-			if len(log_entries) == limit:
-				break
+		# pylint: disable-msg=C0103; (Invalid variable name)
+		blocks_per_app_id = {}
+		removed_per_app_id = {}
+
+		log_batches = log_batch.yield_batches(log_entry_generator, limit=limit)
+
+		# class_means_intruded() expects the multi-class labels
+		for app_id, X_block, y_block in self._converter.yield_X_y_blocks(log_batches, binary=False):
+			normal_rows = numpy.array([not self._converter.class_means_intruded(c) for c in y_block], dtype=bool)
+
+			blocks_per_app_id.setdefault(app_id, []).append(X_block[normal_rows])
+			removed_per_app_id[app_id] = removed_per_app_id.get(app_id, 0) + len(y_block) - int(normal_rows.sum())
 
-			log_entries.append(log_entry)
+		train_dict = {}
+		for app_id, blocks in blocks_per_app_id.items():
+			train_dict[app_id] = numpy.concatenate(blocks)
 
-		# Convert entries to { app_id : (X, y) } dict
-		ids_entries_dict = self._converter.log_entries_to_ids_entries_dict(log_entries)
-		return ids_entries_dict
+		return train_dict, removed_per_app_id
 
 
-	def _train_entries(self, ids_entries_dict, printer):
-		""" Train all app_id based classifiers with the given labelled entries. """
+	def _train_entries(self, train_dict, removed_per_app_id, printer):
+		""" Train all app_id based classifiers with the given { app_id : X } dict of normal entries. """
 
 		app_id_number = 1
-		for app_id, ids_entries in ids_entries_dict.items():
+		for app_id, X_train in sorted(train_dict.items()):
 			printer.prt("({}/{}) Training model for \"{}\": "
-				.format(app_id_number, len(ids_entries_dict), app_id), newline=False)
+				.format(app_id_number, len(train_dict), app_id), newline=False)
 
 			# Check for existing model
 			if ModelDir.has_model(app_id):
 				raise IOError("Found existing model on disk!")
 
-			self._train_entries_per_app(app_id, ids_entries, printer)
+			self._train_entries_per_app(app_id, X_train, removed_per_app_id.get(app_id, 0), printer)
 
 			app_id_number += 1
 
 
-	def _train_entries_per_app(self, app_id, ids_entries, printer):
-		""" Train this app_id based classifier with the given labelled entries. """
-
-		printer.prt("Starting training with {} entries".format(len(ids_entries)))
+	# pylint: disable-msg=C0103; (Invalid argument name)
+	def _train_entries_per_app(self, app_id, X_train, removed_count, printer):
+		"""
+		Train this app_id based classifier with the given vectors of normal entries.
+		*removed_count: Number of intruded entries that were dropped from the input.
+		"""
 
-		# Ensure the classifier has only samples for normal behaviour to learn from.
-		printer.prt("Checking for intruded entries...")
-		og_entry_count = len(ids_entries)
-		ids_entries[:] = [e for e in ids_entries
-			if not self._converter.class_means_intruded(e.vclass)]
+		printer.prt("Starting training with {} entries".format(len(X_train)))
 
-		if len(ids_entries) != og_entry_count:
+		if removed_count:
 			printer.prt("Warning! Found intruded data in the input file. {} entries were removed."
-				.format(og_entry_count - len(ids_entries)))
-
-		printer.prt("Converting...")
-		# pylint: disable-msg=C0103; (Invalid variable name)
-		X_train, _ = self._converter.ids_entries_to_X_y(ids_entries, app_id)
+				.format(removed_count))
 
 		printer.prt("Creating and training new model... ", newline=False)
 		clf = sk_svm.OneClassSVM(random_state=0)
@@ -1,46 +1,83 @@
 #!/usr/bin/env python
 """ Live IDS """
 
-import os
-import time
-
+import util.mtrc
 from intrusion_classifier import IntrusionClassifier
 from ids_classification import Classification
 from dir_utils import LogDir, ModelDir
+from alert_feed import AlertFeed, AlertJournal
+import ids_tools
+
+
+_INTRUSIONS_DETECTED = util.mtrc.REGISTRY.counter(
+	"ids_intrusions_detected_total", "Number of detected intrusions", ["app_id"])
 
 
 class LiveIds(object):
 	""" Live intrusion detection """
 
-	def __init__(self, verbose):
-		""" Ctor """
+	def __init__(self, verbose, alert_feed=None):
+		"""
+		Ctor
+		*alert_feed: AlertFeed to publish detections to.
+		Defaults to one with a journal at LogDir/alerts.log.
+		"""
 
 		object.__init__(self)
 
 		self._verbose = verbose
 		self.classifier = IntrusionClassifier()
 
+		if alert_feed is None:
+			alert_feed = AlertFeed(journal=AlertJournal(LogDir.get_log_path_for("alerts")))
+		self.alert_feed = alert_feed
+
 
 	def process(self, log_entry):
 		""" Process the given entry. Outputs a warning when the detection was successful. """
 
 		result = self.classifier.classify(log_entry)
+		self._handle_result(log_entry, result)
+
+
+	def process_all(self, log_entries, runner=None):
+		"""
+		Process the given entries in bulk. Outputs a warning for each successful detection.
+		*runner: Optional callable(func, args) that runs the classification, e.g. a thread pool's apply.
+		The alerts are published in the calling thread either way.
+		"""
+
+		if runner is None:
+			results = self.classifier.classify_all(log_entries)
+		else:
+			results = runner(self.classifier.classify_all, (log_entries,))
+
+		for log_entry, result in zip(log_entries, results):
+			self._handle_result(log_entry, result)
+
+
+	def _handle_result(self, log_entry, result):
+		""" Publish an alert if the result denotes an intrusion. Outputs a warning in verbose mode. """
+
 		if result.classification == Classification.normal and result.confidence > 0:
 			return
 
-		file_path = self._write_intrusion_to_file(log_entry, result)
+		app_id = ids_tools.log_entry_to_app_id(log_entry)
+		_INTRUSIONS_DETECTED.inc(app_id=app_id)
 
-		message = "INTRUSION DETECTED. Log file saved at: {}".format(file_path)
-		if self._verbose:
-			message = "\n!!!\n" + message + "\n!!!\n"
+		alert = self.alert_feed.publish(log_entry.get_log_string(), app_id,
+			result.classification.name, result.confidence)
 
-		print(message)
+		if self._verbose:
+			print("\n!!!\nINTRUSION DETECTED. Alert #{} | {}\n!!!\n".format(alert["seq"], alert["log_entry"]))
 
 
-	# pylint: disable-msg=R0201; (Method could be a function)
 	def reset_log(self):
 		""" Move the intrusion logs to a new sub directory. """
 
+		# The journal is reopened in the log directory with the next alert
+		self.alert_feed.close_journal()
+
 		message = "Intrusion logs: " + LogDir.reset_dir()
 		return message
 
@@ -50,33 +87,3 @@ class LiveIds(object):
 
 		message = "IDS models: " + ModelDir.reset_dir()
 		return message
-
-
-	@staticmethod
-	def _write_intrusion_to_file(log_entry, result):
-		"""
-		Write the given IdsResult to a new file.
-		returns: The relative file path of the log file.
-		"""
-
-		time_str = time.strftime("%A %B %d %Y - %H:%M:%S", time.localtime())
-
-		log_folder = LogDir.get_log_dir()
-
-		log_file_path = os.path.join(log_folder, LogDir.create_unique_log_name())
-		with open(log_file_path, mode="w") as log_file:
-			LiveIds._write_line(log_file, "Intrusion detected | {}".format(time_str))
-			LiveIds._write_line(log_file, "")
-			LiveIds._write_line(log_file, "Classification: {}".format(result.classification.name))
-			LiveIds._write_line(log_file, "Confidence: {} %".format(result.confidence))
-			LiveIds._write_line(log_file, "")
-			LiveIds._write_line(log_file, "Data received:")
-			LiveIds._write_line(log_file, log_entry.get_log_string())
-
-		return log_file_path
-
-
-	@staticmethod
-	def _write_line(file_handle, text):
-		""" Write to the file and append a newline. """
-		file_handle.write(text + "\n")
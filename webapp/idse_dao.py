@@ -2,6 +2,7 @@
 """ Convenient access to IDS entries, stored in various forms. """
 
 import argparse
+import itertools
 import os
 from collections import namedtuple
 from enum import Enum
@@ -9,6 +10,7 @@ from enum import Enum
 import numpy
 
 from log_entry import LogEntry
+import log_parser
 from ids.dir_utils import Dir
 from ids.ids_converter import IdsConverter
 from ids.ids_entry import IdsEntry
@@ -41,10 +43,11 @@ VERIFIER = [
 ]
 
 
-def yield_entries(file_path, limit=None):
+def yield_entries(file_path, limit=None, processes=1):
 	"""
 	Yield IdsEntry objects from the given file. First access on log files is costly!
 	*limit: Optional maximum number of entries to retrieve.
+	*processes: Number of worker processes to convert log files in; see IdsConverter.
 	"""
 
 	if not os.path.lexists(file_path):
@@ -58,7 +61,7 @@ def yield_entries(file_path, limit=None):
 	if file_type == FileType.IDSE_FILE:
 		return _yield_idse_lines(yielder)
 	elif file_type == FileType.LOG_FILE:
-		return _read_log_lines_then_yield(yielder, first_line)
+		return _read_log_lines_then_yield(yielder, first_line, processes)
 	else:
 		raise NotImplementedError("File type not implemented: %s" % file_type)
 
@@ -233,16 +236,12 @@ def _get_expected_types(requested_length):
 	return ELEMENT_TYPES + [ELEMENT_TYPES[3]] * (requested_length - len(ELEMENT_TYPES))
 
 
-def _read_log_lines_then_yield(yielder, first_line):
+def _read_log_lines_then_yield(yielder, first_line, processes):
 	""" Read all provided log lines from the given yielder. """
 
-	first_entry = LogEntry.from_log_string(first_line)
-	log_entries = [first_entry]
-	for line in yielder:
-		log_entry = LogEntry.from_log_string(line)
-		log_entries.append(log_entry)
+	log_entries = list(log_parser.yield_entries(itertools.chain([first_line], yielder)))
 
-	ids_entry_dict = IdsConverter().log_entries_to_ids_entries_dict(log_entries)
+	ids_entry_dict = IdsConverter().log_entries_to_ids_entries_dict(log_entries, processes=processes)
 
 	for _, app_entries in ids_entry_dict.items():
 		for ids_entry in app_entries:
@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+""" Load generator and latency benchmark for the web API """
+
+# Monkey-patch
+from gevent import monkey
+monkey.patch_all()
+
+# pylint: disable-msg=C0411,C0413
+import argparse
+import httplib
+import json
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib
+
+import gevent
+import gevent.pool
+
+from log_entry import LogEntry
+import binary_records
+import ids.ids_data as ids_data
+import util.fmtr
+import util.outp
+import util.stat
+
+
+PROTOCOLS = ["form", "batch", "binary"]
+
+# Coordinates as sent by the ROS nodes
+_CRD_MAX = 499
+_NORMAL_LABEL = "normal"
+
+
+class RequestFactory(object):
+	""" Synthesizes requests for all five endpoints as the ROS nodes would send them. """
+
+	def __init__(self, vin_count, intrusion_ratio, seed=None):
+		""" Ctor """
+
+		object.__init__(self)
+
+		if vin_count <= 0:
+			raise ValueError("VIN count must be positive valued!")
+		if intrusion_ratio < 0 or intrusion_ratio > 1:
+			raise ValueError("Intrusion ratio must be in [0, 1]")
+
+		self._rand = random.Random(seed)
+		self._intrusion_ratio = intrusion_ratio
+
+		# Same VIN format as ids_tools.generate_log_entries()
+		self._vins = [chr(self._rand.randint(65, 90)) + str(x)
+			for x in self._rand.sample(range(100000, 900000), vin_count)]
+
+		self._creators = [
+			self._create_data_request,
+			self._create_colour_request,
+			self._create_country_code_request,
+			self._create_poi_request,
+			self._create_tsp_request
+		]
+
+
+	def create(self):
+		"""
+		Create one request for a random endpoint.
+		returns: (endpoint, params) - e.g. ("log/data/gaussian", {"vin" : ..., "generated" : ...})
+		"""
+
+		creator = self._rand.choice(self._creators)
+		intruded = self._rand.random() < self._intrusion_ratio
+
+		endpoint, params = creator(intruded)
+		params["vin"] = self._rand.choice(self._vins)
+		return (endpoint, params)
+
+
+	def _create_data_request(self, intruded):
+		""" Generated value; intrusions are off or huge values. """
+
+		generator = self._rand.choice(ids_data.get_generators()).lower()
+		generated = self._rand.gauss(0, 1)
+		label = _NORMAL_LABEL
+
+		if intruded:
+			label = self._rand.choice(ids_data.get_intrusion_labels_gens())
+			generated = self._rand.choice([-1, 1]) * (1000 if label == "huge-error" else 10)
+
+		return ("log/data/" + generator, {"generated" : generated, "intrusion" : label})
+
+
+	def _create_colour_request(self, intruded):
+		""" Random colour; intrusions are pure red. """
+
+		colour = [self._rand.randint(0, 255) for _ in range(0, 3)]
+		label = _NORMAL_LABEL
+
+		if intruded:
+			colour = [255, 0, 0]
+			label = self._rand.choice(ids_data.get_intrusion_labels_colrs())
+
+		params = self._create_position()
+		params.update({"colour" : ",".join([str(c) for c in colour]), "intrusion" : label})
+		return ("log/colour", params)
+
+
+	def _create_country_code_request(self, intruded):
+		""" Random position; the server maps it to a country code. """
+
+		params = self._create_position()
+		params["intrusion"] = (self._rand.choice(ids_data.get_intrusion_labels_pose_cc())
+			if intruded else _NORMAL_LABEL)
+		return ("get/country-code", params)
+
+
+	def _create_poi_request(self, intruded):
+		""" Random position and POI type; intrusions request illegal types. """
+
+		params = self._create_position()
+
+		if intruded:
+			params["type"] = self._rand.choice(ids_data.get_intruded_poi_types())
+			params["intrusion"] = self._rand.choice(ids_data.get_intrusion_labels_pose_poi())
+		else:
+			params["type"] = self._rand.choice(ids_data.get_legal_poi_types())
+			params["intrusion"] = _NORMAL_LABEL
+
+		return ("get/poi", params)
+
+
+	def _create_tsp_request(self, intruded):
+		""" Random position and target; intrusions route to the current position. """
+
+		params = self._create_position()
+
+		if intruded:
+			params["targ_x"], params["targ_y"] = params["x"], params["y"]
+			params["intrusion"] = self._rand.choice(ids_data.get_intrusion_labels_pose_tsp())
+		else:
+			params["targ_x"], params["targ_y"] = self._rand.randint(0, _CRD_MAX), self._rand.randint(0, _CRD_MAX)
+			params["intrusion"] = _NORMAL_LABEL
+
+		return ("get/tsp", params)
+
+
+	def _create_position(self):
+		""" Random x and y coordinates. """
+		return {"x" : self._rand.randint(0, _CRD_MAX), "y" : self._rand.randint(0, _CRD_MAX)}
+
+
+
+def yield_requests_from_file(file_path):
+	""" Convert the entries of the given log file back to the requests that created them. """
+
+	with open(file_path, "r") as log_file:
+		for line in log_file:
+			if not line.strip():
+				continue
+
+			yield log_entry_to_request(LogEntry.from_log_string(line.strip()))
+
+
+def log_entry_to_request(log_entry):
+	""" Convert the given LogEntry to (endpoint, params) of the request that created it. """
+
+	app_id = log_entry.data[LogEntry.APP_ID_FIELD]
+	log_message = log_entry.data[LogEntry.LOG_MESSAGE_FIELD]
+
+	params = {"vin" : log_entry.data[LogEntry.VIN_FIELD]}
+	if log_entry.intrusion:
+		params["intrusion"] = log_entry.intrusion
+
+	if app_id in ids_data.get_generators():
+		params["generated"] = log_message
+		return ("log/data/" + app_id.lower(), params)
+
+	params["x"], params["y"] = log_entry.data[LogEntry.GPS_POSITION_FIELD].split(",")
+
+	if app_id in ids_data.get_colours():
+		params["colour"] = log_message
+		return ("log/colour", params)
+
+	if app_id == ids_data.POSE_CC:
+		return ("get/country-code", params)
+
+	if app_id == ids_data.POSE_POI:
+		params["type"] = log_message.split(",")[0]
+		return ("get/poi", params)
+
+	if app_id == ids_data.POSE_TSP:
+		_, _, params["targ_x"], params["targ_y"] = log_message.split(",")
+		return ("get/tsp", params)
+
+	raise ValueError("Invalid app id: {}".format(app_id))
+
+
+
+class LoadTest(object):
+	"""
+	Sends requests with the given concurrency and rate and records the latency per endpoint.
+	Each concurrent sender keeps its own connection alive.
+	"""
+
+	def __init__(self, host, port, request_generator, request_limit, duration=None, rate=None,
+		concurrency=1, protocol="form", batch_size=1):
+		"""
+		Ctor
+		*request_limit: Maximum number of records to send.
+		*duration: Optional maximum duration of the test in seconds.
+		*rate: Optional target number of HTTP requests per second over all senders.
+		*protocol: form (one request per record), batch (NDJSON) or binary (see binary_records).
+		"""
+
+		object.__init__(self)
+
+		if concurrency <= 0 or batch_size <= 0 or request_limit <= 0:
+			raise ValueError("Concurrency, batch size and request limit must be positive valued!")
+		if protocol not in PROTOCOLS:
+			raise ValueError("Invalid protocol: {}".format(protocol))
+		if protocol == "form" and batch_size != 1:
+			raise ValueError("The form protocol sends one record per request!")
+
+		self._host = host
+		self._port = port
+		self._request_generator = request_generator
+		self._records_left = request_limit
+		self._duration = duration
+		self._rate = rate
+		self._concurrency = concurrency
+		self._protocol = protocol
+		self._batch_size = batch_size
+
+		self._start_time = None
+		self._sent_count = 0
+
+		# Endpoint : [latencies in seconds]
+		self.latencies = {}
+		# Endpoint : number of failed requests
+		self.errors = {}
+		self.records_sent = 0
+		self.time_taken = None
+
+
+	def run(self):
+		""" Send all requests and block until they were answered. """
+
+		self._start_time = time.time()
+
+		pool = gevent.pool.Pool(self._concurrency)
+		for _ in range(0, self._concurrency):
+			pool.spawn(self._send_until_done)
+		pool.join()
+
+		self.time_taken = time.time() - self._start_time
+
+
+	def get_results(self):
+		"""
+		Summarise the recorded latencies per endpoint and in total.
+		returns: A list of dicts with the keys endpoint, requests, errors, rps, p50, p95 and p99.
+		"""
+
+		results = []
+		all_latencies = []
+
+		for endpoint in sorted(set(self.latencies.keys() + self.errors.keys())):
+			latencies = self.latencies.get(endpoint, [])
+			all_latencies.extend(latencies)
+			results.append(self._summarise(endpoint, latencies, self.errors.get(endpoint, 0)))
+
+		results.append(self._summarise("TOTAL", all_latencies, sum(self.errors.values())))
+		return results
+
+
+	def _summarise(self, endpoint, latencies, error_count):
+		""" Create the result dict for the given latencies. """
+
+		result = {
+			"endpoint" : endpoint,
+			"requests" : len(latencies) + error_count,
+			"errors" : error_count,
+			"rps" : len(latencies) / self.time_taken if self.time_taken else 0.0
+		}
+
+		for percent in [50, 95, 99]:
+			result["p{}".format(percent)] = (util.stat.percentile(latencies, percent)
+				if latencies else None)
+
+		return result
+
+
+	### Sending ###
+
+
+	def _send_until_done(self):
+		""" Send requests until no records or time are left. """
+
+		connection = httplib.HTTPConnection(self._host, self._port)
+
+		try:
+			while True:
+				records = self._next_records()
+				if not records:
+					return
+
+				self._wait_for_schedule()
+
+				path, body, headers, endpoint = self._build_request(records)
+				self._send(connection, path, body, headers, endpoint)
+				self.records_sent += len(records)
+		finally:
+			connection.close()
+
+
+	def _next_records(self):
+		""" Take the next records to send. Greenlets don't preempt, so no lock is required. """
+
+		if self._duration is not None and time.time() - self._start_time >= self._duration:
+			return []
+
+		records = []
+		while self._records_left > 0 and len(records) < self._batch_size:
+			try:
+				records.append(next(self._request_generator))
+			except StopIteration:
+				self._records_left = 0
+				break
+			self._records_left -= 1
+
+		return records
+
+
+	def _wait_for_schedule(self):
+		""" Sleep until the next request is due according to the rate. """
+
+		request_index = self._sent_count
+		self._sent_count += 1
+
+		if not self._rate:
+			return
+
+		delay = self._start_time + float(request_index) / self._rate - time.time()
+		if delay > 0:
+			gevent.sleep(delay)
+
+
+	def _build_request(self, records):
+		""" Create (path, body, headers, endpoint to report) for the given records. """
+
+		if self._protocol == "batch":
+			lines = []
+			for endpoint, params in records:
+				record = dict(params)
+				record["endpoint"] = endpoint
+				lines.append(json.dumps(record))
+			return ("/log/batch", "\n".join(lines), {"Content-Type" : "application/x-ndjson"}, "log/batch")
+
+		if self._protocol == "binary":
+			body = "".join([binary_records.encode_record(e, p) for e, p in records])
+			return ("/log/binary", body, {"Content-Type" : binary_records.CONTENT_TYPE}, "log/binary")
+
+		endpoint, params = records[0]
+		report_endpoint = "log/data" if endpoint.startswith("log/data/") else endpoint
+		return ("/" + endpoint, urllib.urlencode(params),
+			{"Content-Type" : "application/x-www-form-urlencoded"}, report_endpoint)
+
+
+	def _send(self, connection, path, body, headers, endpoint):
+		""" Send one request and record its latency or failure. """
+
+		time_before = time.time()
+
+		try:
+			connection.request("POST", path, body, headers)
+			response = connection.getresponse()
+			response.read()
+			success = response.status == 200
+		except (httplib.HTTPException, socket.error):
+			# Reconnect for the next request
+			connection.close()
+			success = False
+
+		if success:
+			self.latencies.setdefault(endpoint, []).append(time.time() - time_before)
+		else:
+			self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+
+### Server handling ###
+
+
+def start_server(host, port, server_args):
+	""" Start web_api.py with the given args in the current directory and wait for it to accept. """
+
+	web_api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_api.py")
+	process = subprocess.Popen([sys.executable, web_api_path] + shlex.split(server_args))
+
+	# Loading the models takes a while
+	for _ in range(0, 600):
+		if process.poll() is not None:
+			raise ValueError("Server exited with code {}".format(process.returncode))
+
+		try:
+			socket.create_connection((host, port), timeout=1).close()
+			return process
+		except socket.error:
+			time.sleep(.1)
+
+	stop_server(process)
+	raise ValueError("Server didn't start accepting on {}:{}".format(host, port))
+
+
+def stop_server(process):
+	""" Interrupt the server so it saves its state, and wait for it to exit. """
+
+	if process.poll() is None:
+		process.send_signal(signal.SIGINT)
+		process.wait()
+
+
+
+### Output ###
+
+
+def print_results(load_test):
+	""" Print the results of the given test as a table. """
+
+	table = [["Endpoint", "Requests", "Errors", "Req/s", "p50 (ms)", "p95 (ms)", "p99 (ms)"]]
+
+	for result in load_test.get_results():
+		table.append([result["endpoint"], "{:,}".format(result["requests"]), result["errors"],
+			"{:,.1f}".format(result["rps"])]
+			+ [_format_ms(result[p]) for p in ["p50", "p95", "p99"]])
+
+	util.outp.print_table(table, headline="Sent {:,} records in {}".format(
+		load_test.records_sent, util.fmtr.format_time_passed(load_test.time_taken)))
+
+
+def save_results(load_test, file_path, args):
+	""" Append the results and the configuration of the given test to the given file as one JSON line. """
+
+	line = json.dumps({
+		"time_unix" : time.time(),
+		"config" : vars(args),
+		"records_sent" : load_test.records_sent,
+		"time_taken" : load_test.time_taken,
+		"results" : load_test.get_results()
+	}, sort_keys=True)
+
+	with open(file_path, "a") as results_file:
+		results_file.write(line + "\n")
+
+
+def _format_ms(latency):
+	""" Format the given latency in seconds as milliseconds. """
+
+	if latency is None:
+		return "-"
+
+	return "{:.2f}".format(latency * 1000)
+
+
+def _yield_synthesized_requests(factory):
+	""" Yield requests from the given factory forever. """
+
+	while True:
+		yield factory.create()
+
+
+
+if __name__ == "__main__":
+	try:
+		PARSER = argparse.ArgumentParser(description="Send synthesized or replayed traffic to the web API.")
+		PARSER.add_argument("--host", default="localhost")
+		PARSER.add_argument("--port", type=int, default=5000)
+		PARSER.add_argument("--requests", "-n", type=int, default=10000, metavar="N",
+			help="Number of records to send")
+		PARSER.add_argument("--duration", "-d", type=float, metavar="S",
+			help="Stop after the given number of seconds")
+		PARSER.add_argument("--rate", "-r", type=float, metavar="R",
+			help="Target HTTP requests per second (default: as fast as possible)")
+		PARSER.add_argument("--concurrency", "-c", type=int, default=10, metavar="N")
+		PARSER.add_argument("--vins", type=int, default=100, metavar="N", help="Number of simulated clients")
+		PARSER.add_argument("--intrusion-ratio", "-i", type=float, default=0.0, metavar="P",
+			help="Share of intruded requests in [0, 1]")
+		PARSER.add_argument("--seed", type=int)
+		PARSER.add_argument("--replay", metavar="PATH", help="Replay the requests of the given log file")
+		PARSER.add_argument("--protocol", "-p", choices=PROTOCOLS, default="form")
+		PARSER.add_argument("--batch-size", "-b", type=int, default=1, metavar="N",
+			help="Records per request for the batch and binary protocols")
+		PARSER.add_argument("--start-server", metavar="ARGS", nargs="?", const="",
+			help="Start web_api.py with the given args in the current directory for the test")
+		PARSER.add_argument("--save", metavar="PATH", help="Append the results as a JSON line to the file")
+		ARGS = PARSER.parse_args()
+
+		if ARGS.replay:
+			REQUEST_GENERATOR = yield_requests_from_file(ARGS.replay)
+		else:
+			REQUEST_GENERATOR = _yield_synthesized_requests(
+				RequestFactory(ARGS.vins, ARGS.intrusion_ratio, seed=ARGS.seed))
+
+		LOAD_TEST = LoadTest(ARGS.host, ARGS.port, REQUEST_GENERATOR, ARGS.requests,
+			duration=ARGS.duration, rate=ARGS.rate, concurrency=ARGS.concurrency,
+			protocol=ARGS.protocol, batch_size=ARGS.batch_size)
+
+		SERVER = None
+		if ARGS.start_server is not None:
+			SERVER = start_server(ARGS.host, ARGS.port, ARGS.start_server)
+
+		try:
+			LOAD_TEST.run()
+		finally:
+			if SERVER is not None:
+				stop_server(SERVER)
+
+		print_results(LOAD_TEST)
+
+		if ARGS.save:
+			save_results(LOAD_TEST, ARGS.save, ARGS)
+			print("Saved results to {}".format(ARGS.save))
+
+		exit()
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+""" Columnar container for many log entries """
+
+import array
+import binascii
+import re
+
+from log_entry import LogEntry
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def yield_batches(log_entries, batch_size=DEFAULT_BATCH_SIZE, limit=None):
+	"""
+	Yield the given log entries as LogBatch objects.
+	*log_entries: A LogBatch, or an iterable of LogEntry and/or LogBatch objects - batches are passed on.
+	*batch_size: Maximum number of LogEntry objects per yielded batch.
+	*limit: Optional maximum number of entries to yield in total. Stops consuming the input once reached.
+	"""
+
+	if limit is None:
+		for batch in _yield_batches(log_entries, batch_size):
+			yield batch
+		return
+
+	count = 0
+
+	for batch in _yield_batches(log_entries, batch_size):
+		if count == limit:
+			return
+
+		if count + len(batch) > limit:
+			batch = batch[:limit - count]
+
+		count += len(batch)
+		yield batch
+
+		if count == limit:
+			return
+
+
+def _yield_batches(log_entries, batch_size):
+	""" See yield_batches(). """
+
+	if isinstance(log_entries, LogBatch):
+		yield log_entries
+		return
+
+	batch = LogBatch()
+
+	for item in log_entries:
+		if isinstance(item, LogBatch):
+			if batch:
+				yield batch
+				batch = LogBatch()
+			yield item
+			continue
+
+		batch.append(item)
+		if len(batch) == batch_size:
+			yield batch
+			batch = LogBatch()
+
+	if batch:
+		yield batch
+
+
+
+class LogBatch(object):
+	"""
+	Log entries stored per field in one array each instead of one object per entry.\n
+	vin, app_id, level and intrusion are dictionary-encoded: Their column holds one integer code per
+	entry that indexes the column's categories. Group-bys work on the codes, so per-value work like
+	stripping an app_id is done once per category instead of once per entry.
+	log_id values are packed to their 16 bytes and time_unix values to machine integers.
+	Categories are interned like the values of LogEntry objects.\n
+	Indexing and iterating return LogEntry objects.
+	"""
+
+	INTRUSION_FIELD = "intrusion"
+	CATEGORICAL_FIELDS = (LogEntry.VIN_FIELD, LogEntry.APP_ID_FIELD, LogEntry.LEVEL_FIELD, INTRUSION_FIELD)
+
+	_LOG_ID_SIZE = 16
+	# Any number of canonical UUID strings without separators
+	_CANONICAL_UUIDS_PATTERN = re.compile(
+		r"(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})*\Z")
+
+
+	@staticmethod
+	def from_entries(log_entries):
+		""" Create a LogBatch holding the given LogEntry objects. """
+
+		batch = LogBatch()
+		batch.extend(log_entries)
+		return batch
+
+
+
+	### Class interface ###
+
+
+	def __init__(self):
+		""" Ctor """
+
+		object.__init__(self)
+
+		# Categorical fields: { field : codes }, { field : [value] } and { field : { value : code } }
+		self._codes = {f : array.array("i") for f in LogBatch.CATEGORICAL_FIELDS}
+		self._categories = {f : [] for f in LogBatch.CATEGORICAL_FIELDS}
+		self._category_codes = {f : {} for f in LogBatch.CATEGORICAL_FIELDS}
+
+		self._gps_positions = []
+		self._log_messages = []
+		self._times = array.array("l")
+
+		# Canonical UUID strings are packed; any other accepted form is kept as is
+		self._log_ids = bytearray()
+		self._irregular_log_ids = {}
+
+
+	def __len__(self):
+		return len(self._times)
+
+
+	def __iter__(self):
+		for index in xrange(len(self)):
+			yield self.get_entry(index)
+
+
+	def __getitem__(self, index):
+		""" Return the LogEntry at the given index or a LogBatch of the entries in the given slice. """
+
+		if isinstance(index, slice):
+			return self.select(xrange(*index.indices(len(self))))
+
+		return self.get_entry(index)
+
+
+	def append(self, log_entry):
+		""" Add the given LogEntry object. """
+
+		self.append_fields(log_entry.vin, log_entry.app_id, log_entry.level, log_entry.gps_position,
+			log_entry.log_message, log_entry.log_id, log_entry.time_unix, log_entry.intrusion)
+
+
+	def append_fields(self, vin, app_id, level, gps_position, log_message, log_id, time_unix, intrusion=""):
+		""" Add an entry from field values that are valid as in a LogEntry object. """
+
+		self._encode(LogEntry.VIN_FIELD, vin)
+		self._encode(LogEntry.APP_ID_FIELD, app_id)
+		self._encode(LogEntry.LEVEL_FIELD, level)
+		self._encode(LogBatch.INTRUSION_FIELD, intrusion or "")
+
+		self._gps_positions.append(gps_position)
+		self._log_messages.append(log_message)
+		self._times.append(time_unix)
+		self._append_log_id(log_id)
+
+
+	def extend_fields(self, vins, app_ids, levels, gps_positions, log_messages, log_ids, times, intrusions):
+		"""
+		Add entries from lists of field values that are valid as in LogEntry objects, one list per field.
+		Faster than append_fields() per entry, as the columns are encoded at once.
+		"""
+
+		self._encode_all(LogEntry.VIN_FIELD, vins)
+		self._encode_all(LogEntry.APP_ID_FIELD, app_ids)
+		self._encode_all(LogEntry.LEVEL_FIELD, levels)
+		self._encode_all(LogBatch.INTRUSION_FIELD, intrusions)
+
+		self._gps_positions.extend(gps_positions)
+		self._log_messages.extend(log_messages)
+
+		joined_log_ids = "".join(log_ids)
+		if LogBatch._CANONICAL_UUIDS_PATTERN.match(joined_log_ids):
+			self._log_ids += binascii.unhexlify(joined_log_ids.replace("-", ""))
+			self._times.fromlist(list(times))
+			return
+
+		for log_id, time_unix in zip(log_ids, times):
+			self._times.append(time_unix)
+			self._append_log_id(log_id)
+
+
+	def extend(self, log_entries):
+		""" Add the given LogEntry objects. """
+
+		for log_entry in log_entries:
+			self.append(log_entry)
+
+
+	def get_entry(self, index):
+		""" Return the entry at the given index as a LogEntry object. """
+
+		if index < 0:
+			index += len(self)
+
+		return LogEntry.from_verified_fields(
+			self._decode(LogEntry.VIN_FIELD, index),
+			self._decode(LogEntry.APP_ID_FIELD, index),
+			self._decode(LogEntry.LEVEL_FIELD, index),
+			self._gps_positions[index],
+			self._log_messages[index],
+			self._get_log_id(index),
+			self._times[index],
+			self._decode(LogBatch.INTRUSION_FIELD, index))
+
+
+	def get_column(self, field):
+		""" Return a list of the values of the given field (see LogEntry.FIELDS and INTRUSION_FIELD). """
+
+		if field in self._codes:
+			categories = self._categories[field]
+			return [categories[c] for c in self._codes[field]]
+
+		if field == LogEntry.GPS_POSITION_FIELD:
+			return list(self._gps_positions)
+		if field == LogEntry.LOG_MESSAGE_FIELD:
+			return list(self._log_messages)
+		if field == LogEntry.TIME_UNIX_FIELD:
+			return self._times.tolist()
+		if field == LogEntry.LOG_ID_FIELD:
+			return [self._get_log_id(i) for i in xrange(len(self))]
+
+		raise KeyError(field)
+
+
+	def get_codes(self, field):
+		""" Return the codes of the given categorical field as array. Don't modify it. """
+		return self._codes[field]
+
+
+	def get_categories(self, field):
+		""" Return the values of the given categorical field, indexed by code. Don't modify it. """
+		return self._categories[field]
+
+
+	def get_group_indices(self, fields, key=None):
+		"""
+		Group the entries by the values of the given categorical fields.
+		*fields: List of categorical fields.
+		*key: Optional function mapping a tuple of values to its group; called once per distinct tuple.
+		returns: { group : [entry index] } with ascending indices. Groups are tuples of values or key's results.
+		"""
+
+		if any([f not in self._codes for f in fields]):
+			raise ValueError("Invalid fields: {}".format([f for f in fields if f not in self._codes]))
+
+		# { tuple of codes : list of its group }
+		lists_per_codes = {}
+		groups = {}
+
+		for index, codes in enumerate(zip(*[self._codes[f] for f in fields])):
+			if codes not in lists_per_codes:
+				group = tuple([self._categories[f][c] for f, c in zip(fields, codes)])
+				if key is not None:
+					group = key(group)
+
+				lists_per_codes[codes] = groups.setdefault(group, [])
+
+			lists_per_codes[codes].append(index)
+
+		return groups
+
+
+	def select(self, indices):
+		""" Return a new LogBatch with the entries at the given indices in the given order. """
+
+		batch = LogBatch()
+
+		for field in LogBatch.CATEGORICAL_FIELDS:
+			codes = self._codes[field]
+			categories = self._categories[field]
+			for index in indices:
+				batch._encode(field, categories[codes[index]])
+
+		gps_positions = self._gps_positions
+		log_messages = self._log_messages
+		times = self._times
+
+		for index in indices:
+			batch._gps_positions.append(gps_positions[index])
+			batch._log_messages.append(log_messages[index])
+			batch._times.append(times[index])
+
+			if index in self._irregular_log_ids:
+				batch._irregular_log_ids[len(batch._gps_positions) - 1] = self._irregular_log_ids[index]
+
+			start = index * LogBatch._LOG_ID_SIZE
+			batch._log_ids += self._log_ids[start:start + LogBatch._LOG_ID_SIZE]
+
+		return batch
+
+
+	### Helpers ###
+
+
+	def _encode(self, field, value):
+		""" Append the code of the given value to the given categorical field. """
+
+		category_codes = self._category_codes[field]
+		code = category_codes.get(value)
+
+		if code is None:
+			code = len(category_codes)
+			value = intern(value) if type(value) is str else value
+			category_codes[value] = code
+			self._categories[field].append(value)
+
+		self._codes[field].append(code)
+
+
+	def _encode_all(self, field, values):
+		""" Append the codes of the given values to the given categorical field. """
+
+		category_codes = self._category_codes[field]
+
+		for value in set(values).difference(category_codes):
+			value = intern(value) if type(value) is str else value
+			category_codes[value] = len(category_codes)
+			self._categories[field].append(value)
+
+		self._codes[field].fromlist(map(category_codes.__getitem__, values))
+
+
+	def _decode(self, field, index):
+		return self._categories[field][self._codes[field][index]]
+
+
+	def _append_log_id(self, log_id):
+		""" Pack canonical UUID strings into 16 bytes. Keep others as given, e.g. uppercase ones. """
+
+		if LogEntry.is_canonical_uuid(log_id):
+			self._log_ids += binascii.unhexlify(log_id.replace("-", ""))
+			return
+
+		self._irregular_log_ids[len(self._times) - 1] = log_id
+		self._log_ids += b"\0" * LogBatch._LOG_ID_SIZE
+
+
+	def _get_log_id(self, index):
+		if index in self._irregular_log_ids:
+			return self._irregular_log_ids[index]
+
+		start = index * LogBatch._LOG_ID_SIZE
+		hex_str = binascii.hexlify(self._log_ids[start:start + LogBatch._LOG_ID_SIZE])
+		return "%s-%s-%s-%s-%s" % (hex_str[:8], hex_str[8:12], hex_str[12:16], hex_str[16:20], hex_str[20:])
@@ -3,13 +3,28 @@
 
 # pylint: disable-msg=R0903,R0913; (Too few public methods, too many arguments)
 
+import binascii
 import json
+import os
+import re
 import time
 import uuid
 
+import field_codes
+
+
+# Encodes a str or unicode value as a JSON string literal exactly like json.dumps
+_ENCODE_JSON_STRING = json.encoder.encode_basestring_ascii
+
 
 class LogEntry(object):
-	""" Container class for log data """
+	"""
+	Container class for log data.\n
+	The fields are kept in slots named after them instead of a dict per entry. data returns them
+	as a dict by field name.\n
+	vin, app_id, level and intrusion repeat across many entries. Their values are interned, so all
+	entries share one string per distinct value. The *_code properties map them to integer codes.
+	"""
 
 	LEVEL_DEFAULT = "DEBUG"
 	LEVEL_ERROR = "ERROR"
@@ -23,6 +38,18 @@ class LogEntry(object):
 	LOG_ID_FIELD = "log_id"
 	TIME_UNIX_FIELD = "time_unix"
 
+	FIELDS = (VIN_FIELD, APP_ID_FIELD, LEVEL_FIELD, GPS_POSITION_FIELD, LOG_MESSAGE_FIELD, LOG_ID_FIELD,
+		TIME_UNIX_FIELD)
+
+	__slots__ = FIELDS + ("intrusion",)
+
+	# The log string with the fields sorted by key - same as json.dumps(data, sort_keys=True)
+	_SORTED_FIELDS = tuple(sorted(FIELDS))
+	_LOG_STRING_TEMPLATE = "{" + ", ".join(['"{}": %{}'.format(f, "d" if f == TIME_UNIX_FIELD else "s")
+		for f in _SORTED_FIELDS]) + "}"
+
+	_UUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
 
 	@staticmethod
 	def create_base_entry(vin="INVALID", time_unix=None):
@@ -42,15 +69,13 @@ class LogEntry(object):
 
 		object.__init__(self)
 
-		self.data = {
-			LogEntry.VIN_FIELD : "",             # Identifier of the car calling the microservice
-			LogEntry.APP_ID_FIELD : "",          # Name of the microservice using this
-			LogEntry.LEVEL_FIELD : "",           # INFO, DEBUG, ...
-			LogEntry.GPS_POSITION_FIELD : "",    # GPS position of car - "12.12312312,42.32321"
-			LogEntry.LOG_MESSAGE_FIELD : "",
-			LogEntry.LOG_ID_FIELD : "",          # UUID of this log entry
-			LogEntry.TIME_UNIX_FIELD : 0         # !Caution! At COMPANY not the same time as time_utc
-		}
+		self.vin = ""                # Identifier of the car calling the microservice
+		self.app_id = ""             # Name of the microservice using this
+		self.level = ""              # INFO, DEBUG, ...
+		self.gps_position = ""       # GPS position of car - "12.12312312,42.32321"
+		self.log_message = ""
+		self.log_id = ""             # UUID of this log entry
+		self.time_unix = 0           # !Caution! At COMPANY not the same time as time_utc
 
 		self.intrusion = ""
 
@@ -80,22 +105,61 @@ class LogEntry(object):
 		intrusion=None):
 		""" Setter for all fields at once """
 
-		self._set_if_not_none(LogEntry.VIN_FIELD, vin)
-		self._set_if_not_none(LogEntry.APP_ID_FIELD, app_id)
-		self._set_if_not_none(LogEntry.LEVEL_FIELD, level)
-		self._set_if_not_none(LogEntry.LOG_MESSAGE_FIELD, log_message)
-		self._set_if_not_none(LogEntry.GPS_POSITION_FIELD, gps_position)
-		self._set_if_not_none(LogEntry.TIME_UNIX_FIELD, time_unix, verifier=self._verify_time)
-		self._set_if_not_none(LogEntry.LOG_ID_FIELD, log_id, verifier=self._verify_uuid)
+		# Each field is checked and converted inline - this runs for every entry
+		if vin is not None:
+			self.vin = intern(vin if type(vin) is str else str(vin))
+		if app_id is not None:
+			self.app_id = intern(app_id if type(app_id) is str else str(app_id))
+		if level is not None:
+			self.level = intern(level if type(level) is str else str(level))
+		if log_message is not None:
+			self.log_message = log_message if type(log_message) is str else str(log_message)
+		if gps_position is not None:
+			self.gps_position = gps_position if type(gps_position) is str else str(gps_position)
+		if time_unix is not None:
+			self.time_unix = self._verify_time(time_unix)
+		if log_id is not None:
+			self.log_id = self._verify_uuid(log_id)
 
 		if intrusion is not None:
-			self.intrusion = intrusion
+			self.intrusion = intern(intrusion) if type(intrusion) is str else intrusion
+
+
+	@property
+	def data(self):
+		""" Return a new dict of the fields by field name. Changing it doesn't change this entry - use set_any(). """
+		return dict([(f, getattr(self, f)) for f in LogEntry.FIELDS])
+
+
+	@property
+	def app_id_code(self):
+		""" Integer code of the app_id (see field_codes.APP_IDS). """
+		return field_codes.APP_IDS.encode(self.app_id)
+
+
+	@property
+	def level_code(self):
+		""" Integer code of the level (see field_codes.LEVELS). """
+		return field_codes.LEVELS.encode(self.level)
+
+
+	@property
+	def intrusion_code(self):
+		""" Integer code of the intrusion label (see field_codes.LABELS). """
+		return field_codes.LABELS.encode(self.intrusion or "")
 
 
 	def get_log_string(self):
-		""" Create a log string from this item's log data, sorted by key. """
+		""" Create a log string from this item's log data, sorted by key. Same as json.dumps with sort_keys. """
 
-		result = json.dumps(self.data, sort_keys=True)
+		result = LogEntry._LOG_STRING_TEMPLATE % (
+			_ENCODE_JSON_STRING(self.app_id),
+			_ENCODE_JSON_STRING(self.gps_position),
+			_ENCODE_JSON_STRING(self.level),
+			_ENCODE_JSON_STRING(self.log_id),
+			_ENCODE_JSON_STRING(self.log_message),
+			self.time_unix,
+			_ENCODE_JSON_STRING(self.vin))
 
 		if self.intrusion is not None and self.intrusion != "":
 			result += ",{}".format(self.intrusion)
@@ -107,7 +171,7 @@ class LogEntry(object):
 	def from_log_string(log_string):
 		""" Create a LogEntry from the log string produced by get_log_string(). """
 
-		first_part = None
+		first_part = log_string
 		second_part = None
 
 		if not log_string.endswith("}"):
@@ -144,30 +208,41 @@ class LogEntry(object):
 
 
 	@staticmethod
-	def copy(log_entry):
-		""" Value-copy the given LogEntry object. """
+	def from_verified_fields(vin, app_id, level, gps_position, log_message, log_id, time_unix, intrusion=""):
+		"""
+		Create a LogEntry from field values that are known to be valid, e.g. by log_parser.
+		Skips the verification, conversion and interning of the ctor - pass interned values to share them.
+		"""
 
-		assert(isinstance(log_entry, LogEntry))
-		return LogEntry.from_data(log_entry.data, log_entry.intrusion)
+		log_entry = LogEntry.__new__(LogEntry)
 
+		log_entry.vin = vin
+		log_entry.app_id = app_id
+		log_entry.level = level
+		log_entry.gps_position = gps_position
+		log_entry.log_message = log_message
+		log_entry.log_id = log_id
+		log_entry.time_unix = time_unix
+		log_entry.intrusion = intrusion
 
-	### Helper ###
+		return log_entry
 
 
-	def _set_if_not_none(self, field_key, value, verifier=str):
-		"""
-		Set the field with the given key to the value specified if that is not None.\n
-		verifier: Optional verification method (default: convert to str)
-		"""
+	@staticmethod
+	def copy(log_entry):
+		""" Value-copy the given LogEntry object. """
+
+		assert(isinstance(log_entry, LogEntry))
+		return LogEntry.from_data(log_entry.data, log_entry.intrusion)
 
-		if value is None:
-			return
 
-		if verifier is not None:
-			value = verifier(value)
+	def __getstate__(self):
+		return tuple([getattr(self, s) for s in LogEntry.__slots__])
 
-		self.data[field_key] = value
 
+	def __setstate__(self, state):
+		for slot, value in zip(LogEntry.__slots__, state):
+			setattr(self, slot, value)
 
 
 	### Generators ###
@@ -181,18 +256,33 @@ class LogEntry(object):
 
 	@staticmethod
 	def _generate_uuid_str_if_none(given_uuid):
-		""" Return the given UUID or generate one if it's None. """
-		return given_uuid or uuid.uuid4().__str__()
+		""" Return the given UUID or generate one if it's None. Same as str(uuid.uuid4()) without the UUID object. """
+
+		if given_uuid:
+			return given_uuid
+
+		raw = bytearray(os.urandom(16))
+		raw[6] = (raw[6] & 0x0F) | 0x40 # Version 4
+		raw[8] = (raw[8] & 0x3F) | 0x80 # RFC 4122 variant
+
+		hex_str = binascii.hexlify(raw)
+		return "%s-%s-%s-%s-%s" % (hex_str[:8], hex_str[8:12], hex_str[12:16], hex_str[16:20], hex_str[20:])
 
 
 
 	### Verifiers ###
 
 
+	@staticmethod
+	def is_canonical_uuid(given_uuid):
+		""" Whether the given string is a UUID in the canonical form produced by uuid4(). """
+		return LogEntry._UUID_PATTERN.match(given_uuid) is not None
+
+
 	@staticmethod
 	def _verify_time(given_time):
 		""" Convert the given time to int. """
-		return int(given_time)
+		return given_time if type(given_time) is int else int(given_time)
 
 
 	@staticmethod
@@ -200,8 +290,9 @@ class LogEntry(object):
 		""" Convert the given object to a UUID string if it's not yet one. """
 
 		if isinstance(given_uuid, str) or isinstance(given_uuid, unicode):
-			# Verify the given string is well-formed
-			uuid.UUID(given_uuid)
+			# Verify the given string is well-formed; the regex covers the canonical form produced by uuid4()
+			if not LogEntry.is_canonical_uuid(given_uuid):
+				uuid.UUID(given_uuid)
 			return given_uuid
 
 		if isinstance(given_uuid, uuid.UUID):
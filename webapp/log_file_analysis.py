@@ -4,12 +4,14 @@
 import md5
 import os
 
+from log_batch import LogBatch
 from log_entry import LogEntry
+import log_batch
+import log_parser
 import util.fmtr
 import util.outp
 import util.prtr
 import util.stat
-from ids.dir_utils import Dir
 import ids.ids_tools as ids_tools
 import ids.ids_data as ids_data
 import idse_dao
@@ -39,7 +41,7 @@ def analyse(file_path, to_file, output_printer):
 	elif file_type != idse_dao.FileType.LOG_FILE:
 		raise NotImplementedError("File type \"%s\" not implemented!" % file_type)
 
-	log_entry_generator = (LogEntry.from_log_string(line) for line in  Dir.yield_lines(file_path))
+	log_batch_generator = log_parser.yield_batches(file_path)
 
 	# Analysis #
 
@@ -50,7 +52,7 @@ def analyse(file_path, to_file, output_printer):
 		total_entries, found_app_ids, entry_count_per_app_id, elements_per_class_per_app_id,
 		found_classes, entry_count_per_class, app_ids_per_class, duplicate_elements_per_app_id,
 		scorable_app_ids, dispersion_index, duplicate_index
-	) = analyse_entries(log_entry_generator)
+	) = analyse_entries(log_batch_generator)
 
 	# Output #
 
@@ -187,7 +189,7 @@ def analyse(file_path, to_file, output_printer):
 
 def analyse_entries(log_entry_generator):
 	"""
-	Analyse the LogEntry objects from the given generator.
+	Analyse the LogEntry objects or LogBatch objects from the given generator, or the given LogBatch.
 	returns: A tuple containing (found_app_ids, entry_count_per_app_id, elements_per_class_per_app_id,
 	found_classes, entry_count_per_class, app_ids_per_class, duplicate_elements_per_app_id),
 	scorable_app_ids, dispersion_index, duplicate_index
@@ -206,7 +208,7 @@ def analyse_entries(log_entry_generator):
 	app_ids_per_class = {}
 
 	duplicate_elements_per_app_id = {}
-	last_hash_per_app_id = {}
+	last_content_per_app_id = {}
 
 	for app_id in all_app_ids:
 		entry_count_per_app_id[app_id] = 0
@@ -214,40 +216,57 @@ def analyse_entries(log_entry_generator):
 
 		# Unique, Duplicates
 		duplicate_elements_per_app_id[app_id] = dict(uniq=0, dupe=0)
-		last_hash_per_app_id[app_id] = None
+		last_content_per_app_id[app_id] = None
 
 	for a_class in all_classes:
 		entry_count_per_class[a_class] = 0
 		app_ids_per_class[a_class] = set()
 
-	for entry in log_entry_generator:
-		if not entry.intrusion:
+	for batch in log_batch.yield_batches(log_entry_generator):
+		if "" in batch.get_categories(LogBatch.INTRUSION_FIELD):
 			raise NotImplementedError("Entries without labels can currently not be handled")
 
-		total_entries += 1
+		total_entries += len(batch)
 
-		app_id = ids_tools.log_entry_to_app_id(entry)
-		its_class = entry.intrusion
+		# Count per group of app_id and class instead of per entry
+		indices_per_app_id_and_class = batch.get_group_indices(
+			[LogEntry.APP_ID_FIELD, LogBatch.INTRUSION_FIELD],
+			key=lambda values: (ids_tools.strip_app_id(values[0]), values[1]))
 
-		found_app_ids.add(app_id)
-		found_classes.add(its_class)
+		for (app_id, its_class), indices in indices_per_app_id_and_class.items():
+			found_app_ids.add(app_id)
+			found_classes.add(its_class)
 
-		entry_count_per_app_id[app_id] += 1
+			entry_count_per_app_id[app_id] += len(indices)
 
-		if its_class not in elements_per_class_per_app_id[app_id]:
-			elements_per_class_per_app_id[app_id][its_class] = 1
-		else:
-			elements_per_class_per_app_id[app_id][its_class] += 1
+			if its_class not in elements_per_class_per_app_id[app_id]:
+				elements_per_class_per_app_id[app_id][its_class] = len(indices)
+			else:
+				elements_per_class_per_app_id[app_id][its_class] += len(indices)
 
-		entry_count_per_class[its_class] += 1
-		app_ids_per_class[its_class].add(app_id)
+			entry_count_per_class[its_class] += len(indices)
+			app_ids_per_class[its_class].add(app_id)
 
-		entry_hash = get_content_hash(entry)
-		if entry_hash == last_hash_per_app_id[app_id]:
-			duplicate_elements_per_app_id[app_id]["dupe"] += 1
-		else:
-			duplicate_elements_per_app_id[app_id]["uniq"] += 1
-		last_hash_per_app_id[app_id] = entry_hash
+		# Duplicates are consecutive entries of an app_id with the same content (see get_content_hash)
+		app_id_per_code = [ids_tools.strip_app_id(a) for a in batch.get_categories(LogEntry.APP_ID_FIELD)]
+		vins = batch.get_categories(LogEntry.VIN_FIELD)
+		levels = batch.get_categories(LogEntry.LEVEL_FIELD)
+		intrusions = batch.get_categories(LogBatch.INTRUSION_FIELD)
+
+		for app_id_code, vin_code, level_code, gps_position, log_message, intrusion_code in zip(
+			batch.get_codes(LogEntry.APP_ID_FIELD), batch.get_codes(LogEntry.VIN_FIELD),
+			batch.get_codes(LogEntry.LEVEL_FIELD), batch.get_column(LogEntry.GPS_POSITION_FIELD),
+			batch.get_column(LogEntry.LOG_MESSAGE_FIELD), batch.get_codes(LogBatch.INTRUSION_FIELD)):
+
+			app_id = app_id_per_code[app_id_code]
+			entry_content = (vins[vin_code] + levels[level_code] + gps_position + log_message
+				+ intrusions[intrusion_code])
+
+			if entry_content == last_content_per_app_id[app_id]:
+				duplicate_elements_per_app_id[app_id]["dupe"] += 1
+			else:
+				duplicate_elements_per_app_id[app_id]["uniq"] += 1
+			last_content_per_app_id[app_id] = entry_content
 
 	scorable_app_ids = []
 	scorable_entry_counts = []
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+""" Sparse sidecar index of a log file """
+
+import json
+import os
+import threading
+import zlib
+
+from log_entry import LogEntry
+
+
+class LogIndex(object):
+	"""
+	Sparse index of a log file, kept in <log file>.index.\n
+	Every block_size lines a checkpoint stores the entry count and byte offset at the end of the block
+	and the minimum and maximum time_unix within it. Lines after the last checkpoint (the tail) are
+	only tracked in memory and re-scanned on load.\n
+	Entries should be written through write_entries(); lines appended by others are picked up by
+	scanning from the last known offset. The index is rebuilt if it is missing or doesn't match the log.\n
+	With LogSegments, the log file is sealed into a segment once it is full and the index moves along.
+	Compressing a sealed segment happens while writing and holds up the writes for that long.
+	"""
+
+	_SUFFIX = ".index"
+
+
+	def __init__(self, log_file_path, block_size=1000, segments=None):
+		"""
+		Ctor
+		*segments: Optional LogSegments of the log file.
+		"""
+
+		object.__init__(self)
+
+		if block_size <= 0:
+			raise ValueError("Block size must be positive valued!")
+
+		self.log_file_path = log_file_path
+		self.block_size = block_size
+		self.segments = segments
+
+		self._lock = threading.Lock()
+		self._reset_state()
+		self._load()
+
+
+	### Interface ###
+
+
+	def write_entries(self, log_entries, io_runner=None):
+		"""
+		Append the given LogEntry objects to the log file and index them.
+		*io_runner: Optional callable(func, args) that runs the serialisation and the I/O, e.g. a thread pool's apply.
+		The index is locked in the calling thread, so a monkey-patched lock is never taken by a native thread.
+		"""
+
+		with self._lock:
+			if io_runner is None:
+				self._write_entries(log_entries)
+			else:
+				io_runner(self._write_entries, (log_entries,))
+
+
+	def count(self):
+		""" Return the number of lines in the log file. """
+
+		with self._lock:
+			self._catch_up_or_rebuild()
+			return self._count
+
+
+	def get_stats(self):
+		""" Return (lines, bytes, min time_unix, max time_unix) of the log file. """
+
+		with self._lock:
+			self._catch_up_or_rebuild()
+			return (self._count, self._end_offset) + self._get_time_bounds()
+
+
+	def find_cut(self, max_time):
+		"""
+		Find the end of the last line with a time_unix at or below max_time.
+		returns: (lines up to and including that line, its end offset, total lines, total bytes)
+		"""
+
+		with self._lock:
+			self._catch_up_or_rebuild()
+
+			# Blocks as (start count, start offset, end offset, min time), the tail being the last
+			blocks = []
+			start_count, start_offset = 0, 0
+			for count, offset, min_time, _ in self._checkpoints:
+				blocks.append((start_count, start_offset, offset, min_time))
+				start_count, start_offset = count, offset
+			blocks.append((start_count, start_offset, self._end_offset, self._tail_min_time))
+
+			for block_start_count, block_start_offset, block_end_offset, block_min_time in reversed(blocks):
+				# All lines in this block are newer
+				if max_time is None or block_min_time is None or block_min_time > max_time:
+					continue
+
+				cut = self._find_cut_in_block(block_start_count, block_start_offset, block_end_offset, max_time)
+				if cut is not None:
+					return cut + (self._count, self._end_offset)
+
+			return (0, 0, self._count, self._end_offset)
+
+
+	def read_tail(self, line_count):
+		""" Return the last line_count lines of the log file including their line ending, or all if it has fewer. """
+
+		with self._lock:
+			self._catch_up_or_rebuild()
+
+			first_line = max(self._count - line_count, 0)
+
+			# Start reading at the last checkpoint before the first requested line
+			start_count, start_offset = 0, 0
+			for count, offset, _, _ in self._checkpoints:
+				if count > first_line:
+					break
+				start_count, start_offset = count, offset
+
+			if start_offset == self._end_offset:
+				return []
+
+			with open(self.log_file_path, "r") as log_file:
+				log_file.seek(start_offset)
+				lines = log_file.read(self._end_offset - start_offset).splitlines(True)
+
+			return lines[first_line - start_count:]
+
+
+	def repair(self):
+		"""
+		Cut off an incomplete last line, e.g. of a write that was interrupted by a crash.
+		returns: True if the log file was truncated.
+		"""
+
+		with self._lock:
+			self._catch_up_or_rebuild()
+			return self._truncate_to_end()
+
+
+	def rename(self, new_log_file_path):
+		"""
+		Move the index along with the log file that was renamed to the given path.
+		This index continues empty for a new log file at the original path.
+		"""
+
+		with self._lock:
+			self._move_index(new_log_file_path)
+
+
+	def _write_entries(self, log_entries):
+		"""
+		Append and index the given entries. Requires the lock.
+		A failed write is cut off again, so a retry doesn't append to a partially written batch.
+		"""
+
+		lines = [e.get_log_string() + "\n" for e in log_entries]
+
+		try:
+			with open(self.log_file_path, "a") as log_file:
+				log_file.seek(0, os.SEEK_END)
+				start_offset = log_file.tell()
+
+				# Someone else wrote to or replaced the file
+				if start_offset != self._end_offset:
+					self._catch_up_or_rebuild(start_offset)
+
+				log_file.writelines(lines)
+		# pylint: disable-msg=W0702; (No exception type - any interrupted write is cut off, then re-raised)
+		except:
+			self._truncate_to_end()
+			raise
+
+		for line, log_entry in zip(lines, log_entries):
+			self._add_line(len(line), log_entry.time_unix)
+
+		if self.segments is not None and self.segments.is_full(self._count, self._end_offset):
+			self._seal()
+
+
+	def _truncate_to_end(self):
+		""" Cut the log file off at the end of the indexed lines. Call with the lock held. returns: True if truncated. """
+
+		if not os.path.lexists(self.log_file_path) or os.path.getsize(self.log_file_path) <= self._end_offset:
+			return False
+
+		with open(self.log_file_path, "r+") as log_file:
+			log_file.truncate(self._end_offset)
+
+		return True
+
+
+	def _move_index(self, new_log_file_path):
+		""" Move the index file to the given log's index path and start over. Call with the lock held. """
+
+		if os.path.lexists(self._get_index_path()):
+			os.rename(self._get_index_path(), LogIndex.get_index_path(new_log_file_path))
+
+		self._reset_state()
+
+
+	def _seal(self):
+		""" Seal the log file into a segment and move the index along. Call with the lock held. """
+
+		stats = (self._count, self._end_offset) + self._get_time_bounds()
+		segment_path = self.segments.seal(*stats)
+
+		# Compressed segments carry their own block index
+		if self.segments.compression is not None:
+			LogIndex.remove_index(self.log_file_path)
+			self._reset_state()
+			return
+
+		self._move_index(segment_path)
+
+
+	@staticmethod
+	def get_index_path(log_file_path):
+		""" Return the path of the index for the given log file. """
+		return log_file_path + LogIndex._SUFFIX
+
+
+	@staticmethod
+	def remove_index(log_file_path):
+		""" Remove the index of the given log file if there is one. """
+
+		index_path = LogIndex.get_index_path(log_file_path)
+		if os.path.lexists(index_path):
+			os.remove(index_path)
+
+
+	### Index state ###
+
+
+	def _reset_state(self):
+		""" Start over with an empty index. """
+
+		# (count, offset, min time, max time) at the end of each full block
+		self._checkpoints = []
+
+		self._count = 0
+		self._end_offset = 0
+
+		self._tail_count = 0
+		self._tail_min_time = None
+		self._tail_max_time = None
+
+
+	def _add_line(self, line_length, time_unix):
+		""" Account for one line appended at the end. Creates a checkpoint for every full block. """
+
+		self._count += 1
+		self._end_offset += line_length
+		self._tail_count += 1
+
+		if time_unix is not None:
+			self._tail_min_time = _min(self._tail_min_time, time_unix)
+			self._tail_max_time = max(self._tail_max_time, time_unix)
+
+		if self._tail_count < self.block_size:
+			return
+
+		checkpoint = (self._count, self._end_offset, self._tail_min_time, self._tail_max_time)
+		self._checkpoints.append(checkpoint)
+		self._persist_checkpoint(checkpoint)
+
+		self._tail_count = 0
+		self._tail_min_time = None
+		self._tail_max_time = None
+
+
+	def _get_time_bounds(self):
+		""" Return (min time, max time) over all indexed lines. """
+
+		min_time, max_time = self._tail_min_time, self._tail_max_time
+		for _, _, checkpoint_min_time, checkpoint_max_time in self._checkpoints:
+			min_time = _min(min_time, checkpoint_min_time)
+			max_time = max(max_time, checkpoint_max_time)
+
+		return (min_time, max_time)
+
+
+	def _catch_up_or_rebuild(self, file_size=None):
+		""" Index lines that were appended by others. Rebuilds if the file shrank. """
+
+		if file_size is None:
+			file_size = os.path.getsize(self.log_file_path) if os.path.lexists(self.log_file_path) else 0
+
+		if file_size == self._end_offset:
+			return
+
+		if file_size < self._end_offset:
+			self._rebuild()
+			return
+
+		self._scan_from_end()
+
+
+	def _scan_from_end(self):
+		""" Index all complete lines after the last known offset. """
+
+		with open(self.log_file_path, "r") as log_file:
+			log_file.seek(self._end_offset)
+
+			for line in log_file:
+				# Incomplete line that is currently being written
+				if not line.endswith("\n"):
+					break
+
+				self._add_line(len(line), parse_time(line))
+
+
+	def _rebuild(self):
+		""" Discard the index and index the whole log file. """
+
+		LogIndex.remove_index(self.log_file_path)
+		self._reset_state()
+
+		if os.path.lexists(self.log_file_path):
+			self._scan_from_end()
+
+
+	def _find_cut_in_block(self, start_count, start_offset, end_offset, max_time):
+		""" Find the last line at or below max_time in the given block. returns: (count, offset) or None """
+
+		with open(self.log_file_path, "r") as log_file:
+			log_file.seek(start_offset)
+			lines = log_file.read(end_offset - start_offset).splitlines(True)
+
+		line_end_offset = end_offset
+		for index in range(len(lines) - 1, -1, -1):
+			line_time = parse_time(lines[index])
+			if line_time is not None and line_time <= max_time:
+				return (start_count + index + 1, line_end_offset)
+
+			line_end_offset -= len(lines[index])
+
+		return None
+
+
+	### Index file ###
+
+
+	def _get_index_path(self):
+		return LogIndex.get_index_path(self.log_file_path)
+
+
+	def _load(self):
+		""" Load the index from disk or rebuild it if it's missing or doesn't match the log. """
+
+		if not self._load_checkpoints():
+			self._rebuild()
+			return
+
+		self._catch_up_or_rebuild()
+
+
+	def _load_checkpoints(self):
+		"""
+		Load the checkpoints from the index file and verify them against the log file.
+		returns: False if the index is missing or invalid.
+		"""
+
+		if not os.path.lexists(self._get_index_path()) or not os.path.lexists(self.log_file_path):
+			return False
+
+		try:
+			with open(self._get_index_path(), "r") as index_file:
+				header = json.loads(index_file.readline())
+				checkpoints = [tuple(json.loads(line)) for line in index_file if line.endswith("\n")]
+		except ValueError:
+			return False
+
+		if (header.get("block_size") != self.block_size
+			or header.get("first_line_crc") != self._get_first_line_crc()):
+			return False
+
+		file_size = os.path.getsize(self.log_file_path)
+		previous_count, previous_offset = 0, 0
+		for count, offset, _, _ in checkpoints:
+			if count != previous_count + self.block_size or offset <= previous_offset or offset > file_size:
+				return False
+			previous_count, previous_offset = count, offset
+
+		if checkpoints and not self._is_line_end(checkpoints[-1][1]):
+			return False
+
+		self._checkpoints = checkpoints
+		if checkpoints:
+			self._count, self._end_offset = checkpoints[-1][0], checkpoints[-1][1]
+
+		return True
+
+
+	def _persist_checkpoint(self, checkpoint):
+		""" Append the given checkpoint to the index file. Creates the file with its header. """
+
+		lines = []
+		if len(self._checkpoints) == 1:
+			lines.append(json.dumps({
+				"block_size" : self.block_size,
+				"first_line_crc" : self._get_first_line_crc()
+			}, sort_keys=True) + "\n")
+
+		lines.append(json.dumps(list(checkpoint)) + "\n")
+
+		with open(self._get_index_path(), "w" if len(self._checkpoints) == 1 else "a") as index_file:
+			index_file.writelines(lines)
+
+
+	def _get_first_line_crc(self):
+		""" CRC of the log file's first line to recognise a replaced log. """
+
+		with open(self.log_file_path, "r") as log_file:
+			return zlib.crc32(log_file.readline())
+
+
+	def _is_line_end(self, offset):
+		""" Whether the log file has a newline right before the given offset. """
+
+		with open(self.log_file_path, "r") as log_file:
+			log_file.seek(offset - 1)
+			return log_file.read(1) == "\n"
+
+
+
+### Helpers ###
+
+
+def parse_time(line):
+	""" Parse the time_unix of the given log line. returns: None for invalid lines. """
+
+	try:
+		return json.loads(line[:line.rindex("}") + 1])[LogEntry.TIME_UNIX_FIELD]
+	except (ValueError, KeyError, TypeError):
+		return None
+
+
+def _min(current, value):
+	""" min() that treats None as unset. """
+	return value if current is None else min(current, value)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+""" Bulk parser for log files """
+
+import gc
+import json
+import re
+
+import block_log
+from log_batch import LogBatch
+from log_entry import LogEntry
+import log_segments
+
+
+DEFAULT_CHUNK_SIZE = 10000
+
+INTRUSION_FIELD = LogBatch.INTRUSION_FIELD
+
+# JSON string value without the quotes - in lines without any backslash and in lines with escape
+# sequences, which are decoded separately
+_PLAIN_STRING = r'"([^"]*)"'
+_ESCAPED_STRING = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+_UUID = r'"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"'
+_INT = r'(-?[0-9]+)'
+
+
+def _compile_line_pattern(string_pattern, flags=0):
+	""" Pattern of a line as written by LogEntry.get_log_string: sorted keys, canonical UUID, integer time. """
+
+	return re.compile(
+		r'^\{"app_id": ' + string_pattern
+		+ r', "gps_position": ' + string_pattern
+		+ r', "level": ' + string_pattern
+		+ r', "log_id": ' + _UUID
+		+ r', "log_message": ' + string_pattern
+		+ r', "time_unix": ' + _INT
+		+ r', "vin": ' + string_pattern
+		+ r'\}(?:,([^{}\n]*))?$', flags)
+
+
+# Lines without any backslash can't contain escaped quotes and need no decoding
+_PLAIN_LINE_PATTERN = _compile_line_pattern(_PLAIN_STRING)
+_ESCAPED_LINE_PATTERN = _compile_line_pattern(_ESCAPED_STRING)
+# All lines of a buffer without any backslash at once
+_PLAIN_BUFFER_PATTERN = _compile_line_pattern(_PLAIN_STRING, re.MULTILINE)
+
+# Group of each field in the line patterns
+_GROUPS = {
+	LogEntry.APP_ID_FIELD : 1,
+	LogEntry.GPS_POSITION_FIELD : 2,
+	LogEntry.LEVEL_FIELD : 3,
+	LogEntry.LOG_ID_FIELD : 4,
+	LogEntry.LOG_MESSAGE_FIELD : 5,
+	LogEntry.TIME_UNIX_FIELD : 6,
+	LogEntry.VIN_FIELD : 7,
+	INTRUSION_FIELD : 8
+}
+
+
+def parse_line(line, fields=None):
+	"""
+	Parse the given log line.
+	*fields: Optional list of field names (see LogEntry.FIELDS and INTRUSION_FIELD).
+	returns: A LogEntry object or, if fields are given, a tuple of their values.
+	"""
+	return parse_lines([line], fields)[0]
+
+
+def parse_lines(lines, fields=None):
+	"""
+	Parse the given log lines with or without their line ending.\n
+	Lines in the layout written by LogEntry.get_log_string are parsed with one regular expression.
+	It verifies the fields as strictly as the LogEntry ctor, so the ctor's verification is skipped.
+	Any other line goes through LogEntry.from_log_string.
+	The garbage collector is paused meanwhile - the new objects can't form reference cycles.
+	*fields: Optional list of field names (see LogEntry.FIELDS and INTRUSION_FIELD).
+	returns: A list of LogEntry objects or, if fields are given, of tuples of their values.
+	"""
+
+	gc_was_enabled = gc.isenabled()
+	gc.disable()
+
+	try:
+		if fields is not None:
+			return _parse_fields(lines, fields)
+
+		return _parse_entries(lines)
+	finally:
+		if gc_was_enabled:
+			gc.enable()
+
+
+def parse_buffer(buffer_string, fields=None):
+	""" Parse all lines in the given string. See parse_lines(). """
+	return parse_lines(buffer_string.splitlines(), fields)
+
+
+def parse_lines_to_batch(lines, batch=None):
+	"""
+	Parse the given log lines like parse_lines(), but into a LogBatch without any LogEntry objects.
+	*batch: Optional LogBatch to append to.
+	returns: The LogBatch.
+	"""
+
+	if batch is None:
+		batch = LogBatch()
+
+	gc_was_enabled = gc.isenabled()
+	gc.disable()
+
+	try:
+		_parse_batch(lines, batch)
+	finally:
+		if gc_was_enabled:
+			gc.enable()
+
+	return batch
+
+
+def yield_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, fields=None, limit=None):
+	"""
+	Yield the parsed lines of the given source in lists of up to chunk_size. See parse_lines().
+	*source: Path of a plain, block-compressed or segmented log file, or an iterable of lines.
+	*limit: Optional maximum number of lines to parse.
+	"""
+
+	for lines in _yield_line_chunks(source, chunk_size, limit):
+		yield parse_lines(lines, fields)
+
+
+def yield_entries(source, fields=None, limit=None):
+	""" Yield the parsed lines of the given source one by one. See yield_chunks(). """
+
+	for chunk in yield_chunks(source, fields=fields, limit=limit):
+		for item in chunk:
+			yield item
+
+
+def yield_batches(source, chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+	""" Yield the parsed lines of the given source in LogBatch objects of up to chunk_size. See yield_chunks(). """
+
+	for lines in _yield_line_chunks(source, chunk_size, limit):
+		yield parse_lines_to_batch(lines)
+
+
+def read_batch(source, limit=None):
+	""" Parse the lines of the given source into one LogBatch. See yield_chunks(). """
+
+	batch = LogBatch()
+	for lines in _yield_line_chunks(source, DEFAULT_CHUNK_SIZE, limit):
+		parse_lines_to_batch(lines, batch)
+
+	return batch
+
+
+### Helpers ###
+
+
+def _parse_entries(lines):
+	""" Parse the given lines to LogEntry objects. """
+
+	result = []
+	append = result.append
+	match_plain_line = _PLAIN_LINE_PATTERN.match
+	new_entry = LogEntry.__new__
+
+	for line in lines:
+		match = match_plain_line(line) if "\\" not in line else None
+
+		if match is None:
+			append(_parse_line_slowly(line))
+			continue
+
+		app_id, gps_position, level, log_id, log_message, time_unix, vin, intrusion = match.groups()
+
+		# Same as LogEntry.from_verified_fields with interned values like in the ctor, inlined for speed
+		log_entry = new_entry(LogEntry)
+		log_entry.vin = intern(vin)
+		log_entry.app_id = intern(app_id)
+		log_entry.level = intern(level)
+		log_entry.gps_position = gps_position
+		log_entry.log_message = log_message
+		log_entry.log_id = log_id
+		log_entry.time_unix = int(time_unix)
+		log_entry.intrusion = intern(intrusion) if intrusion else ""
+
+		append(log_entry)
+
+	return result
+
+
+def _parse_batch(lines, batch):
+	""" Parse the given lines into the given LogBatch - column by column for each run of regular lines. """
+
+	# Usually all lines are regular - match them in one go
+	buffer_string = "\n".join(lines)
+	if "\\" not in buffer_string:
+		matched = _PLAIN_BUFFER_PATTERN.findall(buffer_string)
+		if len(matched) == len(lines):
+			_extend_batch(batch, matched)
+			return
+
+	matched = []
+	match_plain_line = _PLAIN_LINE_PATTERN.match
+
+	for line in lines:
+		match = match_plain_line(line) if "\\" not in line else None
+
+		if match is None:
+			_extend_batch(batch, matched)
+			matched = []
+			batch.append(_parse_line_slowly(line))
+			continue
+
+		matched.append(match.groups())
+
+	_extend_batch(batch, matched)
+
+
+def _extend_batch(batch, matched):
+	""" Add the given groups of matched lines to the given LogBatch. """
+
+	if not matched:
+		return
+
+	app_ids, gps_positions, levels, log_ids, log_messages, times, vins, intrusions = zip(*matched)
+	batch.extend_fields(vins, app_ids, levels, gps_positions, log_messages, log_ids, map(int, times),
+		[i or "" for i in intrusions])
+
+
+def _parse_line_slowly(line):
+	""" Parse a line with escape sequences or in an unknown layout. returns: A LogEntry object. """
+
+	match = _ESCAPED_LINE_PATTERN.match(line)
+
+	if match is None:
+		return LogEntry.from_log_string(line.rstrip("\n"))
+
+	app_id, gps_position, level, log_id, log_message, time_unix, vin, intrusion = match.groups()
+
+	return LogEntry.from_verified_fields(intern(_decode(vin)), intern(_decode(app_id)), intern(_decode(level)),
+		_decode(gps_position), _decode(log_message), log_id, int(time_unix), intern(intrusion) if intrusion else "")
+
+
+def _parse_fields(lines, fields):
+	""" Parse only the given fields of each line. returns: A list of tuples. """
+
+	if any([f not in _GROUPS for f in fields]):
+		raise ValueError("Invalid fields: {}".format([f for f in fields if f not in _GROUPS]))
+
+	groups = [_GROUPS[f] for f in fields]
+	converters = [_get_converter(f) for f in fields]
+
+	result = []
+	match_plain_line = _PLAIN_LINE_PATTERN.match
+
+	for line in lines:
+		match = match_plain_line(line) if "\\" not in line else _ESCAPED_LINE_PATTERN.match(line)
+
+		if match is None:
+			log_entry = LogEntry.from_log_string(line.rstrip("\n"))
+			result.append(tuple([getattr(log_entry, f) for f in fields]))
+			continue
+
+		values = match.group(*groups) if len(groups) > 1 else (match.group(groups[0]),)
+		result.append(tuple([convert(v) for convert, v in zip(converters, values)]))
+
+	return result
+
+
+def _get_converter(field):
+	""" Return the function converting the matched group of the given field to the LogEntry's value. """
+
+	if field == LogEntry.TIME_UNIX_FIELD:
+		return int
+	if field == LogEntry.LOG_ID_FIELD:
+		return str
+	if field == INTRUSION_FIELD:
+		return lambda v: v or ""
+
+	return _decode
+
+
+def _decode(value):
+	""" Decode the escape sequences of a JSON string value. Values are converted to str like in LogEntry. """
+
+	if "\\" not in value:
+		return value
+
+	return str(json.loads('"' + value + '"'))
+
+
+def _yield_line_chunks(source, chunk_size, limit):
+	""" Yield the lines of the given source in lists of up to chunk_size, up to limit lines in total. """
+
+	if chunk_size <= 0:
+		raise ValueError("Chunk size must be positive valued!")
+
+	if limit is not None and limit <= 0:
+		return
+
+	lines = []
+	count = 0
+
+	# The limit is checked right after each line, so no line beyond it is read from the source
+	for line in _yield_lines(source):
+		lines.append(line)
+		count += 1
+
+		if len(lines) == chunk_size:
+			yield lines
+			lines = []
+
+		if limit is not None and count == limit:
+			break
+
+	if lines:
+		yield lines
+
+
+def _yield_lines(source):
+	""" Yield the lines of the given file path or iterable of lines. """
+
+	if not isinstance(source, basestring):
+		for line in source:
+			yield line
+		return
+
+	parts = log_segments.get_log_parts(source)
+	if not parts:
+		raise IOError("File doesn't exist: {}".format(source))
+
+	for part_path in parts:
+		for line in block_log.yield_lines(part_path):
+			yield line
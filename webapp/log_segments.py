@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+""" Sealed segments of a log file """
+
+import json
+import os
+import shutil
+
+import block_log
+from log_index import LogIndex
+import log_index
+
+
+_MANIFEST_SUFFIX = ".manifest"
+
+
+def get_manifest_path(log_file_path):
+	""" Return the path of the manifest of the given log file. """
+	return log_file_path + _MANIFEST_SUFFIX
+
+
+def get_log_parts(log_file_path):
+	"""
+	Return the files making up the given log in order: its sealed segments, then the file itself.
+	Logs without a manifest consist of the file only.
+	"""
+
+	parts = []
+
+	manifest_path = get_manifest_path(log_file_path)
+	if os.path.lexists(manifest_path):
+		folder = os.path.dirname(log_file_path)
+		with open(manifest_path, "r") as manifest_file:
+			parts = [os.path.join(folder, s["file"]) for s in json.load(manifest_file)["segments"]]
+
+	if os.path.lexists(log_file_path):
+		parts.append(log_file_path)
+
+	return parts
+
+
+class LogSegments(object):
+	"""
+	Sealed segments of a log file.\n
+	The log file is the active segment. Once it holds max_entries or max_bytes, it is sealed: renamed to
+	<log file>.000001, .000002, ... and listed in <log file>.manifest with its entry count, size and
+	time range. The log consists of the listed segments in order, followed by the log file.
+	With retention set, only that many sealed segments are kept.\n
+	With compression set, sealed segments are block-compressed with that codec (see block_log).
+	Compressed segments carry their own block index instead of a LogIndex.
+	"""
+
+	_NUMBER_FORMAT = "{}.{:06d}"
+
+
+	def __init__(self, log_file_path, max_entries=None, max_bytes=None, retention=None, compression=None):
+		"""
+		Ctor
+		*compression: Optional block_log codec for sealed segments.
+		"""
+
+		object.__init__(self)
+
+		if max_entries is None and max_bytes is None:
+			raise ValueError("Segments need a maximum number of entries or bytes!")
+		if any([x <= 0 for x in filter(lambda x: x is not None, [max_entries, max_bytes, retention])]):
+			raise ValueError("All args must be positive valued!")
+		if compression is not None and compression not in block_log.CODECS:
+			raise ValueError("Unknown codec {}! Use one of: {}".format(
+				compression, ", ".join(sorted(block_log.CODECS))))
+
+		self.log_file_path = log_file_path
+		self.compression = compression
+
+		self._max_entries = max_entries
+		self._max_bytes = max_bytes
+		self._retention = retention
+
+		# { file, count, bytes (uncompressed), min_time, max_time } per sealed segment, oldest first
+		self.segments = []
+		self._next_number = 1
+
+		self._load()
+
+
+	def is_full(self, entry_count, byte_count):
+		""" Whether an active segment of the given size needs to be sealed. """
+
+		return ((self._max_entries is not None and entry_count >= self._max_entries)
+			or (self._max_bytes is not None and byte_count >= self._max_bytes))
+
+
+	def seal(self, count, byte_count, min_time, max_time):
+		"""
+		Rename the log file to the next segment and list it in the manifest. Applies the retention.
+		Compresses the segment if compression is set.
+		returns: The path of the new segment.
+		"""
+
+		segment_path = self._get_segment_path(self._next_number)
+		os.rename(self.log_file_path, segment_path)
+
+		if self.compression is not None:
+			block_log.compress_in_place(segment_path, self.compression)
+
+		self.segments.append({
+			"file" : os.path.basename(segment_path),
+			"count" : count,
+			"bytes" : byte_count,
+			"min_time" : min_time,
+			"max_time" : max_time
+		})
+		self._next_number += 1
+
+		while self._retention is not None and len(self.segments) > self._retention:
+			_remove_segment_files(self._get_path(self.segments.pop(0)))
+
+		self._write_manifest()
+
+		return segment_path
+
+
+	def get_count(self):
+		""" Return the number of entries in all sealed segments. """
+		return sum([s["count"] for s in self.segments])
+
+
+	def rename(self, new_log_file_path):
+		"""
+		Move all sealed segments and the manifest to the given log path, e.g. for a backup of the log.
+		The log file itself is not moved. This continues with no sealed segments.
+		"""
+
+		new_segments = LogSegments._for_path(new_log_file_path)
+
+		for segment in self.segments:
+			new_path = new_segments._get_segment_path(new_segments._next_number)
+			_move_segment_files(self._get_path(segment), new_path)
+			new_segments._append(segment, new_path)
+
+		new_segments._write_manifest()
+
+		self.segments = []
+		self._next_number = 1
+		self._remove_manifest()
+
+
+	def link_to(self, new_log_file_path, max_time=None):
+		"""
+		Create a segmented log at the given path that shares the sealed segments via hard links.
+		*max_time: Only keep the entries up to the last one at or below max_time.
+		returns: The number of entries kept.
+		"""
+
+		new_segments = LogSegments._for_path(new_log_file_path)
+		kept_segments = self.segments
+		cut_segment = None
+
+		if max_time is not None:
+			kept_segments, cut_segment = self._find_cut_segment(max_time)
+
+		for segment in kept_segments:
+			new_path = new_segments._get_segment_path(new_segments._next_number)
+			_link_segment_files(self._get_path(segment), new_path)
+			new_segments._append(segment, new_path)
+
+		if cut_segment is not None:
+			new_path = new_segments._get_segment_path(new_segments._next_number)
+			_copy_segment_until(self._get_path(cut_segment), new_path, max_time)
+			new_segments._append(_get_segment_stats(new_path), new_path)
+
+		new_segments._write_manifest()
+
+		return new_segments.get_count()
+
+
+	def _find_cut_segment(self, max_time):
+		"""
+		Find the segment holding the last entry at or below max_time.
+		returns: (segments before it, that segment or None if all segments are kept fully)
+		"""
+
+		for index in range(len(self.segments) - 1, -1, -1):
+			segment = self.segments[index]
+			if segment["min_time"] is None or segment["min_time"] > max_time:
+				continue
+
+			if segment["max_time"] is not None and segment["max_time"] <= max_time:
+				return (self.segments[:index + 1], None)
+
+			return (self.segments[:index], segment)
+
+		return ([], None)
+
+
+	### Manifest ###
+
+
+	@staticmethod
+	def _for_path(log_file_path):
+		""" Create an empty instance for the given path without limits, e.g. for backups. """
+
+		new_segments = LogSegments(log_file_path, max_entries=1)
+		if new_segments.segments:
+			raise ValueError("A segmented log exists at {} already!".format(log_file_path))
+
+		new_segments._max_entries = None
+		return new_segments
+
+
+	def _append(self, segment, segment_path):
+		""" List the given segment stats for the segment file at the given path. """
+
+		new_segment = dict(segment)
+		new_segment["file"] = os.path.basename(segment_path)
+		self.segments.append(new_segment)
+		self._next_number += 1
+
+
+	def _load(self):
+		""" Load the manifest and adopt a segment that was sealed but not listed before a crash. """
+
+		manifest_path = get_manifest_path(self.log_file_path)
+		if os.path.lexists(manifest_path):
+			with open(manifest_path, "r") as manifest_file:
+				manifest = json.load(manifest_file)
+
+			self.segments = manifest["segments"]
+			self._next_number = manifest["next_number"]
+
+		orphan_path = self._get_segment_path(self._next_number)
+		if os.path.lexists(orphan_path):
+			self._append(_get_segment_stats(orphan_path), orphan_path)
+			self._write_manifest()
+
+
+	def _write_manifest(self):
+		""" Atomically replace the manifest. Removes it if there are no segments left. """
+
+		if not self.segments:
+			self._remove_manifest()
+			return
+
+		manifest_path = get_manifest_path(self.log_file_path)
+		temp_path = manifest_path + ".tmp"
+
+		with open(temp_path, "w") as manifest_file:
+			json.dump({"segments" : self.segments, "next_number" : self._next_number},
+				manifest_file, sort_keys=True, indent=1)
+
+		os.rename(temp_path, manifest_path)
+
+
+	def _remove_manifest(self):
+		manifest_path = get_manifest_path(self.log_file_path)
+		if os.path.lexists(manifest_path):
+			os.remove(manifest_path)
+
+
+	def _get_segment_path(self, number):
+		return LogSegments._NUMBER_FORMAT.format(self.log_file_path, number)
+
+
+	def _get_path(self, segment):
+		return os.path.join(os.path.dirname(self.log_file_path), segment["file"])
+
+
+
+### Segment files (log and index) ###
+
+
+def _get_segment_stats(segment_path):
+	""" Return the stats for the manifest of the given plain or compressed segment. """
+
+	if not block_log.is_block_file(segment_path):
+		count, byte_count, min_time, max_time = LogIndex(segment_path).get_stats()
+		return {"count" : count, "bytes" : byte_count, "min_time" : min_time, "max_time" : max_time}
+
+	count, byte_count, min_time, max_time = 0, 0, None, None
+	for line in block_log.yield_lines(segment_path):
+		count += 1
+		byte_count += len(line)
+		line_time = log_index.parse_time(line)
+		if line_time is not None:
+			min_time = line_time if min_time is None else min(min_time, line_time)
+			max_time = max(max_time, line_time)
+
+	return {"count" : count, "bytes" : byte_count, "min_time" : min_time, "max_time" : max_time}
+
+
+def _copy_segment_until(segment_path, new_segment_path, max_time):
+	""" Copy the given segment up to and including its last line at or below max_time. Keeps the format. """
+
+	if not block_log.is_block_file(segment_path):
+		kept_bytes = LogIndex(segment_path).find_cut(max_time)[1]
+
+		shutil.copyfile(segment_path, new_segment_path)
+		with open(new_segment_path, "r+") as segment_file:
+			segment_file.truncate(kept_bytes)
+		return
+
+	lines = list(block_log.yield_lines(segment_path))
+
+	kept_count = 0
+	for index in range(len(lines) - 1, -1, -1):
+		line_time = log_index.parse_time(lines[index])
+		if line_time is not None and line_time <= max_time:
+			kept_count = index + 1
+			break
+
+	with block_log.BlockLogWriter(new_segment_path, block_log.BlockLogReader(segment_path).codec) as writer:
+		for line in lines[:kept_count]:
+			writer.write_line(line)
+
+
+def _get_segment_files(segment_path):
+	""" Return (path, suffix) of the files belonging to the given segment: the segment and its index. """
+
+	index_path = LogIndex.get_index_path(segment_path)
+	return [(segment_path, ""), (index_path, index_path[len(segment_path):])]
+
+
+def _move_segment_files(segment_path, new_segment_path):
+	for path, suffix in _get_segment_files(segment_path):
+		if os.path.lexists(path):
+			os.rename(path, new_segment_path + suffix)
+
+
+def _link_segment_files(segment_path, new_segment_path):
+	""" Hard-link the segment files. Falls back to copying if the file system doesn't support it. """
+
+	for path, suffix in _get_segment_files(segment_path):
+		if not os.path.lexists(path):
+			continue
+
+		try:
+			os.link(path, new_segment_path + suffix)
+		except OSError:
+			shutil.copyfile(path, new_segment_path + suffix)
+
+
+def _remove_segment_files(segment_path):
+	for path, _ in _get_segment_files(segment_path):
+		if os.path.lexists(path):
+			os.remove(path)
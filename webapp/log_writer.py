@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+""" Background log writer """
+
+import threading
+import time
+
+import util.mtrc
+
+
+_WRITE_DURATION = util.mtrc.REGISTRY.histogram(
+	"log_writer_write_duration_seconds", "Time spent serialising and writing one batch of log entries")
+_WRITE_SIZE = util.mtrc.REGISTRY.histogram(
+	"log_writer_write_size_entries", "Number of log entries written per batch", buckets=util.mtrc.SIZE_BUCKETS)
+
+
+class LogWriter(object):
+	"""
+	Double-buffered group-commit writer for the log file.\n
+	Appends go to the active buffer. A writer thread swaps it out as soon as one of the flush limits
+	is reached and writes the whole batch with a single writelines call, so appending never waits for
+	serialisation or disk I/O.
+	Note: Once gevent monkey-patched threading (the web API's default mode) the writer thread is a greenlet,
+	so without an io_runner on native threads the writes still run on the hub.
+	A batch that fails to be written goes back to the front of the buffer and is retried.
+	"""
+
+	# Time to wait before retrying a batch that failed to be written
+	_RETRY_INTERVAL = 0.5
+
+	def __init__(self, log_index, max_entries=None, max_bytes=None, interval_ms=1000, io_runner=None, wal=None):
+		"""
+		Ctor
+		*log_index: LogIndex of the log file to write to.
+		*max_entries, max_bytes, interval_ms: Flush limits - a batch is written as soon as the buffer holds
+		max_entries or max_bytes (estimated), or its oldest entry is older than interval_ms.
+		*io_runner: Optional callable(func, args) that runs the writes, e.g. a thread pool's apply.
+		Required under gevent to keep the writes off the hub.
+		*wal: Optional WriteAheadLog that journals appended entries. Each batch is one generation.
+		"""
+
+		object.__init__(self)
+
+		if any([x <= 0 for x in filter(lambda x: x is not None, [max_entries, max_bytes, interval_ms])]):
+			raise ValueError("All flush limits must be positive valued!")
+
+		self.log_index = log_index
+		self.wal = wal
+
+		self._max_entries = max_entries
+		self._max_bytes = max_bytes
+		self._interval = interval_ms / 1000.0 if interval_ms is not None else None
+		self._io_runner = io_runner
+
+		self._cond = threading.Condition()
+
+		# Active buffer and the time its first entry arrived
+		self._active = []
+		self._active_bytes = 0
+		self._active_since = None
+
+		# Batch being written
+		self._writing_count = 0
+		self._writing_bytes = 0
+
+		# Flush requests are numbered; flush() waits until its number was written
+		self._flush_requested = 0
+		self._flush_done = 0
+
+		# Error of the last write and the flush number it was for; WAL generations of unwritten batches
+		self._write_error = None
+		self._failed_flush = 0
+		self._unwritten_generations = []
+
+		self._closed = False
+
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+
+	def append_all(self, log_entries, size_bytes):
+		""" Add the given entries with the given estimated size to the active buffer. """
+
+		with self._cond:
+			if self._closed:
+				raise ValueError("Writer is closed!")
+
+			if self.wal is not None:
+				self.wal.append(log_entries)
+
+			if not self._active:
+				self._active_since = time.time()
+
+			self._active.extend(log_entries)
+			self._active_bytes += size_bytes
+
+			# Wake up the writer to write or to (re)start its interval timer
+			self._cond.notify_all()
+
+
+	def flush(self):
+		"""
+		Write all buffered entries and block until they are on disk.
+		raises: WriteError if writing them failed. The writer keeps retrying.
+		"""
+
+		with self._cond:
+			self._flush_requested += 1
+			flush_number = self._flush_requested
+			self._cond.notify_all()
+
+			while self._flush_done < flush_number:
+				if self._write_error is not None and self._failed_flush >= flush_number:
+					raise LogWriter.WriteError(self._write_error)
+				self._cond.wait()
+
+
+	def close(self):
+		""" Write all buffered entries and stop the writer thread. """
+
+		self.flush()
+
+		with self._cond:
+			self._closed = True
+			self._cond.notify_all()
+
+		self._thread.join()
+
+		if self.wal is not None:
+			self.wal.close()
+
+
+	def get_pending_count(self):
+		""" Return the number of entries that are buffered or being written. """
+		return len(self._active) + self._writing_count
+
+
+	def get_pending_bytes(self):
+		""" Return the estimated size of the entries that are buffered or being written. """
+		return self._active_bytes + self._writing_bytes
+
+
+	### Writer thread ###
+
+
+	def _run(self):
+		""" Write batches until closed. """
+
+		while True:
+			with self._cond:
+				while not self._closed and not self._is_due():
+					self._cond.wait(self._get_wait_time())
+
+				if self._closed and not self._active:
+					return
+
+				log_entries = self._active
+				active_since = self._active_since
+				flush_number = self._flush_requested
+				generations = self._unwritten_generations
+				if self.wal is not None:
+					generations = generations + [self.wal.rotate()]
+
+				self._writing_count = len(log_entries)
+				self._writing_bytes = self._active_bytes
+				self._active = []
+				self._active_bytes = 0
+				self._active_since = None
+				self._unwritten_generations = []
+
+			try:
+				if log_entries:
+					self._write_batch(log_entries)
+			# pylint: disable-msg=W0703; (Catching too general exception - the writer needs to survive)
+			except Exception as error:
+				print("Writing {} log entries failed, retrying: {}".format(len(log_entries), error))
+				self._requeue(log_entries, active_since, generations, flush_number, error)
+				time.sleep(LogWriter._RETRY_INTERVAL)
+				continue
+
+			try:
+				for generation in generations:
+					self.wal.discard(generation)
+			# pylint: disable-msg=W0703; (Catching too general exception - the writer needs to survive)
+			except Exception as error:
+				# The entries are in the log - a recovery skips them
+				print("Discarding the write-ahead log failed: {}".format(error))
+
+			with self._cond:
+				self._writing_count = 0
+				self._writing_bytes = 0
+				self._flush_done = max(self._flush_done, flush_number)
+				self._write_error = None
+				self._cond.notify_all()
+
+
+	def _requeue(self, log_entries, active_since, generations, flush_number, error):
+		""" Put the given batch that failed to be written back to the front of the buffer. """
+
+		with self._cond:
+			self._active = log_entries + self._active
+			self._active_bytes += self._writing_bytes
+			self._active_since = active_since
+			self._unwritten_generations = generations
+
+			self._writing_count = 0
+			self._writing_bytes = 0
+			self._write_error = error
+			self._failed_flush = flush_number
+			self._cond.notify_all()
+
+
+	def _is_due(self):
+		""" Whether a flush was requested or a flush limit is reached. Call with the lock held. """
+
+		if self._flush_requested > self._flush_done:
+			return True
+
+		if not self._active:
+			return False
+
+		return ((self._max_entries is not None and len(self._active) >= self._max_entries)
+			or (self._max_bytes is not None and self._active_bytes >= self._max_bytes)
+			or (self._interval is not None and time.time() >= self._active_since + self._interval))
+
+
+	def _get_wait_time(self):
+		""" Time until the oldest buffered entry is due. None to wait for the next append. """
+
+		if not self._active or self._interval is None:
+			return None
+
+		return max(self._active_since + self._interval - time.time(), 0)
+
+
+	def _write_batch(self, log_entries):
+		""" Serialise and write the given entries, in the io_runner if there is one. """
+
+		time_before = time.time()
+
+		self.log_index.write_entries(log_entries, self._io_runner)
+
+		_WRITE_DURATION.observe(time.time() - time_before)
+		_WRITE_SIZE.observe(len(log_entries))
+
+
+	### Exception class ###
+
+
+	class WriteError(Exception):
+		""" Thrown by flush() if the buffered entries couldn't be written. """
+		def __init__(self, cause):
+			""" Ctor """
+			Exception.__init__(self, "Writing the log failed: {}".format(cause))
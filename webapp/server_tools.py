@@ -12,9 +12,9 @@ import sklearn
 import sklearn.metrics as sk_met
 import sklearn.model_selection as sk_mod
 
-from log_entry import LogEntry
 from state_dao import StateDao
 import log_file_analysis
+import log_parser
 import util.fmtr
 import util.outp
 import util.prtr
@@ -51,8 +51,8 @@ def _train(file_path):
 			+ " If you think this is a mistake, rename it and run again.")
 		return
 
-	log_entry_generator = _yield_log_entries_from_file(file_path)
-	_train_entries(log_entry_generator)
+	log_batch_generator = _yield_log_batches_from_file(file_path)
+	_train_entries(log_batch_generator)
 
 	with open(_HISTORY_FILE, 'a') as hist_file:
 		hist_file.write(file_path + "\n")
@@ -60,7 +60,7 @@ def _train(file_path):
 
 def _train_entries(log_entry_generator, squelch_output=False):
 	"""
-	Train with the given LogEntry objects.
+	Train with the given LogEntry and/or LogBatch objects. They are converted chunk by chunk.
 	returns: Boolean flag indicating success
 	"""
 
@@ -354,17 +354,11 @@ def _read_file_flow(file_path, squelch_output=False):
 def _get_log_entries_from_file(file_path, limit):
 	""" Read up to <limit> number of log entries from the given file. """
 
-	log_entries = []
-
-	for line in Dir.yield_lines(file_path, limit):
-		log_entries.append(LogEntry.from_log_string(line))
-
-	return log_entries
+	return list(log_parser.yield_entries(file_path, limit=limit))
 
 
-def _yield_log_entries_from_file(file_path):
-	for line in Dir.yield_lines(file_path):
-		yield LogEntry.from_log_string(line)
+def _yield_log_batches_from_file(file_path):
+	return log_parser.yield_batches(file_path)
 
 
 
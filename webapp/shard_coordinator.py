@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+""" Coordinator for multi-process ingestion """
+
+import json
+import socket
+import threading
+
+from client_time_index import ClientTimeIndex
+from state_store import StateStore
+
+
+class ShardCoordinator(object):
+	"""
+	Owns the client times of all worker processes, so a client's time only ever moves forward -
+	no matter which worker the kernel hands its connections to.\n
+	Runs in the parent process. Each worker talks to it through its ShardClient: requests go from the
+	worker to the coordinator, commands broadcast by one worker go from the coordinator to all workers.
+	Broadcasts have their own connection, so they never hold up a worker's client time requests.
+	Needs to be created before the workers are forked. The client times are loaded in __enter__ and
+	saved in __exit__, once all workers disconnected.
+	"""
+
+	def __init__(self, shard_count, next_client_time, state_path):
+		"""
+		Ctor
+		*next_client_time: Callable(client time) returning the client's next time - None for new clients.
+		*state_path: Folder of the StateStore holding the client times.
+		"""
+
+		object.__init__(self)
+
+		if shard_count <= 0:
+			raise ValueError("Shard count must be positive valued!")
+
+		self.shard_count = shard_count
+
+		self._next_client_time = next_client_time
+		self._state_store = StateStore(state_path)
+
+		self._lock = threading.Lock()
+		self._client_times = ClientTimeIndex()
+		self._changed_clients = set()
+
+		# One request, broadcast and command connection per worker: (coordinator side, worker side)
+		self._request_sockets = [socket.socketpair() for _ in range(0, shard_count)]
+		self._broadcast_sockets = [socket.socketpair() for _ in range(0, shard_count)]
+		self._command_sockets = [socket.socketpair() for _ in range(0, shard_count)]
+		self._command_channels = None
+
+		self._threads = []
+
+
+	def __enter__(self):
+		""" Load the client times. """
+
+		_, client_times = self._state_store.load()
+		self._client_times = ClientTimeIndex(client_times)
+		self._changed_clients = set()
+
+		return self
+
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		""" Save the client times. """
+
+		self._state_store.save(self._client_times.get_min(), dict(self._client_times.items()), self._changed_clients)
+		self._changed_clients = set()
+
+
+	### Parent process ###
+
+
+	def start(self):
+		""" Serve the requests of all workers in background threads. Call after forking the workers. """
+
+		for _, worker_side in self._request_sockets + self._broadcast_sockets + self._command_sockets:
+			worker_side.close()
+
+		self._command_channels = [(_Channel(s), threading.Lock()) for s, _ in self._command_sockets]
+
+		for coordinator_side, _ in self._request_sockets + self._broadcast_sockets:
+			thread = threading.Thread(target=self._serve, args=(_Channel(coordinator_side),))
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+
+	def join(self):
+		""" Block until all workers disconnected. """
+
+		for thread in self._threads:
+			# Join in steps so a KeyboardInterrupt isn't held back
+			while thread.is_alive():
+				thread.join(1)
+
+
+	### Worker process ###
+
+
+	def connect(self, shard):
+		""" Return the ShardClient of the given shard. Call in the worker process after forking. """
+
+		if shard < 0 or shard >= self.shard_count:
+			raise ValueError("Invalid shard: {}".format(shard))
+
+		all_sockets = zip(self._request_sockets, self._broadcast_sockets, self._command_sockets)
+		for other_shard, sockets in enumerate(all_sockets):
+			for coordinator_side, worker_side in sockets:
+				coordinator_side.close()
+				if other_shard != shard:
+					worker_side.close()
+
+		return ShardClient(shard, *[worker_side for _, worker_side in all_sockets[shard]])
+
+
+	### Request handling ###
+
+
+	def _serve(self, channel):
+		""" Answer the requests of one worker until it disconnects. """
+
+		while True:
+			request = channel.receive()
+			if request is None:
+				return
+
+			channel.send(self._handle(request))
+
+
+	def _handle(self, request):
+		""" Return the response to the given request. """
+
+		operation = request["op"]
+
+		if operation == "advance":
+			return [self._advance_client_time(i) for i in request["identifiers"]]
+
+		if operation == "min_time":
+			return self._client_times.get_min()
+
+		if operation == "reset":
+			return self._reset_client_times()
+
+		if operation == "broadcast":
+			return [self._send_command(shard, request["command"], request["args"])
+				for shard in range(0, self.shard_count)]
+
+		raise ValueError("Unknown operation: {}".format(operation))
+
+
+	def _advance_client_time(self, identifier):
+		""" Set and return the next time of the given client. """
+
+		with self._lock:
+			try:
+				client_time = self._client_times.get(identifier)
+			except KeyError:
+				client_time = None
+
+			client_time = self._next_client_time(client_time)
+			self._client_times.set(identifier, client_time)
+			self._changed_clients.add(identifier)
+
+			return client_time
+
+
+	def _reset_client_times(self):
+		""" Clear the client times in memory and on disk. returns: Status message. """
+
+		with self._lock:
+			self._client_times = ClientTimeIndex()
+			self._changed_clients = set()
+			self._state_store.clear()
+
+		return "Cleared successfully"
+
+
+	def _send_command(self, shard, command, args):
+		""" Run the given command on the given shard's worker and return its response. """
+
+		channel, lock = self._command_channels[shard]
+
+		with lock:
+			try:
+				channel.send({"command" : command, "args" : args})
+				response = channel.receive()
+			except socket.error:
+				response = None
+
+		if response is None:
+			return {"error" : "Worker has shut down"}
+
+		return response
+
+
+
+class ShardClient(object):
+	"""
+	A worker's connection to the ShardCoordinator. Requests block the calling thread until answered.
+	Broadcasts go over their own connection, so client time requests aren't queued behind them.
+	"""
+
+	def __init__(self, shard, request_socket, broadcast_socket, command_socket):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self.shard = shard
+
+		self._requests = (_Channel(request_socket), threading.Lock())
+		self._broadcasts = (_Channel(broadcast_socket), threading.Lock())
+		self._command_channel = _Channel(command_socket)
+
+
+	def advance_client_times(self, identifiers):
+		"""
+		Advance the times of the given clients in the coordinator.
+		returns: The new time of each given client.
+		"""
+		return self._request(self._requests, {"op" : "advance", "identifiers" : identifiers})
+
+
+	def get_global_min_time(self):
+		"""
+		Return the minimum client time over all shards.
+		returns: Unix time or None if there are no client times.
+		"""
+		return self._request(self._requests, {"op" : "min_time"})
+
+
+	def reset_client_times(self):
+		""" Clear the client times of all shards. returns: Status message. """
+		return self._request(self._requests, {"op" : "reset"})
+
+
+	def broadcast(self, command, **args):
+		"""
+		Run the given command on the workers of all shards, including this one.
+		returns: The results in the order of the shards.
+		raises: ValueError if the command failed on any shard.
+		"""
+
+		responses = self._request(self._broadcasts, {"op" : "broadcast", "command" : command, "args" : args})
+
+		results = []
+		for shard, response in enumerate(responses):
+			if "error" in response:
+				raise ValueError("Shard {}: {}".format(shard, response["error"]))
+			results.append(response["result"])
+
+		return results
+
+
+	def serve_commands(self, commands):
+		"""
+		Run the broadcast commands in a background thread.
+		*commands: { command : callable(**args) returning a JSON-serialisable result }
+		The commands must not broadcast themselves, which waits for the running broadcast to finish.
+		"""
+
+		thread = threading.Thread(target=self._serve_commands, args=(commands,))
+		thread.daemon = True
+		thread.start()
+
+
+	def _serve_commands(self, commands):
+		""" Run the received commands until the coordinator disconnects. """
+
+		while True:
+			command = self._command_channel.receive()
+			if command is None:
+				return
+
+			try:
+				response = {"result" : commands[command["command"]](**command["args"])}
+			# pylint: disable-msg=W0703; (Catching too general exception - the error is sent to the broadcaster)
+			except Exception as error:
+				response = {"error" : "{}: {}".format(type(error).__name__, error)}
+
+			self._command_channel.send(response)
+
+
+	@staticmethod
+	def _request(connection, request):
+		""" Send the given request over the given (channel, lock) to the coordinator and return its response. """
+
+		channel, lock = connection
+		with lock:
+			channel.send(request)
+			response = channel.receive()
+
+		if response is None:
+			raise ValueError("Shard coordinator has shut down!")
+
+		return response
+
+
+
+class _Channel(object):
+	""" JSON messages over a connected socket, one per line. """
+
+	def __init__(self, connected_socket):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self._socket = connected_socket
+		self._file = connected_socket.makefile("r")
+
+
+	def send(self, message):
+		self._socket.sendall(json.dumps(message) + "\n")
+
+
+	def receive(self):
+		""" Return the next message or None once the other side is closed. """
+
+		line = self._file.readline()
+		if not line:
+			return None
+
+		return json.loads(line)
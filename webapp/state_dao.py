@@ -3,56 +3,127 @@
 
 # pylint: disable-msg=R0902; (Too many instance attributes)
 
-import datetime
-import json
+import heapq
 import os
+import re
 import shutil
 import time
 
 from log_entry import LogEntry
+from client_time_index import ClientTimeIndex
+from state_store import StateStore
+from log_index import LogIndex, parse_time
+from write_ahead_log import WriteAheadLog
+import block_log
+import log_segments
 import util.fmtr
+import util.mtrc
 import util.prtr
 
 
+_FLUSH_DURATION = util.mtrc.REGISTRY.histogram(
+	"dao_flush_duration_seconds", "Time spent writing new log entries to disk")
+_FLUSH_SIZE = util.mtrc.REGISTRY.histogram(
+	"dao_flush_size_entries", "Number of log entries written per flush", buckets=util.mtrc.SIZE_BUCKETS)
+_BUFFER_DEPTH = util.mtrc.REGISTRY.gauge(
+	"dao_buffered_entries", "Number of log entries held in memory")
+_BUFFER_BYTES = util.mtrc.REGISTRY.gauge(
+	"dao_buffered_bytes", "Estimated memory held by buffered and currently written log entries")
+
+
 class StateDao(object):
 	""" DAO class for handling the STATE objects """
 
 	_INSTANCE = None
 
+	_STATE_PATH = "state"
+	_LOG_PATH = "log"
+	_LOG_FILE_NAME = "log"
+
+	# Estimated memory footprint of a LogEntry object with its data dict and fixed-size values
+	_ENTRY_BASE_SIZE = 1024
+
 
 	def __init__(
-		self, verbose, flush_frequency=None, max_entries_in_state=None, max_entries_total=None):
-		""" Ctor """
+		self, verbose, flush_frequency=None, max_entries_in_state=None, max_entries_total=None,
+		shard=None, shard_client=None, io_runner=None, max_buffered_bytes=None, log_writer=None,
+		log_index=None, wal=None):
+		"""
+		Ctor
+		*shard: Optional index of the log shard this process owns.
+		*shard_client: Optional ShardClient of the shard. The client times are kept by its coordinator then.
+		*io_runner: Optional callable(func, args) that runs the log writes, e.g. a thread pool's apply.
+		Defaults to writing in the calling thread.
+		*max_buffered_bytes: Optional memory budget for buffered entries. Reaching it triggers a flush.
+		*log_writer: Optional LogWriter for the log file that writes new entries in the background.
+		Its flush limits replace the auto-flush.
+		*log_index: Optional LogIndex of the log file, e.g. with LogSegments.
+		Defaults to the log writer's or a plain one.
+		*wal: Optional WriteAheadLog of the log file that journals new entries until they are written.
+		Unwritten entries of a crashed run are recovered in __enter__. Must be the log writer's, if any.
+		"""
 
 		if StateDao._INSTANCE:
 			raise ValueError("DAO is already instantiated!")
 
 		if any([x <= 0 for x in
-			filter(lambda x: x is not None, [flush_frequency, max_entries_in_state, max_entries_total])]):
+			filter(lambda x: x is not None,
+				[flush_frequency, max_entries_in_state, max_entries_total, max_buffered_bytes])]):
 			raise ValueError("All args must be positive valued!")
 
 		object.__init__(self)
 
+		if shard is not None and shard < 0:
+			raise ValueError("Shard must be positive valued!")
+
 		StateDao._INSTANCE = self
-		self._printer = util.prtr.TimePrinter(verbose=verbose, name="DAO")
+		self._printer = util.prtr.TimePrinter(verbose=verbose,
+			name="DAO" if shard is None else "DAO {}".format(shard))
+
+		self._shard = shard
+		self._shard_client = shard_client
+		self._io_runner = io_runner
+		self._log_writer = log_writer
+
+		self._state_path = StateDao._STATE_PATH
+		self._state_store = StateStore(self._state_path) if shard_client is None else None
+		self._log_path = StateDao._LOG_PATH
+		self._log_file_path = StateDao.get_log_file_path(shard)
+
+		if log_index is None:
+			log_index = log_writer.log_index if log_writer is not None else LogIndex(self._log_file_path)
+		if log_writer is not None and log_writer.log_index is not log_index:
+			raise ValueError("Log writer and DAO need to share the log index!")
+		if log_index.log_file_path != self._log_file_path:
+			raise ValueError("Log index is for {} instead of {}".format(log_index.log_file_path, self._log_file_path))
+
+		self._log_index = log_index
+		self._segments = log_index.segments
 
-		self._state_path = "state"
-		self._state_file_name = "state"
-		self._state_file_path = os.path.join(self._state_path, self._state_file_name)
-		self._log_path = "log"
-		self._log_file_name = "log"
-		self._log_file_path = os.path.join(self._log_path, self._log_file_name)
+		if log_writer is not None and log_writer.wal is not wal:
+			raise ValueError("Log writer and DAO need to share the write-ahead log!")
+		if wal is not None and wal.log_file_path != self._log_file_path:
+			raise ValueError("Write-ahead log is for {} instead of {}".format(wal.log_file_path, self._log_file_path))
+
+		self._wal = wal
 
 		self._curr_min_time = None
-		self._client_times = {}
+		self._client_times = ClientTimeIndex()
+		self._changed_clients = set() # Identifiers of clients changed since the state was loaded or saved
 		self._new_log_entries = [] # LogEntry objects
 
+		# Estimated memory of the buffered entries and of those currently being written
+		self._buffered_bytes = 0
+		self._writing_bytes = 0
+		self._max_buffered_bytes = max_buffered_bytes
+
 		self._unique_log_file_names = []
 
 		# Auto-flush
 		self._flush_frequency = flush_frequency
 		self._max_entries_in_state = max_entries_in_state
-		self._auto_flush = flush_frequency is not None or max_entries_in_state is not None
+		self._auto_flush = any([x is not None for x in
+			[flush_frequency, max_entries_in_state, max_buffered_bytes]])
 		self._last_flush = time.time()
 
 		# Stopping after
@@ -78,20 +149,21 @@ class StateDao(object):
 		# Make sure the required directories exist
 		for directory_path in [self._state_path, self._log_path]:
 			if not os.path.lexists(directory_path):
-				os.mkdir(directory_path)
+				os.makedirs(directory_path)
 
-		# List all files in state directory
-		files = []
-		for (_, _, filenames) in os.walk(self._state_path):
-			files.extend(filenames)
-			break
+		if self._state_store is not None:
+			self._curr_min_time, client_times = self._state_store.load()
+			self._client_times = ClientTimeIndex(client_times)
+			self._changed_clients = set()
 
-		for file_name in files:
-			# State not initialised and files exist - load from file
-			self._load_state_from_file(file_name)
+			# The client times take precedence over the stored minimum
+			if self._client_times.get_min() is not None:
+				self._curr_min_time = self._client_times.get_min()
 
-		self._printer.prt("Loaded state from {} files from disk.".format(len(files)),
-			only_verbose=True)
+			self._printer.prt("Loaded state of {:,} clients from disk.".format(len(self._client_times)),
+				only_verbose=True)
+
+		self._recover_from_wal()
 
 		return self
 
@@ -101,6 +173,11 @@ class StateDao(object):
 
 		self._write_all_to_files()
 
+		if self._log_writer is not None:
+			self._log_writer.close()
+		elif self._wal is not None:
+			self._wal.close()
+
 		self._printer.prt("Successfully saved state to disk.",
 			only_verbose=True)
 
@@ -109,10 +186,10 @@ class StateDao(object):
 	### Interface methods ###
 
 
-	def cut_log_io(self):
+	def cut_log_io(self, min_time=None):
 		""" Call cut_log and return an I/O-friendly message with its result. """
 
-		result = self.cut_log()
+		result = self.cut_log(min_time)
 		if not result:
 			return "Log is empty"
 
@@ -122,39 +199,76 @@ class StateDao(object):
 			lines_removed, log_length, new_file_path)
 
 
-	def cut_log(self):
+	def cut_log(self, min_time=None):
 		"""
-		Save a copy of the log that is cut at the current minimum time.
+		Save a copy of the log that is cut at the given or else the current minimum time.
 		returns: None if no log file exists, else (lines_removed, log_length, new_file_path).
 		"""
 
-		if not os.path.lexists(self._log_file_path):
+		if not log_segments.get_log_parts(self._log_file_path):
 			return None
 
 		new_file_path = self.create_unique_log_file_path()
 
 		self.flush_log()
 
-		shutil.copyfile(self._log_file_path, new_file_path)
+		# Find the cut before copying - entries written in the meantime are cut off anyway
+		if min_time is None:
+			min_time = self.get_current_min_time()
+		kept_length, kept_bytes, log_length, _ = self._log_index.find_cut(min_time)
+
+		# Sealed segments are shared via hard links; the cut lies within them if no line of the file is kept
+		if self._segments is not None:
+			log_length += self._segments.get_count()
+			if kept_length:
+				kept_length += self._segments.link_to(new_file_path)
+			elif min_time is not None:
+				kept_length += self._segments.link_to(new_file_path, max_time=min_time)
+
+		if os.path.lexists(self._log_file_path):
+			shutil.copyfile(self._log_file_path, new_file_path)
+		else:
+			open(new_file_path, "w").close()
+
+		with open(new_file_path, "r+") as new_log_file:
+			new_log_file.truncate(kept_bytes)
 
-		log_lines = []
-		with open(new_file_path, "r") as new_log_file:
-			log_lines = new_log_file.readlines()
+		return (log_length - kept_length, log_length, new_file_path)
 
-		log_length = len(log_lines)
 
-		current_index = len(log_lines) - 1
-		while True:
-			entry = json.loads(log_lines[current_index])
-			if entry[LogEntry.TIME_UNIX_FIELD] <= self.get_current_min_time():
-				break
-			log_lines.pop()
-			current_index -= 1
+	@staticmethod
+	def merge_shard_logs():
+		"""
+		Append the logs of all shards, including their sealed segments and the entries left in their write-ahead
+		logs, to the log and remove the shard logs. Finds the shards left behind by a run that crashed as well.
+		The shards are merged in time order: The next line is the one with the lowest time_unix among the
+		next lines of all shards, so each shard keeps the order it was written in.
+		Must not be called while a DAO for any of the shards is active.
+		returns: The number of shard logs that were merged.
+		"""
 
-		with open(new_file_path, "w") as new_log_file:
-			new_log_file.writelines(log_lines)
+		shard_log_file_paths = [StateDao.get_log_file_path(s) for s in StateDao._find_shards()]
 
-		return (log_length - len(log_lines), log_length, new_file_path)
+		for shard_log_file_path in shard_log_file_paths:
+			wal = WriteAheadLog(shard_log_file_path)
+			_recover_lines(LogIndex(shard_log_file_path), wal)
+			wal.discard_pending()
+
+		shard_log_parts = [log_segments.get_log_parts(p) for p in shard_log_file_paths]
+		shard_log_parts = [p for p in shard_log_parts if p]
+		if not shard_log_parts:
+			return 0
+
+		with open(StateDao.get_log_file_path(), "a") as log_file:
+			log_file.writelines(_merge_by_time([_yield_parts_lines(p) for p in shard_log_parts]))
+
+		for shard_log_file_path in shard_log_file_paths:
+			for part_path in log_segments.get_log_parts(shard_log_file_path):
+				os.remove(part_path)
+				LogIndex.remove_index(part_path)
+			StateDao._delete_file_if_existing(log_segments.get_manifest_path(shard_log_file_path))
+
+		return len(shard_log_parts)
 
 
 	@staticmethod
@@ -187,6 +301,10 @@ class StateDao(object):
 	def flush_log(self):
 		""" Force a write of all new log entries to disk. """
 
+		if self._log_writer is not None:
+			self._log_writer.flush()
+			return
+
 		number_of_entries = len(self._new_log_entries)
 
 		if number_of_entries == 0:
@@ -197,11 +315,7 @@ class StateDao(object):
 			self._printer.prt("\nTime in msec: %s\n" % round(time.time() * 1000))
 
 		# Maximum number of entries reached on disk: Print info and raise MaximumReachedError
-		if self._maximum_reached(include_state=False):
-			self._printer.prt("Flush blocked - log already has {:,} entries (set maximum: {:,})."
-				.format(self._current_total_entries, self._max_entries_total))
-
-			raise self.MaximumReachedError()
+		self._raise_if_maximum_reached()
 
 		time_now = time.time()
 
@@ -234,17 +348,49 @@ class StateDao(object):
 
 		self._printer.prt(output_message)
 
-		# Remove new entries from list and save them to disk
-		with open(self._log_file_path, "a") as log_file:
-			for _ in range(0, number_of_entries):
-				new_log_entry = self._new_log_entries.pop(0)
-				log_file.write(new_log_entry.get_log_string() + "\n")
-
+		# Take the new entries out of the state so they can be written while new ones arrive
+		log_entries = self._new_log_entries
+		log_entries_bytes = self._buffered_bytes
+		self._new_log_entries = []
+		self._buffered_bytes = 0
+		self._writing_bytes += log_entries_bytes
 		self._last_flush = time_now
 
+		# The journaled entries of this batch are kept until the batch is written
+		wal_generation = self._wal.rotate() if self._wal is not None else None
+
+		try:
+			self._log_index.write_entries(log_entries, self._io_runner)
+		finally:
+			self._writing_bytes -= log_entries_bytes
+
+		if wal_generation is not None:
+			self._wal.discard(wal_generation)
+
+		_FLUSH_DURATION.observe(time.time() - time_now)
+		_FLUSH_SIZE.observe(number_of_entries)
+		_BUFFER_DEPTH.set(len(self._new_log_entries))
+		_BUFFER_BYTES.set(self.get_buffered_bytes())
+
+
+	def get_buffered_bytes(self):
+		""" Estimated memory held by buffered entries, including those that are currently written. """
+
+		if self._log_writer is not None:
+			return self._log_writer.get_pending_bytes()
+
+		return self._buffered_bytes + self._writing_bytes
+
 
 	def get_current_min_time(self):
-		""" Getter for the STATE. Reads from disk and updates internal state. """
+		"""
+		Getter for the STATE. Reads from disk and updates internal state.\n
+		With a shard client, this is the minimum time over all shards.
+		"""
+
+		if self._shard_client is not None:
+			return self._shard_client.get_global_min_time()
+
 		return self._curr_min_time
 
 
@@ -255,7 +401,7 @@ class StateDao(object):
 		"""
 
 		try:
-			return self._client_times[identifier]
+			return self._client_times.get(identifier)
 		except KeyError:
 			self.set_client_time(identifier, None)
 			return None
@@ -264,38 +410,63 @@ class StateDao(object):
 	def set_client_time(self, identifier, new_time):
 		""" Setter for the STATE. Updates the internal state and saves to disk. """
 
-		self._client_times[identifier] = new_time
+		self._client_times.set(identifier, new_time)
+		self._changed_clients.add(identifier)
+		self._curr_min_time = self._client_times.get_min()
 
-		if self._curr_min_time is None:
-			self._curr_min_time = new_time
-		else:
-			self._curr_min_time = min(self._client_times.values())
+
+	def advance_client_times(self, identifiers, next_client_time):
+		"""
+		Set the next time of each given client.
+		*next_client_time: Callable(client time) returning the client's next time - None for new clients.
+		With a shard client, the coordinator advances the times with its own next_client_time instead.
+		returns: The new time of each given client.
+		"""
+
+		if self._shard_client is not None:
+			return self._shard_client.advance_client_times(identifiers)
+
+		new_times = []
+		for identifier in identifiers:
+			try:
+				client_time = self._client_times.get(identifier)
+			except KeyError:
+				client_time = None
+
+			new_times.append(next_client_time(client_time))
+			self.set_client_time(identifier, new_times[-1])
+
+		return new_times
 
 
 	def append_to_log(self, log_entry):
 		""" Append the given LogEntry object to the log. """
 
+		if self._log_writer is not None:
+			self._append_to_writer([log_entry])
+			return
+
+		if self._wal is not None:
+			self._wal.append([log_entry])
+
 		self._new_log_entries.append(log_entry)
+		self._buffered_bytes += StateDao._estimate_size(log_entry)
+		self._flush_if_required()
 
-		if self._maximum_reached(include_state=True):
-			self.flush_log()
-			return
 
-		if not self._auto_flush:
+	def append_all_to_log(self, log_entries):
+		""" Append all given LogEntry objects to the log. Checks for an auto-flush only once. """
+
+		if self._log_writer is not None:
+			self._append_to_writer(log_entries)
 			return
 
-		do_auto_flush = (
-			# max_log was set and is reached
-			(self._max_entries_in_state is not None
-			and len(self._new_log_entries) >= self._max_entries_in_state)
-			or
-			# flush_frequency was set and is reached
-			(self._flush_frequency is not None
-			and self._last_flush + self._flush_frequency <= time.time())
-		)
+		if self._wal is not None:
+			self._wal.append(log_entries)
 
-		if do_auto_flush:
-			self.flush_log()
+		self._new_log_entries.extend(log_entries)
+		self._buffered_bytes += sum([StateDao._estimate_size(e) for e in log_entries])
+		self._flush_if_required()
 
 
 	def create_unique_log_file_path(self):
@@ -310,51 +481,51 @@ class StateDao(object):
 		""" Count the log lines in the file as well as those kept in-memory. """
 
 		log_line_count = len(self._new_log_entries)
+		if self._log_writer is not None:
+			log_line_count += self._log_writer.get_pending_count()
+		if self._segments is not None:
+			log_line_count += self._segments.get_count()
 
-		if not os.path.lexists(self._log_file_path):
-			return log_line_count
+		return log_line_count + self._log_index.count()
 
-		with open(self._log_file_path, "r") as log_file:
-			lines = log_file.readlines()
-			log_line_count += len(lines)
 
-		return log_line_count
 
+	### File access ###
 
 
-	### File access ###
+	def _write_all_to_files(self):
+		""" Save the internal state and append the new log entries. """
 
+		if self._state_store is not None:
+			self._state_store.save(self._curr_min_time, dict(self._client_times.items()), self._changed_clients)
+			self._changed_clients = set()
 
-	def _load_state_from_file(self, file_name):
-		""" Load the state from file. Differentiates between client and state files. """
+		# Append new log entries
+		self.flush_log()
 
-		state_from_file = None
-		with open(self._get_state_path(file_name), "r") as state_file:
-			state_from_file = json.loads(state_file.read())
 
-		if file_name == self._state_file_name:
-			self._curr_min_time = state_from_file
-		else:
-			self._client_times[file_name] = state_from_file
+	def _recover_from_wal(self):
+		"""
+		Write the journaled entries that didn't make it into the log before a crash.
+		The journal is compared with the end of the log so entries that were written are skipped.
+		"""
 
+		if self._wal is None:
+			return
 
-	def _write_all_to_files(self):
-		""" Save the internal state to the corresponding files. """
+		result = _recover_lines(self._log_index, self._wal)
 
-		if not os.path.lexists(self._state_path):
-			os.mkdir(self._state_path)
+		if result is not None:
+			repaired, missing_count, written_count = result
 
-		# Write current minimum time
-		with open(self._state_file_path, "w") as state_file:
-			state_file.write(json.dumps(self._curr_min_time))
+			if repaired:
+				self._printer.prt("Removed an incomplete last line from the log.")
 
-		# Write clients' current time
-		for key, value in self._client_times.items():
-			with open(self._get_state_path(key), "w") as client_file:
-				client_file.write(json.dumps(value))
+			self._current_total_entries += missing_count
+			self._printer.prt("Recovered {:,} entries from the write-ahead log ({:,} were written already)."
+				.format(missing_count, written_count))
 
-		# Append new log entries
-		self.flush_log()
+		self._wal.discard_pending()
 
 
 	def _rename_log_file(self):
@@ -363,11 +534,21 @@ class StateDao(object):
 		returns: Status message denoting success.
 		"""
 
-		if not os.path.lexists(self._log_file_path):
+		if not log_segments.get_log_parts(self._log_file_path):
 			return "File doesn't exist"
 
 		new_file_name = self._create_unique_log_file_path()
-		os.rename(self._log_file_path, new_file_name)
+
+		if os.path.lexists(self._log_file_path):
+			os.rename(self._log_file_path, new_file_name)
+		else:
+			# All entries are in sealed segments
+			open(new_file_name, "w").close()
+		self._log_index.rename(new_file_name)
+
+		if self._segments is not None:
+			self._segments.rename(new_file_name)
+
 		return "File was renamed successfully"
 
 
@@ -377,21 +558,31 @@ class StateDao(object):
 		returns: Status message denoting success.
 		"""
 
+		if self._state_store is None:
+			return "Kept by the shard coordinator"
+
 		if not os.path.lexists(self._state_path):
 			return "Folder doesn't exist"
 
-		# Delete state file
-		StateDao._delete_file_if_existing(
-			self._state_file_path)
-
-		# Delete client files
-		for client_file_path in self._get_client_file_paths():
-			StateDao._delete_file_if_existing(
-				client_file_path)
+		self._state_store.clear()
 
 		return "Cleared successfully"
 
 
+	@staticmethod
+	def _find_shards():
+		""" Return the shards that have a log file, sealed segments or a write-ahead log. """
+
+		if not os.path.lexists(StateDao._LOG_PATH):
+			return []
+
+		# Excludes the cut copies of shard logs, e.g. log_shard_0_until_2017-12-20_18-08-25
+		pattern = re.compile(re.escape(StateDao._LOG_FILE_NAME) + r"_shard_(\d+)(\.|$)")
+		matches = [pattern.match(f) for f in os.listdir(StateDao._LOG_PATH)]
+
+		return sorted(set([int(m.group(1)) for m in matches if m]))
+
+
 	@staticmethod
 	def _delete_file_if_existing(file_path):
 		if os.path.lexists(file_path):
@@ -401,17 +592,21 @@ class StateDao(object):
 	### File paths ###
 
 
-	def _get_client_file_paths(self):
-		""" Create the relative paths of all client files. """
-		paths = []
-		for key in self._client_times:
-			paths.append(self._get_state_path(key))
-		return paths
+	@staticmethod
+	def get_state_path():
+		""" Return the path of the state folder. """
+		return StateDao._STATE_PATH
+
 
+	@staticmethod
+	def get_log_file_path(shard=None):
+		""" Build the path of the log file or of the given shard's log file. """
 
-	def _get_state_path(self, file_name):
-		""" Build a state path to the given file. """
-		return os.path.join(self._state_path, file_name)
+		log_file_name = StateDao._LOG_FILE_NAME
+		if shard is not None:
+			log_file_name += "_shard_{}".format(shard)
+
+		return os.path.join(StateDao._LOG_PATH, log_file_name)
 
 
 	def _create_unique_log_file_path(self):
@@ -421,7 +616,7 @@ class StateDao(object):
 		new_file_name = self._create_log_file_name_from_time(time_unix)
 
 		while os.path.lexists(new_file_name) or (new_file_name in self._unique_log_file_names):
-			time_unix += datetime.timedelta(seconds=1)
+			time_unix += 1
 			new_file_name = self._create_log_file_name_from_time(time_unix)
 
 		self._unique_log_file_names.append(new_file_name)
@@ -442,8 +637,81 @@ class StateDao(object):
 		""" Reset all internal fields. """
 
 		self._curr_min_time = None
-		self._client_times = {}
+		self._client_times = ClientTimeIndex()
+		self._changed_clients = set()
 		self._new_log_entries = []
+		self._buffered_bytes = 0
+
+		_BUFFER_DEPTH.set(0)
+		_BUFFER_BYTES.set(self.get_buffered_bytes())
+
+
+	def _flush_if_required(self):
+		""" Flush if the maximum or one of the auto-flush limits has been reached. """
+
+		_BUFFER_DEPTH.set(len(self._new_log_entries))
+		_BUFFER_BYTES.set(self.get_buffered_bytes())
+
+		if self._maximum_reached(include_state=True):
+			self.flush_log()
+			return
+
+		if not self._auto_flush:
+			return
+
+		do_auto_flush = (
+			# max_log was set and is reached
+			(self._max_entries_in_state is not None
+			and len(self._new_log_entries) >= self._max_entries_in_state)
+			or
+			# flush_frequency was set and is reached
+			(self._flush_frequency is not None
+			and self._last_flush + self._flush_frequency <= time.time())
+			or
+			# max_buffered_bytes was set and is reached
+			(self._max_buffered_bytes is not None
+			and self._buffered_bytes >= self._max_buffered_bytes)
+		)
+
+		if do_auto_flush:
+			self.flush_log()
+
+
+	def _append_to_writer(self, log_entries):
+		""" Hand the given entries to the log writer. The maximum is checked before appending. """
+
+		self._raise_if_maximum_reached()
+
+		if self._timing_mode:
+			self._printer.prt("\nTime in msec: %s\n" % round(time.time() * 1000))
+
+		self._current_total_entries += len(log_entries)
+		self._log_writer.append_all(log_entries, sum([StateDao._estimate_size(e) for e in log_entries]))
+
+		_BUFFER_DEPTH.set(self._log_writer.get_pending_count())
+		_BUFFER_BYTES.set(self.get_buffered_bytes())
+
+
+	def _raise_if_maximum_reached(self):
+		""" Print info and raise MaximumReachedError if the log holds the maximum number of entries. """
+
+		if not self._maximum_reached(include_state=False):
+			return
+
+		self._printer.prt("Flush blocked - log already has {:,} entries (set maximum: {:,})."
+			.format(self._current_total_entries, self._max_entries_total))
+
+		raise self.MaximumReachedError()
+
+
+	@staticmethod
+	def _estimate_size(log_entry):
+		""" Estimate the memory held by the given entry without serialising it. """
+
+		return (StateDao._ENTRY_BASE_SIZE
+			+ len(log_entry.log_message)
+			+ len(log_entry.gps_position)
+			+ len(log_entry.vin))
 
 
 	def _maximum_reached(self, include_state=False):
@@ -471,6 +739,78 @@ class StateDao(object):
 
 
 
+def _recover_lines(log_index, wal):
+	"""
+	Write the lines journaled in the given write-ahead log that are missing at the end of the log.
+	returns: None if nothing was journaled, else (incomplete last line removed, lines written, lines skipped).
+	"""
+
+	journaled_lines = wal.get_pending_lines()
+	if not journaled_lines:
+		return None
+
+	repaired = log_index.repair()
+
+	written_count = _count_overlap(_read_log_tail(log_index, len(journaled_lines)), journaled_lines)
+	missing_lines = journaled_lines[written_count:]
+
+	if missing_lines:
+		log_index.write_entries([LogEntry.from_log_string(l[:-1]) for l in missing_lines])
+
+	return (repaired, len(missing_lines), written_count)
+
+
+def _read_log_tail(log_index, line_count):
+	""" Return the last line_count lines of the log, reading into the sealed segments if required. """
+
+	lines = log_index.read_tail(line_count)
+
+	segment_paths = [p for p in log_segments.get_log_parts(log_index.log_file_path) if p != log_index.log_file_path]
+	for segment_path in reversed(segment_paths):
+		if len(lines) >= line_count:
+			break
+		lines = list(block_log.yield_lines(segment_path))[-(line_count - len(lines)):] + lines
+
+	return lines
+
+
+def _yield_parts_lines(log_parts):
+	""" Yield the lines of the given log parts (see log_segments.get_log_parts) in order. """
+
+	for part_path in log_parts:
+		for line in block_log.yield_lines(part_path):
+			yield line
+
+
+def _merge_by_time(line_iterables):
+	""" Merge the given line iterables by the time_unix of their next lines. Invalid lines keep their place. """
+
+	def _decorate(source_number, lines):
+		""" Yield (time, source number, line) with the time of the last valid line for invalid lines. """
+
+		time_unix = 0
+		for line in lines:
+			line_time = parse_time(line)
+			if line_time is not None:
+				time_unix = line_time
+			yield (time_unix, source_number, line)
+
+	# The source number breaks ties, so lines of one source stay in order and lines aren't compared
+	for _, _, line in heapq.merge(*[_decorate(n, l) for n, l in enumerate(line_iterables)]):
+		yield line
+
+
+def _count_overlap(log_tail, journaled_lines):
+	""" Return the length of the longest beginning of the journaled lines that the log ends with. """
+
+	for count in range(min(len(log_tail), len(journaled_lines)), 0, -1):
+		if log_tail[-count] == journaled_lines[0] and log_tail[-count:] == journaled_lines[:count]:
+			return count
+
+	return 0
+
+
+
 if __name__ == "__main__":
 	with StateDao(True) as DAO:
 		print("yep")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+""" Persistence of the client times """
+
+import json
+import os
+
+
+class StateStore(object):
+	"""
+	Client times and the minimum time, kept in two files in the state folder.\n
+	The snapshot holds the complete state. Every save appends the clients that changed since the
+	previous save to the journal as one line. Loading reads the snapshot and replays the journal.
+	Once the journal outgrows the snapshot, the next save compacts both into a new snapshot.
+	Journal records carry the snapshot's generation, so records left over from before a compaction
+	are ignored.
+	Saving and loading are a few sequential I/Os regardless of the number of clients.\n
+	State folders in the legacy format with one file per client are migrated on load.
+	"""
+
+	_SNAPSHOT_FILE_NAME = "clients.snapshot"
+	_JOURNAL_FILE_NAME = "clients.journal"
+	_LEGACY_STATE_FILE_NAME = "state"
+
+	_GENERATION_KEY = "generation"
+	_MIN_TIME_KEY = "min_time"
+	_CLIENTS_KEY = "clients"
+
+
+	def __init__(self, state_path):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self.state_path = state_path
+		self._snapshot_path = os.path.join(state_path, StateStore._SNAPSHOT_FILE_NAME)
+		self._journal_path = os.path.join(state_path, StateStore._JOURNAL_FILE_NAME)
+
+		self._generation = 0
+
+
+	def load(self):
+		"""
+		Load the state from disk, migrating legacy state files.
+		returns: (minimum time, { identifier : time }) - (None, {}) if nothing was saved.
+		"""
+
+		min_time, client_times = None, {}
+
+		if os.path.lexists(self._snapshot_path):
+			with open(self._snapshot_path, "r") as snapshot_file:
+				snapshot = json.load(snapshot_file)
+			self._generation = snapshot[StateStore._GENERATION_KEY]
+			min_time = snapshot[StateStore._MIN_TIME_KEY]
+			client_times = snapshot[StateStore._CLIENTS_KEY]
+
+		if os.path.lexists(self._journal_path):
+			with open(self._journal_path, "r") as journal_file:
+				for line in journal_file:
+					# Incomplete last record of an interrupted save
+					if not line.endswith("\n"):
+						break
+
+					record = json.loads(line)
+					if record[StateStore._GENERATION_KEY] != self._generation:
+						continue
+
+					min_time = record[StateStore._MIN_TIME_KEY]
+					client_times.update(record[StateStore._CLIENTS_KEY])
+
+		legacy_file_names = self._get_legacy_file_names()
+		if legacy_file_names:
+			min_time, client_times = self._load_legacy_files(legacy_file_names, min_time, client_times)
+			self._write_snapshot(min_time, client_times)
+			self._remove_legacy_files(legacy_file_names)
+
+		return (min_time, client_times)
+
+
+	def save(self, min_time, client_times, changed_identifiers):
+		"""
+		Save the state: Append the changed clients to the journal or compact into a new snapshot.
+		*client_times: All clients as { identifier : time }.
+		*changed_identifiers: The clients that changed since the previous save or load.
+		"""
+
+		if not os.path.lexists(self.state_path):
+			os.makedirs(self.state_path)
+
+		record = json.dumps({
+			StateStore._GENERATION_KEY : self._generation,
+			StateStore._MIN_TIME_KEY : min_time,
+			StateStore._CLIENTS_KEY : {i : client_times[i] for i in changed_identifiers}
+		}, sort_keys=True) + "\n"
+
+		journal_size = os.path.getsize(self._journal_path) if os.path.lexists(self._journal_path) else 0
+		snapshot_size = os.path.getsize(self._snapshot_path) if os.path.lexists(self._snapshot_path) else 0
+
+		if journal_size + len(record) > snapshot_size:
+			self._write_snapshot(min_time, client_times)
+			return
+
+		with open(self._journal_path, "a") as journal_file:
+			journal_file.write(record)
+
+
+	def clear(self):
+		""" Delete all state files. """
+
+		self._generation = 0
+
+		for file_path in [self._snapshot_path, self._journal_path]:
+			if os.path.lexists(file_path):
+				os.remove(file_path)
+
+		self._remove_legacy_files(self._get_legacy_file_names())
+
+
+	### Snapshot ###
+
+
+	def _write_snapshot(self, min_time, client_times):
+		""" Atomically replace the snapshot with the given state and start an empty journal. """
+
+		self._generation += 1
+
+		temp_path = self._snapshot_path + ".tmp"
+		with open(temp_path, "w") as snapshot_file:
+			json.dump({
+				StateStore._GENERATION_KEY : self._generation,
+				StateStore._MIN_TIME_KEY : min_time,
+				StateStore._CLIENTS_KEY : client_times
+			}, snapshot_file, sort_keys=True)
+
+		os.rename(temp_path, self._snapshot_path)
+
+		if os.path.lexists(self._journal_path):
+			os.remove(self._journal_path)
+
+
+	### Legacy format ###
+
+
+	def _get_legacy_file_names(self):
+		""" Return the names of all files in the state folder that belong to the legacy format. """
+
+		if not os.path.lexists(self.state_path):
+			return []
+
+		own_file_names = [
+			StateStore._SNAPSHOT_FILE_NAME,
+			StateStore._JOURNAL_FILE_NAME,
+			StateStore._SNAPSHOT_FILE_NAME + ".tmp"]
+
+		return [f for f in os.listdir(self.state_path)
+			if f not in own_file_names and os.path.isfile(os.path.join(self.state_path, f))]
+
+
+	def _load_legacy_files(self, file_names, min_time, client_times):
+		"""
+		Load the state file and the client files of the legacy format on top of the given state.
+		returns: (minimum time, { identifier : time })
+		"""
+
+		for file_name in file_names:
+			with open(os.path.join(self.state_path, file_name), "r") as state_file:
+				state_from_file = json.loads(state_file.read())
+
+			if file_name == StateStore._LEGACY_STATE_FILE_NAME:
+				min_time = state_from_file
+			else:
+				client_times[file_name] = state_from_file
+
+		return (min_time, client_times)
+
+
+	def _remove_legacy_files(self, file_names):
+		for file_name in file_names:
+			os.remove(os.path.join(self.state_path, file_name))
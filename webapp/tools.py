@@ -12,9 +12,13 @@ import sklearn
 import sklearn.metrics as sk_met
 import sklearn.model_selection as sk_mod
 
+from log_batch import LogBatch
 from log_entry import LogEntry
 from state_dao import StateDao
+from log_index import LogIndex
+import block_log
 import log_file_analysis
+import log_parser
 import util.fmtr
 import util.outp
 import util.prtr
@@ -35,19 +39,18 @@ def split_call(args):
 	if args.max_entries_per_file <= 0:
 		raise ValueError("Max entries need to be > 0. Received: {}".format(args.max_entries_per_file))
 
-	log_entry_generator = _yield_log_entries_from_file(args.file_path)
-
 	if args.train_split:
-		_split_in_train_and_score(log_entry_generator, args.file_path, args.train_split)
+		# The split needs all entries at once - keep them in the compact columnar form
+		_split_in_train_and_score(log_parser.read_batch(args.file_path), args.file_path, args.train_split)
 	elif args.per_app_id:
-		_split_per_app_id(log_entry_generator, args.file_path, args.max_entries_per_file)
+		_split_per_app_id(_yield_log_entries_from_file(args.file_path), args.file_path, args.max_entries_per_file)
 	elif args.in_chunks:
-		_split_in_chunks(log_entry_generator, args.file_path, args.max_entries_per_file)
+		_split_in_chunks(_yield_log_entries_from_file(args.file_path), args.file_path, args.max_entries_per_file)
 	else:
 		raise NotImplementedError("Arg configuration not implemented")
 
 
-def _split_in_train_and_score(log_entry_generator, file_path, split):
+def _split_in_train_and_score(log_entries, file_path, split):
 	""" Split the given entries into a training and a scoring file based on the given split. """
 
 	print("WARNING: --max-entries-per-file is not implemented")
@@ -55,7 +58,7 @@ def _split_in_train_and_score(log_entry_generator, file_path, split):
 	if split <= 0 or split >= 100:
 		raise ValueError("Invalid split \"{}\" given.".format(split))
 
-	training_entries, scoring_entries = _split_log_entries_flow(log_entry_generator, split)
+	training_entries, scoring_entries = _split_log_entries_flow(log_entries, split)
 
 	training_file_path = file_path + "_train"
 	scoring_file_path = file_path + "_score"
@@ -201,55 +204,71 @@ def analyse_call(args):
 	log_file_analysis.analyse(args.file_path, args.to_file, util.prtr.Printer())
 
 
-def _split_log_entries_flow(log_entry_iterator, split, squelch_output=False):
-	""" Split the given log entries equally by app_id and each app_id's class.
-	Updates the user about progress and success. """
+def compress_call(args):
+	""" Unpack the args and call _compress.
+	Expects 'file_path' and 'codec'. """
+	_compress(args.file_path, args.codec)
 
-	printer = util.prtr.Printer(squelch=squelch_output)
 
-	printer.prt("Trying to split the entries according to given split of {}/{}"
-		.format(split, 100 - split))
+def _compress(file_path, codec):
+	""" Block-compress all parts of the given log file in place. Meant for log backups, not the live log. """
+
+	print("Compressing with {}...".format(codec))
+
+	size_before, size_after = 0, 0
+
+	for part_path in Dir.get_file_parts(file_path):
+		part_size = os.path.getsize(part_path)
 
-	# { app_id : { class : [entries] } }
-	entries_per_app_id_per_class = {}
+		if block_log.compress_in_place(part_path, codec):
+			# Compressed files carry their own block index
+			LogIndex.remove_index(part_path)
+			print("{}: {} -> {}".format(part_path,
+				util.fmtr.format_bytes(part_size), util.fmtr.format_bytes(os.path.getsize(part_path))))
 
-	entry_count = 0
+		size_before += part_size
+		size_after += os.path.getsize(part_path)
 
-	# Sort items into buckets
-	for log_entry in log_entry_iterator:
-		entry_count += 1
+	print("Done. Total size: {} -> {}".format(
+		util.fmtr.format_bytes(size_before), util.fmtr.format_bytes(size_after)))
 
-		app_id = ids_tools.log_entry_to_app_id(log_entry)
-		its_class = log_entry.intrusion
 
-		if app_id not in entries_per_app_id_per_class:
-			entries_per_app_id_per_class[app_id] = {}
-		if its_class not in entries_per_app_id_per_class[app_id]:
-			entries_per_app_id_per_class[app_id][its_class] = []
+def _split_log_entries_flow(log_entries, split, squelch_output=False):
+	""" Split the given LogEntry objects or LogBatch equally by app_id and each app_id's class.
+	Updates the user about progress and success.
+	returns: Two LogBatch objects (train, score). """
 
-		entries_per_app_id_per_class[app_id][its_class].append(log_entry)
+	printer = util.prtr.Printer(squelch=squelch_output)
+
+	printer.prt("Trying to split the entries according to given split of {}/{}"
+		.format(split, 100 - split))
 
-	result_train = []
-	result_score = []
+	batch = log_entries if isinstance(log_entries, LogBatch) else LogBatch.from_entries(log_entries)
+
+	# Sort items into buckets: { (app_id, class) : [entry indices] }
+	indices_per_app_id_and_class = batch.get_group_indices(
+		[LogEntry.APP_ID_FIELD, LogBatch.INTRUSION_FIELD],
+		key=lambda values: (ids_tools.strip_app_id(values[0]), values[1]))
+
+	train_indices = []
+	score_indices = []
 
 	# Split each bucket and add to the result
-	for app_id in entries_per_app_id_per_class:
-		for a_class in entries_per_app_id_per_class[app_id]:
-			items = entries_per_app_id_per_class[app_id][a_class]
+	for bucket in sorted(indices_per_app_id_and_class):
+		indices = indices_per_app_id_and_class[bucket]
 
-			its_split = int((split / 100.0) * len(items))
+		its_split = int((split / 100.0) * len(indices))
 
-			result_train += items[:its_split]
-			result_score += items[its_split:]
+		train_indices += indices[:its_split]
+		score_indices += indices[its_split:]
 
-	achieved_split = round((len(result_train) / float(entry_count)) * 100, 2)
+	achieved_split = round((len(train_indices) / float(len(batch))) * 100, 2)
 	printer.prt("Done. Achieved a split of {}/{}".format(achieved_split, 100 - achieved_split))
-	return result_train, result_score
+	return batch.select(train_indices), batch.select(score_indices)
 
 
 def _yield_log_entries_from_file(file_path):
-	for line in Dir.yield_lines(file_path):
-		yield LogEntry.from_log_string(line)
+	return log_parser.yield_entries(file_path)
 
 
 def _save_entries_flow(log_entry_iterator, file_path):
@@ -300,6 +319,12 @@ if __name__ == "__main__":
 			help="Save the analysis to file.")
 		ANALYSE_PARSER.set_defaults(function=analyse_call)
 
+		COMPRESS_PARSER = SUBPARSERS.add_parser("compress",
+			help="Block-compress a log file and its segments in place (see block_log)")
+		COMPRESS_PARSER.add_argument("file_path", metavar="PATH")
+		COMPRESS_PARSER.add_argument("--codec", choices=sorted(block_log.CODECS), default=block_log.DEFAULT_CODEC)
+		COMPRESS_PARSER.set_defaults(function=compress_call)
+
 		if len(sys.argv) == 1:
 			PARSER.print_help()
 			exit()
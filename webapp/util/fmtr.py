@@ -44,6 +44,22 @@ def format_percentage(value, pad_spaces=False, digits=0):
 	return string
 
 
+def format_bytes(byte_count):
+	""" Format the given number of bytes as "512 B", "1.5 KB", "20.3 MB" or "2.1 GB". """
+
+	if byte_count < 1024:
+		return "{:,} B".format(byte_count)
+
+	units = ["KB", "MB", "GB"]
+	unit_index = 0
+	value = byte_count / 1024.0
+	while value >= 1024 and unit_index < len(units) - 1:
+		value /= 1024
+		unit_index += 1
+
+	return "{:,.1f} {}".format(value, units[unit_index])
+
+
 def fit_string_in(in_str, given_len):
 	""" Fits the given string in a string of length given_len. """
 	return in_str[:given_len].ljust(given_len)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+""" Metrics in the text exposition format """
+
+import collections
+import threading
+
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [1, 10, 100, 1000, 10000, 100000, 1000000]
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Metric(object):
+	""" Base class for metrics with optional labels. """
+
+	TYPE = None
+
+
+	def __init__(self, name, description, label_names=()):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self.name = name
+		self.description = description
+		self.label_names = tuple(label_names)
+
+		self._lock = _create_lock()
+		# { (label values) : value(s) }
+		self._values = {}
+
+
+	def get_lines(self):
+		""" Return the lines of this metric in the text exposition format. """
+		return self.get_header_lines() + self.get_sample_lines()
+
+
+	def get_header_lines(self):
+		""" Return the HELP and TYPE lines of this metric. """
+
+		return [
+			"# HELP {} {}".format(self.name, self.description),
+			"# TYPE {} {}".format(self.name, self.TYPE)
+		]
+
+
+	def get_sample_lines(self, const_labels=()):
+		"""
+		Return the sample lines of this metric.
+		*const_labels: (name, value) pairs added to every sample, e.g. to tell processes apart.
+		"""
+
+		with self._lock:
+			items = sorted(self._values.items())
+
+		lines = []
+		for label_values, value in items:
+			lines.extend(self._get_value_lines(label_values, value, tuple(const_labels)))
+
+		return lines
+
+
+	def _get_value_lines(self, label_values, value, const_labels):
+		""" Return the sample lines for the given label values. """
+		return [self._format_sample(self.name, label_values, value, const_labels)]
+
+
+	def _get_label_values(self, labels):
+		""" Convert the given labels dict to a tuple of values in the order of our label names. """
+
+		if len(labels) != len(self.label_names) or any([n not in labels for n in self.label_names]):
+			raise ValueError("Expected labels {}. Got: {}".format(self.label_names, labels.keys()))
+
+		return tuple([str(labels[n]) for n in self.label_names])
+
+
+	def _format_sample(self, name, label_values, value, const_labels=(), extra_label=None):
+		""" Format one sample as 'name{label="value"} 1.0'. """
+
+		label_pairs = zip(self.label_names, label_values) + list(const_labels)
+		if extra_label is not None:
+			label_pairs.append(extra_label)
+
+		label_str = ""
+		if label_pairs:
+			label_str = "{" + ",".join(["{}=\"{}\"".format(n, _escape(v)) for n, v in label_pairs]) + "}"
+
+		return "{}{} {}".format(name, label_str, _format_value(value))
+
+
+
+class Counter(Metric):
+	""" Monotonically increasing value. """
+
+	TYPE = "counter"
+
+
+	def inc(self, amount=1, **labels):
+		""" Increase the counter with the given labels by amount. """
+
+		key = self._get_label_values(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+
+
+class Gauge(Metric):
+	""" Value that can go up and down. """
+
+	TYPE = "gauge"
+
+
+	def set(self, value, **labels):
+		""" Set the gauge with the given labels to value. """
+
+		key = self._get_label_values(labels)
+		with self._lock:
+			self._values[key] = value
+
+
+
+class Histogram(Metric):
+	""" Distribution of observed values in cumulative buckets. """
+
+	TYPE = "histogram"
+
+
+	def __init__(self, name, description, label_names=(), buckets=None):
+		""" Ctor """
+
+		super(Histogram, self).__init__(name, description, label_names)
+		self.buckets = sorted(buckets or LATENCY_BUCKETS)
+
+
+	def observe(self, value, count=1, **labels):
+		""" Record the given value count times for the given labels. """
+
+		key = self._get_label_values(labels)
+		with self._lock:
+			if key not in self._values:
+				# [count per bucket (non-cumulative) ..., count above all buckets], sum, count
+				self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+			bucket_counts, _, _ = self._values[key]
+
+			index = 0
+			while index < len(self.buckets) and value > self.buckets[index]:
+				index += 1
+			bucket_counts[index] += count
+
+			self._values[key][1] += value * count
+			self._values[key][2] += count
+
+
+	def _get_value_lines(self, label_values, value, const_labels):
+		""" Return the bucket, sum and count lines for the given label values. """
+
+		bucket_counts, value_sum, value_count = value
+
+		lines = []
+		cumulative_count = 0
+		for bound, bucket_count in zip(self.buckets + ["+Inf"], bucket_counts):
+			cumulative_count += bucket_count
+			lines.append(self._format_sample(
+				self.name + "_bucket", label_values, cumulative_count, const_labels, extra_label=("le", bound)))
+
+		lines.append(self._format_sample(self.name + "_sum", label_values, value_sum, const_labels))
+		lines.append(self._format_sample(self.name + "_count", label_values, value_count, const_labels))
+		return lines
+
+
+
+class Registry(object):
+	""" Collection of metrics that can be exposed together. """
+
+	def __init__(self):
+		""" Ctor """
+
+		object.__init__(self)
+
+		self._metrics = []
+
+
+	def counter(self, name, description, label_names=()):
+		""" Create and register a Counter. """
+		return self._register(Counter(name, description, label_names))
+
+
+	def gauge(self, name, description, label_names=()):
+		""" Create and register a Gauge. """
+		return self._register(Gauge(name, description, label_names))
+
+
+	def histogram(self, name, description, label_names=(), buckets=None):
+		""" Create and register a Histogram. """
+		return self._register(Histogram(name, description, label_names, buckets))
+
+
+	def get_exposition(self):
+		""" Return all registered metrics in the text exposition format. """
+		return format_exposition([self.get_families()])
+
+
+	def get_families(self, const_labels=()):
+		"""
+		Return each registered metric as (name, header lines, sample lines), e.g. to be sent to another process.
+		*const_labels: (name, value) pairs added to every sample, e.g. to tell processes apart.
+		"""
+		return [(m.name, m.get_header_lines(), m.get_sample_lines(const_labels)) for m in self._metrics]
+
+
+	def _register(self, metric):
+		""" Add the given metric. Names need to be unique. """
+
+		if any([m.name == metric.name for m in self._metrics]):
+			raise ValueError("Metric {} is already registered!".format(metric.name))
+
+		self._metrics.append(metric)
+		return metric
+
+
+# Process-wide default registry
+REGISTRY = Registry()
+
+
+def format_exposition(families_per_registry):
+	"""
+	Return the metrics of the given registries in the text exposition format, e.g. those of several processes.
+	*families_per_registry: Results of Registry.get_families(). Each metric gets one header followed by
+	its samples from all registries.
+	"""
+
+	header_lines_per_name = collections.OrderedDict()
+	sample_lines_per_name = {}
+
+	for families in families_per_registry:
+		for name, header_lines, sample_lines in families:
+			header_lines_per_name.setdefault(name, header_lines)
+			sample_lines_per_name.setdefault(name, []).extend(sample_lines)
+
+	lines = []
+	for name, header_lines in header_lines_per_name.items():
+		lines.extend(header_lines)
+		lines.extend(sample_lines_per_name[name])
+
+	return "\n".join(lines) + "\n"
+
+
+### Helpers ###
+
+
+def _create_lock():
+	"""
+	Create a lock of the OS thread library, even if gevent monkey-patched threading.
+	Metrics are updated from the hub's greenlets and from native threads of gevent thread pools alike -
+	a monkey-patched lock can't be shared between them.
+	"""
+
+	try:
+		from gevent.monkey import get_original
+	except ImportError:
+		return threading.Lock()
+
+	return get_original("threading", "Lock")()
+
+
+def _escape(value):
+	""" Escape a label value. """
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+	""" Format a sample value. """
+
+	if isinstance(value, float):
+		return repr(value)
+
+	return str(value)
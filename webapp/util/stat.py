@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """ Statistics """
 
+import math
 import statistics as stats
 
 
@@ -13,3 +14,16 @@ def index_of_dispersion(sequence):
 	""" Calculate the variance-to-mean ratio of a sequence. """
 	float_seq = [float(x) for x in sequence]
 	return stats.pvariance(float_seq) / stats.mean(float_seq)
+
+
+def percentile(sequence, percent):
+	""" Nearest-rank percentile of the given sequence. percent needs to be in (0, 100]. """
+
+	if not sequence:
+		raise ValueError("Sequence is empty!")
+	if percent <= 0 or percent > 100:
+		raise ValueError("percent must be in (0, 100]")
+
+	sorted_seq = sorted(sequence)
+	rank = int(math.ceil(percent / 100.0 * len(sorted_seq)))
+	return sorted_seq[rank - 1]
@@ -9,26 +9,112 @@ monkey.patch_all()
 
 # pylint: disable-msg=C0411,C0413
 import argparse
+import json
+import os
 import random
+import socket
 import time
-from bottle import post, get, run, request, BaseResponse
+from bottle import post, get, run, request, install, BaseResponse, HTTPResponse, FormsDict, default_app
+from gevent.pywsgi import WSGIServer
+from gevent.threadpool import ThreadPool
 
 from log_entry import LogEntry
+import binary_records
+import block_log
 from state_dao import StateDao
+from log_writer import LogWriter
+from log_index import LogIndex
+from log_segments import LogSegments
+from write_ahead_log import WriteAheadLog
+from shard_coordinator import ShardCoordinator
 from ids.live_ids import LiveIds
+from ids.detection_queue import DetectionQueue
+from ids.alert_feed import AlertFeed, AlertJournal
+from ids.dir_utils import LogDir
 from functionality.country_code_mapper import CountryCodeMapper
 from functionality.poi_mapper import PoiMapper
 from functionality.routing_mapper import RoutingMapper
 import util.fmtr
+import util.mtrc
 
 
 DAO = None
 IDS = None
+DETECTION_QUEUE = None
+
+# Connection of this worker to the shard coordinator in the --workers mode
+SHARD_CLIENT = None
+
+# Thread pool for the classification in the "gevent-threadpool" server mode
+CLASSIFICATION_POOL = None
 
 # Configuration
 DETECT = True
 STORE = True
 
+# Backpressure: Refuse new entries while the buffered entries exceed this estimated size in bytes
+MAX_BUFFERED_BYTES = None
+RETRY_AFTER = 1
+
+HOST = "localhost"
+PORT = 5000
+
+# gevent: Everything runs on the hub; blocking disk writes and classification stall all requests.
+# gevent-threadpool: Disk writes and classification run on native threads, the hub keeps serving.
+SERVER_MODES = ["gevent", "gevent-threadpool"]
+
+# Metrics
+REQUEST_COUNT = util.mtrc.REGISTRY.counter(
+	"api_requests_total", "Number of handled requests", ["endpoint"])
+REQUEST_DURATION = util.mtrc.REGISTRY.histogram(
+	"api_request_duration_seconds", "Time spent handling requests", ["endpoint"])
+REQUESTS_REJECTED = util.mtrc.REGISTRY.counter(
+	"api_requests_rejected_total", "Number of requests refused due to overload", ["endpoint"])
+
+
+### Request metrics ###
+
+
+def _measure_request(callback):
+	""" Bottle plugin: Count the requests and measure their latency per endpoint. """
+
+	def wrapper(*args, **kwargs):
+		""" Call the endpoint and record its metrics. """
+
+		time_before = time.time()
+		try:
+			return callback(*args, **kwargs)
+		finally:
+			endpoint = request.route.rule
+			REQUEST_COUNT.inc(endpoint=endpoint)
+			REQUEST_DURATION.observe(time.time() - time_before, endpoint=endpoint)
+
+	return wrapper
+
+
+def _reject_when_overloaded(callback):
+	"""
+	Bottle plugin: Answer ingestion requests with 503 and Retry-After while the server is overloaded.
+	Overloaded means the DAO holds more than MAX_BUFFERED_BYTES or the detection queue is full.
+	"""
+
+	def wrapper(*args, **kwargs):
+		""" Refuse the request or call the endpoint. """
+
+		if _is_ingestion_route(request.route.rule) and _is_overloaded():
+			REQUESTS_REJECTED.inc(endpoint=request.route.rule)
+			return HTTPResponse(body="Server is overloaded. Retry later.", status=503,
+				headers={"Retry-After" : str(RETRY_AFTER)})
+
+		return callback(*args, **kwargs)
+
+	return wrapper
+
+
+install(_measure_request)
+install(_reject_when_overloaded)
+
+
 
 ### API endpoints ###
 
@@ -36,80 +122,141 @@ STORE = True
 @post("/log/data/<generator>")
 def log_data(generator):
 	""" Log endpoint for data generator """
-	_log_num(generator)
+	_append_and_detect(_create_num_log_entry(generator, request.params))
+
 
+@post("/log/colour")
+def log_colour():
+	""" Log the given colour. """
+	_append_and_detect(_create_colour_log_entry(request.params))
+
+
+@post("/get/country-code")
+def get_country_code():
+	""" Map coordinates to country code and save to log. """
+	_append_and_detect(_create_country_code_log_entry(request.params))
+
+
+@post("/get/poi")
+def get_poi():
+	""" Map coordinates to POI of given type and save to log. """
+	_append_and_detect(_create_poi_log_entry(request.params))
+
+
+@post("/get/tsp")
+def get_tsp_routing():
+	""" Map current and goal coordinates to TSP and save to log. """
+	_append_and_detect(_create_tsp_log_entry(request.params))
 
-def _log_num(name):
-	""" Log the given number under the given method name. """
 
-	number_log_entry = _create_base_log_entry(request.params.vin)
+@post("/log/batch")
+def log_batch():
+	"""
+	Log all records contained in the request body in one go.\n
+	Expects one JSON object per line. Each object names its target in the field "endpoint"
+	(e.g. "log/data/gaussian", "log/colour", "get/poi") and otherwise holds the same fields
+	as a request to that endpoint.
+	An invalid record rejects the whole batch with 400 before any client time is changed.
+	"""
+
+	try:
+		log_entries = [_create_log_entry_from_record(line) for line in request.body if line.strip()]
+	except ValueError as error:
+		return HTTPResponse(body="Invalid batch: {}".format(error), status=400)
+
+	_append_and_detect_all(log_entries)
+
+	return BaseResponse(body="Logged {} entries.".format(len(log_entries)), status=200)
+
+
+
+@post("/log/binary")
+def log_binary():
+	""" Log all compact binary records (see binary_records) contained in the request body. """
+
+	try:
+		log_entries = [_create_log_entry_from_params(endpoint, _record_to_params(params))
+			for endpoint, params in binary_records.decode_records(request.body.read())]
+	except ValueError as error:
+		return HTTPResponse(body="Invalid records: {}".format(error), status=400)
+
+	_append_and_detect_all(log_entries)
+
+	return BaseResponse(body="Logged {} entries.".format(len(log_entries)), status=200)
+
+
+
+### Log entry creation ###
+
+
+def _create_num_log_entry(name, params):
+	""" Create a log entry for the number generated by the given generator. """
+
+	number_log_entry = _create_base_log_entry(params.vin)
 
 	number_log_entry.complete(
 		app_id=name.upper(),
-		log_message=request.params.generated,
-		intrusion=request.params.intrusion
+		log_message=params.generated,
+		intrusion=params.intrusion
 	)
 
-	_append_and_detect(number_log_entry)
+	return number_log_entry
 
 
-@post("/log/colour")
-def log_colour():
-	""" Log the given colour. """
+def _create_colour_log_entry(params):
+	""" Create a log entry for the given colour. """
 
-	crd_x = request.params.x
-	crd_y = request.params.y
+	crd_x = params.x
+	crd_y = params.y
 
-	colour_log_entry = _create_base_log_entry(request.params.vin)
+	colour_log_entry = _create_base_log_entry(params.vin)
 
 	colour_log_entry.complete(
 		app_id="COLOUR",
-		log_message=request.params.colour,
+		log_message=params.colour,
 		gps_position=_get_position_string(crd_x, crd_y),
-		intrusion=request.params.intrusion
+		intrusion=params.intrusion
 	)
 
-	_append_and_detect(colour_log_entry)
+	return colour_log_entry
 
 
-@post("/get/country-code")
-def get_country_code():
-	""" Map coordinates to country code and save to log. """
+def _create_country_code_log_entry(params):
+	""" Map coordinates to country code and create a log entry. """
 
-	crd_x = request.params.x
-	crd_y = request.params.y
+	crd_x = params.x
+	crd_y = params.y
 
 	app_id = "COUNTRYCODE"
 	position = _get_position_string(crd_x, crd_y)
 
 	country_code = CountryCodeMapper.map(crd_x, crd_y)
 
-	cc_log_entry = _create_base_log_entry(request.params.vin)
+	cc_log_entry = _create_base_log_entry(params.vin)
 
 	cc_log_entry.complete(
 		app_id=app_id,
 		log_message=str(country_code),
 		gps_position=position,
-		intrusion=request.params.intrusion
+		intrusion=params.intrusion
 	)
 
-	_append_and_detect(cc_log_entry)
+	return cc_log_entry
 
 
-@post("/get/poi")
-def get_poi():
-	""" Map coordinates to POI of given type and save to log. """
+def _create_poi_log_entry(params):
+	""" Map coordinates to POI of given type and create a log entry. """
 
-	crd_x = request.params.x
-	crd_y = request.params.y
-	poi_type = request.params.type
+	crd_x = params.x
+	crd_y = params.y
+	poi_type = params.type
 
 	app_id = "POI"
 	position = _get_position_string(crd_x, crd_y)
 
 	poi_result = PoiMapper.map(poi_type, crd_x, crd_y)
 
-	poi_log_entry = _create_base_log_entry(request.params.vin)
+	poi_log_entry = _create_base_log_entry(params.vin)
 
 	log_message = "{},{}".format(poi_type, poi_result)
 	level = LogEntry.LEVEL_DEFAULT
@@ -122,36 +269,116 @@ def get_poi():
 		log_message=log_message,
 		gps_position=position,
 		level=level,
-		intrusion=request.params.intrusion
+		intrusion=params.intrusion
 	)
 
-	_append_and_detect(poi_log_entry)
+	return poi_log_entry
 
 
-@post("/get/tsp")
-def get_tsp_routing():
-	""" Map current and goal coordinates to TSP and save to log. """
+def _create_tsp_log_entry(params):
+	""" Map current and goal coordinates to TSP and create a log entry. """
 
-	crd_x = request.params.x
-	crd_y = request.params.y
-	targ_x = request.params.targ_x
-	targ_y = request.params.targ_y
+	crd_x = params.x
+	crd_y = params.y
+	targ_x = params.targ_x
+	targ_y = params.targ_y
 
 	app_id = "TSPROUTING"
 	position = _get_position_string(crd_x, crd_y)
 
 	tsp_message = RoutingMapper.map(crd_x, crd_y, targ_x, targ_y)
 
-	tsp_log_entry = _create_base_log_entry(request.params.vin)
+	tsp_log_entry = _create_base_log_entry(params.vin)
 
 	tsp_log_entry.complete(
 		app_id=app_id,
 		log_message=tsp_message,
 		gps_position=position,
-		intrusion=request.params.intrusion
+		intrusion=params.intrusion
 	)
 
-	_append_and_detect(tsp_log_entry)
+	return tsp_log_entry
+
+
+# Record endpoint : log entry creator
+_RECORD_ENTRY_CREATORS = {
+	"log/colour" : _create_colour_log_entry,
+	"get/country-code" : _create_country_code_log_entry,
+	"get/poi" : _create_poi_log_entry,
+	"get/tsp" : _create_tsp_log_entry
+}
+_RECORD_DATA_PREFIX = "log/data/"
+
+
+def _create_log_entry_from_record(record_line):
+	""" Create a log entry from a JSON record of the format used by /log/batch. """
+
+	record = json.loads(record_line)
+	if not isinstance(record, dict):
+		raise ValueError("Record is not an object: {}".format(record_line))
+
+	endpoint = record.pop("endpoint", None)
+	if endpoint is None:
+		raise ValueError("Record misses its endpoint: {}".format(record_line))
+
+	return _create_log_entry_from_params(endpoint, _record_to_params(record))
+
+
+def _create_log_entry_from_params(endpoint, params):
+	""" Create a log entry as the given endpoint (e.g. "get/poi") would for the given params. """
+
+	endpoint = endpoint.strip("/")
+
+	if endpoint.startswith(_RECORD_DATA_PREFIX):
+		return _create_num_log_entry(endpoint[len(_RECORD_DATA_PREFIX):], params)
+
+	if endpoint not in _RECORD_ENTRY_CREATORS:
+		raise ValueError("Invalid endpoint: {}".format(endpoint))
+
+	return _RECORD_ENTRY_CREATORS[endpoint](params)
+
+
+def _record_to_params(record):
+	""" Wrap the given dict so it can be accessed like request.params. """
+
+	params = FormsDict(record)
+	# Values are already decoded
+	params.recode_unicode = False
+	return params
+
+
+
+### IDS zone
+
+
+# Maximum time a request to /ids/alerts waits for new alerts
+_MAX_ALERT_TIMEOUT = 60
+
+
+@get("/ids/alerts")
+def get_alerts():
+	"""
+	Long-poll for intrusion alerts.\n
+	Returns the alerts with a sequence number above "since" (default: 0) as JSON. If there are none,
+	waits up to "timeout" seconds (default: 0) for new ones. Pass the returned "last_seq" as the next
+	"since" to follow the feed. Alerts that dropped out of the in-memory buffer are only available in
+	the journal (alerts*.log in the IDS log directory).
+	"""
+
+	if not DETECT:
+		return HTTPResponse(body="Detection is disabled.", status=404)
+
+	try:
+		since = int(request.params.get("since", 0))
+		timeout = min(float(request.params.get("timeout", 0)), _MAX_ALERT_TIMEOUT)
+		limit = int(request.params["limit"]) if "limit" in request.params else None
+	except ValueError as error:
+		return HTTPResponse(body="Invalid parameter: {}".format(error), status=400)
+
+	alerts, last_seq = IDS.alert_feed.get_since(since, timeout=timeout, limit=limit)
+
+	return BaseResponse(body=json.dumps({"alerts" : alerts, "last_seq" : last_seq}), status=200,
+		headers={"Content-Type" : "application/json"})
 
 
 
@@ -159,9 +386,9 @@ def get_tsp_routing():
 
 @get("/UTIL/log-length")
 def get_log_length():
-	""" Count the number of log entries and return the number. """
+	""" Count the number of log entries of all shards and return the number. """
 
-	log_line_count = DAO.count_log_lines()
+	log_line_count = sum(_run_on_all_shards("count_log_lines"))
 
 	message = "The log currently holds {} items.".format(log_line_count)
 	if log_line_count == 0:
@@ -170,11 +397,39 @@ def get_log_length():
 	return BaseResponse(body=message, status=200)
 
 
+@get("/UTIL/detection-status")
+def get_detection_status():
+	""" Return the depth of the detection queue and the current detection lag. """
+
+	if not DETECT:
+		return BaseResponse(body="Detection is disabled.", status=200)
+
+	if DETECTION_QUEUE is None:
+		return BaseResponse(body="Detection runs synchronously.", status=200)
+
+	last_lag, max_lag = DETECTION_QUEUE.get_lag()
+	message = ("Detection queue holds {:,} entries. Detection lag: {:.3f} s (max. {:.3f} s)."
+		.format(DETECTION_QUEUE.get_depth(), last_lag, max_lag))
+
+	return BaseResponse(body=message, status=200)
+
+
+@get("/UTIL/metrics")
+def get_metrics():
+	"""
+	Return the metrics in the text exposition format.
+	In the --workers mode, the samples of all workers are listed with their shard as label "shard".
+	"""
+
+	return BaseResponse(body=util.mtrc.format_exposition(_run_on_all_shards("get_metric_families")), status=200,
+		headers={"Content-Type" : util.mtrc.CONTENT_TYPE})
+
+
 @post("/UTIL/flush-log")
 def flush_log():
-	""" Force a log flush in the DAO. """
+	""" Force a log flush in the DAO of every shard. """
 
-	DAO.flush_log()
+	_run_on_all_shards("flush_log")
 
 	return BaseResponse(body="Log was successfully flushed.", status=200)
 
@@ -185,25 +440,67 @@ def flush_log():
 
 @post("/DANGER/cut-log")
 def cut_log():
-	""" Cut the log off at the common minimum time of all clients. """
+	""" Cut the log of every shard off at the common minimum time of all clients. """
 
 	minimum_time = DAO.get_current_min_time()
 
 	print("Minimum time is {}. Now processing - this might take some time...".format(
 		time.strftime("%Y-%m-%d, %H:%M", time.localtime(minimum_time))))
 
-	message = DAO.cut_log_io()
+	message = _join_shard_messages(_run_on_all_shards("cut_log", min_time=minimum_time))
 
 	return BaseResponse(body=message, status=200)
 
 
 @post("/DANGER/reset")
 def reset():
-	""" Rename the log and clear the state. """
+	""" Rename the log and clear the state of every shard. """
 
 	print("Server is resetting...")
 
 	reset_models = request.params.models == "reset"
+	status_msg = _join_shard_messages(_run_on_all_shards("reset", reset_models=reset_models))
+
+	if SHARD_CLIENT is not None:
+		status_msg += "\nClient times: " + SHARD_CLIENT.reset_client_times()
+
+	return BaseResponse(body=status_msg, status=200)
+
+
+
+### Shard commands - run on every worker in the --workers mode
+
+
+def _run_on_all_shards(command, **args):
+	"""
+	Run the given shard command on the workers of all shards, or in this process without workers.
+	returns: The results in the order of the shards.
+	"""
+
+	if SHARD_CLIENT is None:
+		return [_SHARD_COMMANDS[command](**args)]
+
+	return SHARD_CLIENT.broadcast(command, **args)
+
+
+def _join_shard_messages(messages):
+	""" Join the messages of the shard commands, prefixed with their shard if there are several. """
+
+	if len(messages) == 1:
+		return messages[0]
+
+	return "\n".join(["Shard {}: {}".format(shard, message) for shard, message in enumerate(messages)])
+
+
+def _get_metric_families():
+	""" Return the metrics of this process, labelled with its shard in the --workers mode. """
+
+	const_labels = [] if SHARD_CLIENT is None else [("shard", SHARD_CLIENT.shard)]
+	return util.mtrc.REGISTRY.get_families(const_labels)
+
+
+def _reset_shard(reset_models):
+	""" Rename the log and clear the state of this process. returns: Status message. """
 
 	status_msg = ""
 	try:
@@ -222,42 +519,71 @@ def reset():
 
 	print(status_msg)
 
-	return BaseResponse(body=status_msg, status=200)
+	return status_msg
+
+
+# The lambdas look up the DAO when called, as it's created in _serve().
+# Commands must not broadcast themselves, which waits for the running broadcast to finish.
+_SHARD_COMMANDS = {
+	"count_log_lines" : lambda: DAO.count_log_lines(),
+	"flush_log" : lambda: DAO.flush_log(),
+	"cut_log" : lambda min_time: DAO.cut_log_io(min_time),
+	"get_metric_families" : _get_metric_families,
+	"reset" : _reset_shard
+}
 
 
 
 ### Helper methods ###
 
 
+def _is_ingestion_route(rule):
+	""" Whether the given route creates log entries. """
+	return rule.startswith("/log/") or rule.startswith("/get/")
+
+
+def _is_overloaded():
+	""" Whether buffered entries exceed their budget or the detection queue can't take more. """
+
+	if STORE and MAX_BUFFERED_BYTES is not None and DAO.get_buffered_bytes() >= MAX_BUFFERED_BYTES:
+		return True
+
+	return DETECT and DETECTION_QUEUE is not None and DETECTION_QUEUE.is_full()
+
+
 def _get_position_string(crd_x, crd_y):
 	""" Creates a position string of the format '41.123,40.31312' """
 	return "{},{}".format(crd_x, crd_y)
 
 
 def _create_base_log_entry(vin):
-	""" Verifies the given VIN and creates a log entry with the current client time. """
+	""" Verifies the given VIN and creates a log entry. Its client time is set by _set_client_times(). """
 
 	if vin is None:
 		raise ValueError("No VIN given!")
 
-	time_unix = _create_client_time(vin)
-	return LogEntry.create_base_entry(vin, time_unix)
+	return LogEntry.create_base_entry(vin)
 
 
-def _create_client_time(identifier):
-	""" Creates a time for the client. Randomly increments time with 5 % chance. """
+def _set_client_times(log_entries):
+	"""
+	Set the client time of each given entry.
+	Called once all entries of a request were created, so an invalid record doesn't change any client time.
+	"""
 
-	client_time = DAO.get_client_time(identifier)
-	time_now = time.time()
+	client_times = DAO.advance_client_times([e.vin for e in log_entries], _next_client_time)
 
-	if client_time is None:
-		DAO.set_client_time(identifier, time_now)
-		return time_now
+	for log_entry, client_time in zip(log_entries, client_times):
+		log_entry.set_any(time_unix=client_time)
 
-	time_choice = random.choice([client_time] * 19 + [client_time + random.randint(3600, 57600)])
-	DAO.set_client_time(identifier, time_choice)
 
-	return time_choice
+def _next_client_time(client_time):
+	""" Creates the next time for a client. Randomly increments time with 5 % chance. """
+
+	if client_time is None:
+		return time.time()
+
+	return random.choice([client_time] * 19 + [client_time + random.randint(3600, 57600)])
 
 
 
@@ -267,13 +593,45 @@ def _create_client_time(identifier):
 def _append_and_detect(new_log_entry):
 	""" Append the given string plus a newline to the log file and detect possible intrusions. """
 
+	_set_client_times([new_log_entry])
+
 	if STORE:
 		try:
 			DAO.append_to_log(new_log_entry)
 		except StateDao.MaximumReachedError:
 			exit()
 	if DETECT:
-		IDS.process(new_log_entry)
+		_detect([new_log_entry])
+
+
+def _append_and_detect_all(new_log_entries):
+	""" Append all given entries to the log at once and detect possible intrusions in bulk. """
+
+	if not new_log_entries:
+		return
+
+	_set_client_times(new_log_entries)
+
+	if STORE:
+		try:
+			DAO.append_all_to_log(new_log_entries)
+		except StateDao.MaximumReachedError:
+			exit()
+	if DETECT:
+		_detect(new_log_entries)
+
+
+def _detect(new_log_entries):
+	""" Queue the given entries for detection or detect synchronously if no queue is used. """
+
+	if DETECTION_QUEUE is not None:
+		DETECTION_QUEUE.put_all(new_log_entries)
+	elif CLASSIFICATION_POOL is not None:
+		IDS.process_all(new_log_entries, CLASSIFICATION_POOL.apply)
+	elif len(new_log_entries) == 1:
+		IDS.process(new_log_entries[0])
+	else:
+		IDS.process_all(new_log_entries)
 
 
 
@@ -285,13 +643,55 @@ PARSER = argparse.ArgumentParser()
 PARSER.add_argument("--verbose", "-v", action="store_true")
 PARSER.add_argument("--dont-detect", "-d", action="store_false", dest="detect")
 PARSER.add_argument("--dont-store", "-s", action="store_false", dest="store")
+PARSER.add_argument("--sync-detection", action="store_true",
+	help="Detect intrusions within the request instead of in background workers.")
+PARSER.add_argument("--detection-queue-size", type=int, default=10000, metavar="N",
+	help="Maximum number of log entries waiting for detection")
+PARSER.add_argument("--detection-workers", type=int, default=1, metavar="N")
+PARSER.add_argument("--alert-buffer", type=int, default=10000, metavar="N",
+	help="Number of alerts kept in memory for /ids/alerts")
+PARSER.add_argument("--alert-journal-mb", type=float, default=10, metavar="MB",
+	help="Size at which the alert journal is rotated")
+PARSER.add_argument("--alert-journal-backups", type=int, default=5, metavar="N")
 PARSER.add_argument("--flush-frequency", "-f", type=int, metavar="S")
 PARSER.add_argument("--max-entries-in-state", "-m", type=int, metavar="N")
 PARSER.add_argument("--total-max-entries", "-t", type=int, metavar="N", help="Max. total entries")
+PARSER.add_argument("--background-writer", action="store_true",
+	help="Write the log in a background thread, on a native thread in every server mode. Flush limits: --max-entries-in-state, --flush-bytes and"
+	+ " --flush-interval-ms (default: --flush-frequency or 1000 ms).")
+PARSER.add_argument("--flush-bytes", type=int, metavar="B",
+	help="Background writer: Flush once the buffer holds this many (estimated) bytes")
+PARSER.add_argument("--flush-interval-ms", type=int, metavar="MS",
+	help="Background writer: Flush once the oldest buffered entry is this old")
+PARSER.add_argument("--segment-entries", type=int, metavar="N",
+	help="Seal the log into a segment once it holds N entries (see log_segments)")
+PARSER.add_argument("--segment-mb", type=float, metavar="MB",
+	help="Seal the log into a segment once it reaches MB megabytes")
+PARSER.add_argument("--segment-retention", type=int, metavar="N", help="Only keep the latest N segments")
+PARSER.add_argument("--segment-compression", choices=sorted(block_log.CODECS),
+	help="Block-compress sealed segments with the given codec (see block_log)")
+PARSER.add_argument("--wal", action="store_true",
+	help="Journal buffered entries in a write-ahead log and recover them after a crash (see write_ahead_log)")
+PARSER.add_argument("--wal-sync-entries", type=int, metavar="N", help="Write-ahead log: fsync every N entries")
+PARSER.add_argument("--wal-sync-ms", type=int, metavar="MS", help="Write-ahead log: fsync every MS milliseconds")
+PARSER.add_argument("--max-buffered-mb", type=float, metavar="MB",
+	help="Memory budget for buffered entries. Reaching it flushes; new entries are refused with 503"
+	+ " while flushed entries are still being written.")
+PARSER.add_argument("--retry-after", type=int, default=RETRY_AFTER, metavar="S",
+	help="Seconds clients should wait after a 503")
+PARSER.add_argument("--server-mode", choices=SERVER_MODES, default="gevent",
+	help="gevent-threadpool runs disk writes and classification on native threads.")
+PARSER.add_argument("--workers", "-w", type=int, default=1, metavar="N",
+	help="Number of ingestion processes. Each one stores to its own log shard and applies the limits"
+	+ " per shard. The client times are kept in the parent process. Shards are merged into the log"
+	+ " in time order on shutdown.")
 ARGS = PARSER.parse_args()
 
 DETECT = ARGS.detect
 STORE = ARGS.store
+RETRY_AFTER = ARGS.retry_after
+if ARGS.max_buffered_mb is not None:
+	MAX_BUFFERED_BYTES = int(ARGS.max_buffered_mb * 1024 * 1024)
 
 YES_NO = lambda x: "yes" if x else "no"
 IT_NOT = lambda x: "{:,}".format(x) if x else "not set"
@@ -299,14 +699,21 @@ FLUSH_FREQ_TXT = ("flush frequency: {}"
 	.format(util.fmtr.format_time_passed(ARGS.flush_frequency)
 	if ARGS.flush_frequency
 	else "not set"))
+DETECT_TXT = YES_NO(ARGS.detect)
+if ARGS.detect:
+	DETECT_TXT += " (sync)" if ARGS.sync_detection else " (queued)"
 CFG_MSG = ("detect: {} | store: {} | {} | max. entries in state: {} | max. entries total: {}"
-	.format(
-		YES_NO(ARGS.detect),
-		YES_NO(ARGS.store),
-		FLUSH_FREQ_TXT,
-		IT_NOT(ARGS.max_entries_in_state),
-		IT_NOT(ARGS.total_max_entries)
-	)
+	+ " | max. buffered: {} | writer: {} | workers: {} | server mode: {}")
+CFG_MSG = CFG_MSG.format(
+	DETECT_TXT,
+	YES_NO(ARGS.store),
+	FLUSH_FREQ_TXT,
+	IT_NOT(ARGS.max_entries_in_state),
+	IT_NOT(ARGS.total_max_entries),
+	"{} MB".format(ARGS.max_buffered_mb) if ARGS.max_buffered_mb else "not set",
+	"background" if ARGS.background_writer else "inline",
+	ARGS.workers,
+	ARGS.server_mode
 )
 
 if not ARGS.verbose:
@@ -314,15 +721,133 @@ if not ARGS.verbose:
 else:
 	print("Configuration selected: {}".format(CFG_MSG))
 
-with StateDao(verbose=ARGS.verbose,
-	flush_frequency=ARGS.flush_frequency,
-	max_entries_in_state=ARGS.max_entries_in_state,
-	max_entries_total=ARGS.total_max_entries) as dao:
-	if ARGS.verbose:
-		print("")
+if ARGS.workers <= 0:
+	raise ValueError("Worker count must be positive valued!")
+
+
+def _serve(shard=None, coordinator=None, listener=None):
+	"""
+	Run the DAO, the IDS and the server in this process.
+	*shard, coordinator: Shard of a worker process and the ShardCoordinator it connects to.
+	*listener: Optional socket to accept on instead of binding HOST:PORT.
+	"""
+
+	# pylint: disable-msg=W0603; (Global statement - the endpoints use the module state)
+	global DAO, IDS, DETECTION_QUEUE, CLASSIFICATION_POOL, SHARD_CLIENT
+
+	if coordinator is not None:
+		SHARD_CLIENT = coordinator.connect(shard)
+
+	# Thread pools are created per process as they don't survive a fork
+	io_runner = None
+	if ARGS.server_mode == "gevent-threadpool":
+		# A single writer thread keeps the flushes in order
+		io_runner = ThreadPool(1).apply
+		CLASSIFICATION_POOL = ThreadPool(ARGS.detection_workers)
+
+	segments = None
+	if ARGS.segment_entries or ARGS.segment_mb:
+		segments = LogSegments(StateDao.get_log_file_path(shard), max_entries=ARGS.segment_entries,
+			max_bytes=int(ARGS.segment_mb * 1024 * 1024) if ARGS.segment_mb else None,
+			retention=ARGS.segment_retention, compression=ARGS.segment_compression)
+	log_index = LogIndex(StateDao.get_log_file_path(shard), segments=segments)
+
+	wal = None
+	if ARGS.wal:
+		wal = WriteAheadLog(StateDao.get_log_file_path(shard),
+			sync_entries=ARGS.wal_sync_entries, sync_interval_ms=ARGS.wal_sync_ms)
+
+	log_writer = None
+	if ARGS.background_writer:
+		flush_interval_ms = ARGS.flush_interval_ms
+		if flush_interval_ms is None:
+			flush_interval_ms = ARGS.flush_frequency * 1000 if ARGS.flush_frequency else 1000
+
+		# The writer thread is a greenlet once gevent monkey-patched it - write on a native thread anyway
+		log_writer = LogWriter(log_index,
+			max_entries=ARGS.max_entries_in_state, max_bytes=ARGS.flush_bytes,
+			interval_ms=flush_interval_ms, io_runner=(io_runner or ThreadPool(1).apply), wal=wal)
+
+	with StateDao(verbose=ARGS.verbose,
+		flush_frequency=ARGS.flush_frequency,
+		max_entries_in_state=ARGS.max_entries_in_state,
+		max_entries_total=ARGS.total_max_entries,
+		shard=shard, shard_client=SHARD_CLIENT, io_runner=io_runner,
+		max_buffered_bytes=MAX_BUFFERED_BYTES, log_writer=log_writer, log_index=log_index, wal=wal) as dao:
+		if ARGS.verbose:
+			print("")
+
+		DAO = dao
+		if DETECT:
+			journal_name = "alerts" if shard is None else "alerts_shard_{}".format(shard)
+			journal = AlertJournal(LogDir.get_log_path_for(journal_name),
+				max_bytes=int(ARGS.alert_journal_mb * 1024 * 1024), backup_count=ARGS.alert_journal_backups)
+			IDS = LiveIds(verbose=ARGS.verbose, alert_feed=AlertFeed(ARGS.alert_buffer, journal))
+			if not ARGS.sync_detection:
+				DETECTION_QUEUE = DetectionQueue(IDS,
+					max_size=ARGS.detection_queue_size, worker_count=ARGS.detection_workers,
+					runner=(CLASSIFICATION_POOL.apply if CLASSIFICATION_POOL is not None else None))
+
+		if SHARD_CLIENT is not None:
+			SHARD_CLIENT.serve_commands(_SHARD_COMMANDS)
+
+		if listener is None:
+			run(server="gevent", host=HOST, port=PORT, quiet=(not ARGS.verbose))
+		else:
+			try:
+				WSGIServer(listener, default_app(), log=("default" if ARGS.verbose else None)).serve_forever()
+			except KeyboardInterrupt:
+				pass
+
+		# Detect the remaining entries before the DAO is closed
+		if DETECTION_QUEUE is not None:
+			DETECTION_QUEUE.join()
+
+
+def _serve_workers(worker_count):
+	"""
+	Fork worker processes that accept on the same socket, then merge their logs on shutdown.
+	This process keeps the client times for all workers in the shard coordinator.
+	"""
+
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	listener.bind((HOST, PORT))
+	listener.listen(1024)
+
+	with ShardCoordinator(worker_count, _next_client_time, StateDao.get_state_path()) as coordinator:
+		worker_pids = []
+		for shard in range(0, worker_count):
+			pid = os.fork()
+			if pid == 0:
+				try:
+					_serve(shard=shard, coordinator=coordinator, listener=listener)
+				finally:
+					# pylint: disable-msg=W0212; (Protected member - skip the parent's cleanup)
+					os._exit(0)
+			worker_pids.append(pid)
+
+		print("Started {} workers on {}:{}".format(worker_count, HOST, PORT))
+
+		coordinator.start()
+		try:
+			coordinator.join()
+		except KeyboardInterrupt:
+			# The workers received the interrupt as well - wait for them to shut down
+			coordinator.join()
+
+		for pid in worker_pids:
+			os.waitpid(pid, 0)
+
+	merged_count = StateDao.merge_shard_logs()
+	print("Merged {} log shards into the log.".format(merged_count))
 
-	DAO = dao
-	if DETECT:
-		IDS = LiveIds(verbose=ARGS.verbose)
 
-	run(server="gevent", host="localhost", port=5000, quiet=(not ARGS.verbose))
+# Shards of a run that didn't shut down cleanly - merged before any new entries arrive
+if StateDao.merge_shard_logs():
+	print("Merged the log shards of a previous run into the log.")
+
+if ARGS.workers == 1:
+	_serve()
+else:
+	_serve_workers(ARGS.workers)
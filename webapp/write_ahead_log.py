@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+""" Write-ahead journal for buffered log entries """
+
+import os
+import re
+import threading
+import time
+
+
+class WriteAheadLog(object):
+	"""
+	Journals log entries before they are buffered in memory, so a crash doesn't lose them.\n
+	Entries go to the current generation, <log file>.wal.<number>. When a batch is taken out of the
+	buffer to be written, rotate() closes the generation that holds exactly this batch. Once the batch
+	is in the log, discard() removes it. Generations left on disk after a crash hold the entries
+	that weren't (completely) written yet.\n
+	Appends are handed to the OS right away, which survives a crash of the process. fsync, which also
+	survives a crash of the host, is called every sync_entries entries, every sync_interval_ms or never.
+	With sync_interval_ms, a timer thread also syncs entries that were appended before a pause.
+	"""
+
+	_SUFFIX = ".wal."
+
+
+	def __init__(self, log_file_path, sync_entries=None, sync_interval_ms=None):
+		""" Ctor """
+
+		object.__init__(self)
+
+		if any([x <= 0 for x in filter(lambda x: x is not None, [sync_entries, sync_interval_ms])]):
+			raise ValueError("All args must be positive valued!")
+
+		self.log_file_path = log_file_path
+
+		self._sync_entries = sync_entries
+		self._sync_interval = sync_interval_ms / 1000.0 if sync_interval_ms is not None else None
+
+		self._number = max(self._get_generation_numbers() or [0]) + 1
+		self._file = None
+		self._unsynced_entries = 0
+		self._last_sync = time.time()
+
+		self._lock = threading.Lock()
+		self._closed = threading.Event()
+
+		if self._sync_interval is not None:
+			timer = threading.Thread(target=self._sync_periodically)
+			timer.daemon = True
+			timer.start()
+
+
+	def append(self, log_entries):
+		""" Journal the given LogEntry objects in the current generation. """
+
+		lines = [e.get_log_string() + "\n" for e in log_entries]
+
+		with self._lock:
+			if self._file is None:
+				self._file = open(self._get_path(self._number), "a")
+
+			self._file.writelines(lines)
+			self._file.flush()
+
+			self._unsynced_entries += len(log_entries)
+			if self._is_sync_due():
+				self._sync()
+
+
+	def rotate(self):
+		"""
+		Close the current generation and start a new one for subsequent entries.
+		returns: The number of the closed generation.
+		"""
+
+		with self._lock:
+			if self._file is not None:
+				if self._unsynced_entries and self._is_sync_configured():
+					self._sync()
+				self._file.close()
+				self._file = None
+
+			self._number += 1
+			return self._number - 1
+
+
+	def discard(self, number):
+		""" Remove the given generation - its entries are in the log. """
+
+		if os.path.lexists(self._get_path(number)):
+			os.remove(self._get_path(number))
+
+
+	def discard_pending(self):
+		""" Remove all closed generations, e.g. after they were recovered. """
+
+		for generation_number in self._get_generation_numbers():
+			if generation_number < self._number:
+				os.remove(self._get_path(generation_number))
+
+
+	def close(self):
+		""" Close the current generation and stop the sync timer. The generation stays on disk until discarded. """
+
+		self._closed.set()
+
+		with self._lock:
+			if self._file is not None:
+				self._file.close()
+				self._file = None
+
+
+	def get_pending_lines(self):
+		"""
+		Return the lines of all generations on disk in order, e.g. for a recovery after a crash.
+		Omits an incomplete last line of each generation.
+		"""
+
+		lines = []
+		for generation_number in sorted(self._get_generation_numbers()):
+			with open(self._get_path(generation_number), "r") as generation_file:
+				lines.extend([l for l in generation_file if l.endswith("\n")])
+
+		return lines
+
+
+	def get_current_number(self):
+		""" Return the number of the current generation. """
+		return self._number
+
+
+	### Helpers ###
+
+
+	def _is_sync_configured(self):
+		return self._sync_entries is not None or self._sync_interval is not None
+
+
+	def _is_sync_due(self):
+		return ((self._sync_entries is not None and self._unsynced_entries >= self._sync_entries)
+			or (self._sync_interval is not None and time.time() >= self._last_sync + self._sync_interval))
+
+
+	def _sync(self):
+		os.fsync(self._file.fileno())
+		self._unsynced_entries = 0
+		self._last_sync = time.time()
+
+
+	def _sync_periodically(self):
+		""" Timer thread: Sync the entries that have waited for sync_interval_ms until closed. """
+
+		while not self._closed.wait(max(self._last_sync + self._sync_interval - time.time(), 0)):
+			with self._lock:
+				if self._file is None or not self._unsynced_entries:
+					# Wait a whole interval for entries appended from now on
+					self._last_sync = time.time()
+				elif self._is_sync_due():
+					self._sync()
+
+
+	def _get_path(self, number):
+		return "{}{}{}".format(self.log_file_path, WriteAheadLog._SUFFIX, number)
+
+
+	def _get_generation_numbers(self):
+		""" Return the numbers of all generations on disk. """
+
+		folder = os.path.dirname(self.log_file_path) or "."
+		if not os.path.lexists(folder):
+			return []
+
+		pattern = re.compile(re.escape(os.path.basename(self.log_file_path) + WriteAheadLog._SUFFIX) + r"(\d+)$")
+		matches = [pattern.match(f) for f in os.listdir(folder)]
+		return [int(m.group(1)) for m in matches if m]